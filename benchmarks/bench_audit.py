@@ -0,0 +1,46 @@
+"""
+Compares the sandbox audit's walk against the `find -writable` that the failsafes used to shell out to, over the
+same tree, and times one of the 16MB write probes that the failsafes then made for every writable directory found.
+The tree defaults to /usr, and can be given as an argument. Run as an unprivileged user to see realistic results,
+as everything is writable to root.
+
+Run from the repository root with: python -m benchmarks.bench_audit
+"""
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from sandbox import audit, info
+
+RUNS = 5
+
+
+def _time(operation) -> float:
+    times = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        operation()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    root = sys.argv[1] if len(sys.argv) > 1 else "/usr"
+
+    def find():
+        subprocess.run(["find", root, "-writable"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    print(f"{'find -writable':20s} {_time(find) * 1000:.1f}ms")
+    for workers in [1, 4, 8]:
+        elapsed = _time(lambda: audit.audit(root, time_budget=3600, workers=workers))
+        print(f"{f'audit, {workers} threads':20s} {elapsed * 1000:.1f}ms")
+
+    with tempfile.TemporaryDirectory() as work:
+        elapsed = _time(lambda: info.write_until_full(f"{work}/test.txt", remove=True))
+    print(f"{'one write probe':20s} {elapsed * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compares the per operation overhead of TimedConnection using the shared deadline scheduler against the
+asyncio.wait_for wrapper it used to use, with 1000 connections running at once. Each operation yields to
+the event loop once, standing in for waiting on a container.
+
+Run from the repository root with: python -m benchmarks.bench_deadlines
+"""
+import asyncio
+import time
+
+from runner.timed_connection import TimedConnection
+from shared.connection import Connection, ConnectionTimedOutError
+
+CONNECTIONS = 1000
+OPERATIONS = 200
+
+
+class _IdleConnection(Connection):
+    def get_prints(self) -> str:
+        return ""
+
+    async def get_next_message_data(self):
+        await asyncio.sleep(0)
+        return "pong"
+
+    async def close(self):
+        pass
+
+    async def send_call(self, method_name, method_args, method_kwargs):
+        await asyncio.sleep(0)
+
+    async def send_ping(self):
+        await asyncio.sleep(0)
+
+
+class _LegacyTimedConnection(TimedConnection):
+    async def _timed(self, operation):
+        start = time.time()
+        try:
+            res = await asyncio.wait_for(operation, self._time_remaining)
+        except asyncio.TimeoutError:
+            raise ConnectionTimedOutError()
+        self._time_remaining -= time.time() - start
+        return res
+
+
+async def _run(make_connection) -> float:
+    connections = [make_connection(_IdleConnection(), 3600) for _ in range(CONNECTIONS)]
+
+    async def drive(connection: Connection):
+        for _ in range(OPERATIONS):
+            await connection.get_next_message_data()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[drive(connection) for connection in connections])
+    return time.perf_counter() - start
+
+
+def main():
+    operations = CONNECTIONS * OPERATIONS
+    baseline = asyncio.run(_run(lambda connection, _: connection))
+    print(f"{'untimed':20s} {operations} operations in {baseline:.3f}s")
+
+    for name, make in [("asyncio.wait_for", _LegacyTimedConnection), ("deadline scheduler", TimedConnection)]:
+        elapsed = asyncio.run(_run(make))
+        overhead = (elapsed - baseline) / operations * 1e6
+        print(f"{name:20s} {operations} operations in {elapsed:.3f}s: {overhead:.2f}us overhead per operation")
+
+
+if __name__ == "__main__":
+    main()
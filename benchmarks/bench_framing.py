@@ -0,0 +1,67 @@
+"""
+Measures how many protocol messages per second MessagePrintConnection can send and receive
+with JSON lines and with binary frames, with a number of prints from a chatty bot between each message.
+
+Run from the repository root with: python -m benchmarks.bench_framing
+"""
+import asyncio
+import time
+from typing import List, Union
+
+import chess
+
+from runner.streams import FramedSplitter
+from shared.framing import Framing
+from shared.message_connection import MessagePrintConnection
+
+MESSAGES = 20_000
+PRINTS_PER_MESSAGE = 3
+FRAME_SIZE = 4096
+
+
+async def _send(framing: Framing, board: chess.Board) -> bytes:
+    out: List[bytes] = []
+
+    def out_handler(data: Union[str, bytes]):
+        out.append(data if isinstance(data, bytes) else (data + "\n").encode())
+
+    sender = MessagePrintConnection(out_handler, name="sender")
+    sender.set_framing(framing)
+    for i in range(MESSAGES):
+        for j in range(PRINTS_PER_MESSAGE):
+            out.append(f"Considering move {j} of turn {i}, evaluation {j * 0.25}\n".encode())
+        await sender.send_result({"board": board, "move": chess.Move.from_uci("e2e4")})
+
+    return b"".join(out)
+
+
+async def _receive(framing: Framing, data: bytes) -> int:
+    async def chunks():
+        for i in range(0, len(data), FRAME_SIZE):
+            yield data[i:i + FRAME_SIZE]
+
+    splitter = FramedSplitter()
+    splitter.set_framing(framing)
+    receiver = MessagePrintConnection(lambda _: None, splitter.items(chunks()), "receiver")
+    receiver.set_framing(framing)
+    for _ in range(MESSAGES):
+        await receiver.get_next_message_data()
+    return len(receiver.get_prints())
+
+
+def main():
+    board = chess.Board()
+    for framing in Framing:
+        start = time.perf_counter()
+        data = asyncio.run(_send(framing, board))
+        sent = time.perf_counter()
+        asyncio.run(_receive(framing, data))
+        received = time.perf_counter()
+
+        print(f"{framing.value:7s} send {MESSAGES / (sent - start):10,.0f} msg/s, "
+              f"receive {MESSAGES / (received - sent):10,.0f} msg/s, "
+              f"round trip {MESSAGES / (received - start):10,.0f} msg/s, {len(data) / MESSAGES:.0f} bytes/msg")
+
+
+if __name__ == "__main__":
+    main()
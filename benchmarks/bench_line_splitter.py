@@ -0,0 +1,74 @@
+"""
+Compares the throughput of runner.streams.LineSplitter against the character by character
+splitter that sandbox.run used to use, over the same container output split into Docker sized frames.
+
+Run from the repository root with: python -m benchmarks.bench_line_splitter
+"""
+import asyncio
+import json
+import time
+from typing import AsyncGenerator, List
+
+from runner.streams import LineSplitter
+
+FRAME_SIZE = 4096
+
+
+async def _legacy_get_lines(strings: AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
+    line = []
+    async for string in strings:
+        if string is None or string == b'' or string == "":
+            continue
+        for char in string:
+            if char == "\r" or char == "\n":
+                if len(line) != 0:
+                    yield "".join(line)
+                line = []
+            else:
+                line.append(char)
+
+    if len(line) != 0:
+        yield "".join(line)
+
+
+def _make_output(lines: int) -> bytes:
+    message = {"__custom_type": "message", "type": "RESULT",
+               "data": {"__custom_type": "chess_move", "uci": "e2e4"}}
+    out = []
+    for i in range(lines):
+        out.append(json.dumps(message) if i % 2 == 0 else f"print number {i} from a chatty bot")
+    return ("\n".join(out) + "\n").encode()
+
+
+def _frames(data: bytes) -> List[bytes]:
+    return [data[i:i + FRAME_SIZE] for i in range(0, len(data), FRAME_SIZE)]
+
+
+async def _legacy(frames: List[bytes]) -> int:
+    async def receive():
+        for frame in frames:
+            yield bytes(frame).decode()
+    return len([line async for line in _legacy_get_lines(receive())])
+
+
+async def _splitter(frames: List[bytes]) -> int:
+    async def receive():
+        for frame in frames:
+            yield frame
+    return len([line async for line in LineSplitter().lines(receive())])
+
+
+def main():
+    frames = _frames(_make_output(200_000))
+    total = sum(len(frame) for frame in frames)
+
+    for name, fn in [("legacy _get_lines", _legacy), ("LineSplitter", _splitter)]:
+        start = time.perf_counter()
+        count = asyncio.run(fn(frames))
+        elapsed = time.perf_counter() - start
+        print(f"{name:20s} {count} lines in {elapsed:.3f}s: "
+              f"{count / elapsed:,.0f} lines/s, {total / elapsed / 1024 ** 2:,.1f} MiB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Compares how long a sandbox takes from starting a game's process to answering its first ping, between a cold
+play.py and a zygote.py client handing the game to a zygote that has already started. A fresh zygote is started,
+untimed, for every game, as each pooled container starts its own.
+
+Run from the repository root with: python -m benchmarks.bench_zygote
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import List
+
+from runner.streams import FramedSplitter
+from shared.message_connection import MessagePrintConnection
+
+GAMES = 20
+
+_SCRIPTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sandbox")
+_ENV = dict(os.environ, PYTHONPATH=os.path.dirname(_SCRIPTS), DEBUG="False")
+
+
+async def _time_to_first_ping(args: List[str]) -> float:
+    start = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(*args, stdin=asyncio.subprocess.PIPE,
+                                                   stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.DEVNULL, env=_ENV)
+
+    async def send(m):
+        process.stdin.write(m if isinstance(m, bytes) else (m + "\n").encode())
+        await process.stdin.drain()
+
+    async def receive():
+        while True:
+            data = await process.stdout.read(4096)
+            if not data:
+                break
+            yield data
+
+    splitter = FramedSplitter()
+    connection = MessagePrintConnection(send, splitter.items(receive()), on_framing=splitter.set_framing)
+    await connection.handshake()
+    elapsed = time.perf_counter() - start
+
+    process.stdin.close()
+    await process.wait()
+    return elapsed
+
+
+async def _cold() -> float:
+    return await _time_to_first_ping([sys.executable, "-u", os.path.join(_SCRIPTS, "play.py")])
+
+
+async def _zygote() -> float:
+    with tempfile.TemporaryDirectory() as work:
+        path = os.path.join(work, "zygote.sock")
+        zygote = await asyncio.create_subprocess_exec(sys.executable, "-u", os.path.join(_SCRIPTS, "zygote.py"),
+                                                      "serve", path, env=_ENV)
+        while not os.path.exists(path):
+            await asyncio.sleep(0.001)
+
+        elapsed = await _time_to_first_ping([sys.executable, "-u", os.path.join(_SCRIPTS, "zygote.py"), path])
+        await zygote.wait()
+        return elapsed
+
+
+async def _run():
+    for name, start_game in [("cold play.py", _cold), ("zygote", _zygote)]:
+        times = [await start_game() for _ in range(GAMES)]
+        print(f"{name:15s} first ping after {statistics.median(times) * 1000:.1f}ms median, "
+              f"{min(times) * 1000:.1f}ms best, over {GAMES} games")
+
+
+def main():
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
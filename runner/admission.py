@@ -0,0 +1,208 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import List, Optional, Tuple
+
+import aiodocker
+from aiodocker import DockerError
+
+from runner import metrics
+from runner.logger import logger
+
+
+class Priority(IntEnum):
+    """Lower values are admitted first"""
+    INTERACTIVE = 0
+    NORMAL = 1
+    BATCH = 2
+
+    @classmethod
+    def from_name(cls, name: str) -> "Priority":
+        return cls[name.upper()]
+
+
+class QueueFullError(RuntimeError):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Game queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    def __init__(self, cpus: float, memory: int):
+        self.cpus = cpus
+        self.memory = memory
+        self.future = asyncio.get_event_loop().create_future()
+        self.queued_at = time.monotonic()
+
+
+class AdmissionController:
+    """
+    Only lets games start while the sandboxes they need fit in the host's CPU and memory budget,
+    queueing the rest by priority and then arrival. Games are admitted strictly in order, so a large
+    game at the head of the queue is never starved by smaller ones behind it. A game that would not
+    fit even on an idle host is admitted once nothing else is running
+    """
+    def __init__(self):
+        self.cpu_budget = math.inf
+        self.memory_budget = math.inf
+        self.sandbox_cpus = 0.0
+        self.sandbox_memory = 0
+        self.max_queue_length = 256
+
+        self._cpus_used = 0.0
+        self._memory_used = 0
+        self._running = 0
+        self._queue: List[Tuple[int, int, _Waiter]] = []
+        self._sequence = itertools.count()
+
+        self._admitted = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._average_hold = 0.0
+
+    async def start(self, docker: aiodocker.Docker, sandbox_cpus: float, sandbox_memory: int,
+                    cpu_budget: Optional[float] = None, memory_budget: Optional[int] = None,
+                    max_queue_length: int = 256, share: float = 1.0):
+        """Sets the reservation for each sandbox and the host budget, which defaults to what the Docker host has.
+        When several processes run games on one host, each is given its share of the budget and queue"""
+        self.sandbox_cpus = float(sandbox_cpus)
+        self.sandbox_memory = int(sandbox_memory)
+        self.max_queue_length = max(1, math.ceil(int(max_queue_length) * share))
+
+        if cpu_budget is None or memory_budget is None:
+            host_cpus, host_memory = await self._host_resources(docker)
+            cpu_budget = host_cpus if cpu_budget is None else cpu_budget
+            memory_budget = host_memory if memory_budget is None else memory_budget
+        self.cpu_budget = float(cpu_budget) * share
+        self.memory_budget = int(int(memory_budget) * share)
+
+        logger.debug(f"Admission control started with {self.cpu_budget} CPUs and {self.memory_budget} bytes, "
+                     f"reserving {self.sandbox_cpus} CPUs and {self.sandbox_memory} bytes per sandbox")
+
+    @staticmethod
+    async def _host_resources(docker: aiodocker.Docker) -> Tuple[float, int]:
+        try:
+            info = await docker.system.info()
+            return float(info["NCPU"]), int(info["MemTotal"])
+        except (DockerError, KeyError):
+            logger.warning("Could not get the Docker host's resources, using the runner's instead")
+            return float(os.cpu_count() or 1), os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def queue_length(self) -> int:
+        return sum(1 for _, _, waiter in self._queue if not waiter.future.done())
+
+    def retry_after(self) -> float:
+        """A rough guess at how long until there is space in the queue, from how long games have been taking"""
+        running = max(self._running, 1)
+        return max(1.0, math.ceil(self._average_hold * (self.queue_length + 1) / running))
+
+    def stats(self) -> dict:
+        return {"running": self._running,
+                "queued": self.queue_length,
+                "max_queue_length": self.max_queue_length,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "average_wait_seconds": self._total_wait / self._admitted if self._admitted else 0.0,
+                "max_wait_seconds": self._max_wait,
+                "average_game_seconds": self._average_hold,
+                "cpus_used": self._cpus_used,
+                "cpu_budget": self.cpu_budget,
+                "memory_used": self._memory_used,
+                "memory_budget": self.memory_budget,
+                "free_sandboxes": self.free_sandboxes()}
+
+    def free_sandboxes(self) -> int:
+        """How many more sandboxes would fit right now"""
+        fits = []
+        if self.sandbox_cpus > 0:
+            fits.append((self.cpu_budget - self._cpus_used) / self.sandbox_cpus)
+        if self.sandbox_memory > 0:
+            fits.append((self.memory_budget - self._memory_used) / self.sandbox_memory)
+        if len(fits) == 0 or math.isinf(min(fits)):
+            return -1
+        return max(0, int(min(fits)))
+
+    @asynccontextmanager
+    async def admit(self, sandboxes: int, priority: Priority = Priority.NORMAL):
+        """Waits until there is room for the given number of sandboxes, holding their reservation until exit.
+        Raises QueueFullError straight away if the game would have to queue and the queue is full"""
+        waiter = _Waiter(self.sandbox_cpus * sandboxes, self.sandbox_memory * sandboxes)
+
+        if self.queue_length == 0 and self._fits(waiter):
+            self._take(waiter)
+        else:
+            if self.queue_length >= self.max_queue_length:
+                self._rejected += 1
+                raise QueueFullError(self.retry_after())
+            heapq.heappush(self._queue, (int(priority), next(self._sequence), waiter))
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                if waiter.future.done() and not waiter.future.cancelled():
+                    # Admitted just as we were cancelled, so give the space back
+                    self._give_back(waiter)
+                else:
+                    # We may have been holding up smaller games behind us
+                    waiter.future.cancel()
+                    self._admit_queued()
+                raise
+
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - start
+            self._average_hold = held if self._average_hold == 0 else 0.9 * self._average_hold + 0.1 * held
+            self._give_back(waiter)
+
+    def _fits(self, waiter: _Waiter) -> bool:
+        if self._running == 0:
+            return True
+        return self._cpus_used + waiter.cpus <= self.cpu_budget \
+            and self._memory_used + waiter.memory <= self.memory_budget
+
+    def _take(self, waiter: _Waiter):
+        self._cpus_used += waiter.cpus
+        self._memory_used += waiter.memory
+        self._running += 1
+
+        wait = time.monotonic() - waiter.queued_at
+        self._admitted += 1
+        self._total_wait += wait
+        self._max_wait = max(self._max_wait, wait)
+
+    def _give_back(self, waiter: _Waiter):
+        self._cpus_used -= waiter.cpus
+        self._memory_used -= waiter.memory
+        self._running -= 1
+        self._admit_queued()
+
+    def _admit_queued(self):
+        while len(self._queue) != 0:
+            _, _, waiter = self._queue[0]
+            if waiter.future.done():
+                # Cancelled while queued
+                heapq.heappop(self._queue)
+                continue
+            if not self._fits(waiter):
+                break
+            heapq.heappop(self._queue)
+            self._take(waiter)
+            waiter.future.set_result(None)
+
+
+controller = AdmissionController()
+
+metrics.Gauge("submission_runner_games_queued", "Games waiting for space to start", lambda: controller.queue_length)
+metrics.Gauge("submission_runner_games_admitted", "Games admitted and not yet finished", lambda: controller.running)
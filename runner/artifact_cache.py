@@ -0,0 +1,128 @@
+import asyncio
+import time
+import traceback
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterator, Optional, Set, Tuple
+
+from runner.logger import logger
+
+
+class Artifact:
+    """Something made once per submission, such as a prepared image or a populated volume"""
+    def __init__(self, name: str, size: int = 0):
+        self.name = name
+        self.size = size
+        self.users = 0
+        self.last_used = time.monotonic()
+
+
+class ArtifactCache:
+    """
+    Reference counted artifacts kept by key, least recently used first. Each artifact is only made once, even if many
+    games ask for it at the same time, and making it carries on if the game that started it is cancelled. An artifact
+    is only removed while nobody is using it, and one being removed is gone before another is made under its name.
+    Background work such as eviction is kept track of, so that stopping waits for it
+    """
+    def __init__(self):
+        self._artifacts: "OrderedDict[str, Artifact]" = OrderedDict()
+        self._making: Dict[str, asyncio.Future] = dict()
+        self._removing: Dict[str, asyncio.Future] = dict()
+        self._background: Set[asyncio.Future] = set()
+
+    def __len__(self) -> int:
+        return len(self._artifacts)
+
+    def items(self) -> Iterator[Tuple[str, Artifact]]:
+        return iter(list(self._artifacts.items()))
+
+    def in_use(self) -> int:
+        return sum(1 for artifact in self._artifacts.values() if artifact.users > 0)
+
+    def total_size(self) -> int:
+        return sum(artifact.size for artifact in self._artifacts.values())
+
+    def adopt(self, key: str, artifact: Artifact):
+        self._artifacts[key] = artifact
+
+    def get(self, key: str) -> Optional[Artifact]:
+        return self._artifacts.get(key)
+
+    async def acquire(self, key: str, make: Callable[[], Awaitable[Artifact]]) -> Tuple[Artifact, bool]:
+        """Gets the artifact for the key, making it if needed, and returns it along with whether it was already made.
+        Every call must be matched by a call to release once the artifact is no longer used"""
+        artifact = self._artifacts.get(key)
+        made = artifact is not None
+        if artifact is None:
+            making = self._making.get(key)
+            if making is None:
+                making = asyncio.ensure_future(self._make(key, make))
+                self._making[key] = making
+                making.add_done_callback(lambda task: self._made(key, task))
+            # Shielded, so that the game that started it being cancelled does not stop it for everyone else
+            artifact = await asyncio.shield(making)
+
+        artifact.users += 1
+        artifact.last_used = time.monotonic()
+        self._artifacts.move_to_end(key)
+        return artifact, made
+
+    async def _make(self, key: str, make: Callable[[], Awaitable[Artifact]]) -> Artifact:
+        removing = self._removing.get(key)
+        if removing is not None:
+            await asyncio.shield(removing)
+        artifact = await make()
+        self._artifacts[key] = artifact
+        return artifact
+
+    def _made(self, key: str, task: asyncio.Future):
+        if self._making.get(key) is task:
+            del self._making[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved in case nobody was left waiting
+
+    def release(self, key: str) -> Optional[Artifact]:
+        artifact = self._artifacts.get(key)
+        if artifact is None:
+            return None
+        artifact.users -= 1
+        artifact.last_used = time.monotonic()
+        return artifact
+
+    def least_recently_used(self) -> Optional[str]:
+        """The key of the least recently used artifact that nobody is using"""
+        return next((key for key, artifact in self._artifacts.items() if artifact.users <= 0), None)
+
+    async def remove(self, key: str, delete: Callable[[Artifact], Awaitable[None]],
+                     unused_for: float = 0.0) -> bool:
+        """Removes the artifact if nobody is using it and nobody has for at least unused_for seconds. This is checked
+        and the artifact forgotten before anything is awaited, so that no game can take it while it is deleted"""
+        artifact = self._artifacts.get(key)
+        if artifact is None or artifact.users > 0 or time.monotonic() - artifact.last_used < unused_for:
+            return False
+        del self._artifacts[key]
+
+        removing = asyncio.get_event_loop().create_future()
+        self._removing[key] = removing
+        try:
+            await delete(artifact)
+        finally:
+            del self._removing[key]
+            removing.set_result(None)
+        return True
+
+    def background(self, coroutine: Awaitable) -> asyncio.Future:
+        """Runs the coroutine in the background, logging any error, until it finishes or the cache is stopped"""
+        task = asyncio.ensure_future(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+        return task
+
+    def _background_done(self, task: asyncio.Future):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("".join(traceback.format_exception(type(task.exception()), task.exception(),
+                                                            task.exception().__traceback__)))
+
+    async def stop(self):
+        """Waits for background work and for anything still being made"""
+        await asyncio.gather(*self._background, *self._making.values(), return_exceptions=True)
@@ -0,0 +1,130 @@
+import asyncio
+from typing import Dict, List, Optional
+
+import aiodocker
+from aiodocker import DockerError
+
+from runner import metrics
+from runner.logger import logger
+from shared.connection import ConnectionNotActiveError, ConnectionTimedOutError
+from shared.message_connection import MessagePrintConnection
+
+_audits = metrics.Counter("submission_runner_sandbox_audits_total",
+                          "Sandbox audits by whether they passed, failed, ran out of time, got no answer, or were "
+                          "already known for the sandbox's image", labels=("outcome",))
+
+
+class UnsafeSandboxError(RuntimeError):
+    """A sandbox has somewhere that a game could write to without limit, so no game is played in it"""
+    def __init__(self, image: str, paths: List[str]):
+        super().__init__(f"Sandboxes from {image} have unbounded writable paths: {', '.join(paths)}")
+        self.image = image
+        self.paths = paths
+
+
+class AuditTimedOutError(UnsafeSandboxError):
+    """A sandbox did not answer its audit in time, so it cannot be shown to be safe and its connection is not used"""
+    def __init__(self, image: str, timeout: float):
+        RuntimeError.__init__(self, f"Sandbox from {image} did not answer its audit within {timeout}s")
+        self.image = image
+        self.paths = []
+
+
+class SandboxAudits:
+    """
+    Checks that a sandbox has nowhere a game could write to without limit, before any submission is imported.
+    Every container made from an image is set up the same way, so each image is audited by the first game to use it
+    and the result is kept by the image's digest. Games wait for an audit already running on their image rather
+    than starting another
+    """
+    def __init__(self):
+        self.enabled = False
+        self.time_budget = 2.0
+        self.timeout = 30.0
+        self._digests: Dict[str, str] = dict()
+        self._results: Dict[str, List[str]] = dict()
+        self._running: Dict[str, asyncio.Future] = dict()
+
+        self.passed = 0
+        self.failed = 0
+        self.incomplete = 0
+        self.cached = 0
+
+    def configure(self, enabled: bool, time_budget_seconds: float, timeout_seconds: float = 30.0):
+        self.enabled = bool(enabled)
+        self.time_budget = float(time_budget_seconds)
+        self.timeout = max(float(timeout_seconds), self.time_budget)
+
+    def stats(self) -> dict:
+        return {"images": len(self._results), "passed": self.passed, "failed": self.failed,
+                "incomplete": self.incomplete, "cached": self.cached}
+
+    async def _digest(self, docker: aiodocker.Docker, image: str) -> str:
+        digest = self._digests.get(image)
+        if digest is None:
+            try:
+                digest = (await docker.images.inspect(image))["Id"]
+            except (DockerError, KeyError):
+                return image  # Audited by name until it can be looked up
+            self._digests[image] = digest
+        return digest
+
+    async def check(self, docker: aiodocker.Docker, image: str, connection: MessagePrintConnection):
+        """Audits the sandbox on the other end of the connection unless its image has been already,
+        raising UnsafeSandboxError if anything could be written to without limit"""
+        digest = await self._digest(docker, image)
+
+        unbounded = self._results.get(digest)
+        if unbounded is not None:
+            self.cached += 1
+            _audits.inc(outcome="cached")
+        elif digest in self._running:
+            unbounded = await asyncio.shield(self._running[digest])
+        if unbounded is None:
+            unbounded = await self._audit(digest, image, connection)
+
+        if unbounded is not None and len(unbounded) != 0:
+            raise UnsafeSandboxError(image, unbounded)
+
+    async def _audit(self, digest: str, image: str, connection: MessagePrintConnection) -> Optional[List[str]]:
+        running = asyncio.get_event_loop().create_future()
+        self._running[digest] = running
+        unbounded = None
+        try:
+            try:
+                # The sandbox starts up before it answers, so this allows for more than the walk itself
+                report = await asyncio.wait_for(connection.audit(self.time_budget), self.timeout)
+            except asyncio.TimeoutError:
+                # Not kept, as the next sandbox may answer. This one's answer would arrive out of turn, so it is
+                # not used for the game
+                self.incomplete += 1
+                _audits.inc(outcome="timeout")
+                logger.warning(f"Sandbox audit of {image} got no answer within {self.timeout}s")
+                raise AuditTimedOutError(image, self.timeout)
+            unbounded = list(report.get("unbounded", []))
+            if len(unbounded) != 0:
+                self.failed += 1
+                _audits.inc(outcome="failed")
+                logger.error(f"Sandbox audit of {image} failed, writable without limit: {unbounded}")
+                self._results[digest] = unbounded
+            elif not report.get("complete", False):
+                # Not kept, so the next game tries again. Games still run rather than being stopped by a slow host
+                self.incomplete += 1
+                _audits.inc(outcome="incomplete")
+                logger.warning(f"Sandbox audit of {image} ran out of time after {report.get('scanned', 0)} entries")
+                unbounded = None
+            else:
+                self.passed += 1
+                _audits.inc(outcome="passed")
+                logger.debug(f"Sandbox audit of {image} passed in {report.get('seconds', 0):.3f}s")
+                self._results[digest] = unbounded
+        except (ConnectionNotActiveError, ConnectionTimedOutError):
+            pass  # Left for the handshake to find
+        finally:
+            running.set_result(unbounded)
+            if self._running.get(digest) is running:
+                del self._running[digest]
+        return unbounded
+
+
+sandbox_audits = SandboxAudits()
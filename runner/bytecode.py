@@ -0,0 +1,114 @@
+import compileall
+import os
+import posixpath
+import py_compile
+import sys
+import tarfile
+import tempfile
+from typing import Optional
+
+from runner.logger import logger
+
+# Where the submission is imported from inside a sandbox, so that tracebacks show the paths the player knows
+SANDBOX_SUBMISSION_DIR = "/home/sandbox/submission"
+
+
+def _safe_path(name: str) -> Optional[str]:
+    path = posixpath.normpath(name)
+    if path.startswith("/") or path == ".." or path.startswith("../"):
+        return None
+    return path
+
+
+def _compile(submission_path: str, archive_path: str):
+    with tempfile.TemporaryDirectory() as work:
+        source_dir = os.path.join(work, "submission")
+        os.mkdir(source_dir)
+
+        # Only the Python sources are needed, everything else is shipped from the submission itself
+        with tarfile.open(submission_path, mode='r|') as submission:
+            for member in submission:
+                path = _safe_path(member.name)
+                if not member.isfile() or not member.name.endswith(".py") or path is None:
+                    continue
+                target = os.path.join(source_dir, path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with submission.extractfile(member) as data, open(target, "wb") as out:
+                    out.write(data.read())
+
+        # Checked against a hash of the source rather than its modification time, which the copy does not keep.
+        # Files that do not compile are skipped, and fail on import in the sandbox as they always have
+        compileall.compile_dir(source_dir, ddir=SANDBOX_SUBMISSION_DIR, quiet=2, workers=1,
+                               invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH)
+
+        # Written alongside then moved into place, so that a game never sees half an archive
+        handle, partial_path = tempfile.mkstemp(dir=os.path.dirname(archive_path), suffix=".partial")
+        os.close(handle)
+        try:
+            with tarfile.open(partial_path, mode='w') as archive:
+                for directory, _, files in os.walk(source_dir):
+                    if os.path.basename(directory) != "__pycache__":
+                        continue
+                    relative = os.path.relpath(directory, source_dir)
+                    archive.add(directory, arcname=relative, recursive=False)
+                    for name in sorted(files):
+                        archive.add(os.path.join(directory, name), arcname=posixpath.join(relative, name))
+            os.replace(partial_path, archive_path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+
+def _evict(cache_dir: str, max_bytes: int, keep: str):
+    """Removes the least recently used archives until the cache fits in max_bytes, other than the one just made"""
+    archives = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".tar"):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stats = os.stat(path)
+        except OSError:
+            continue  # Evicted by another process
+        archives.append((stats.st_mtime, stats.st_size, path))
+
+    total = sum(size for _, size, _ in archives)
+    for _, size, path in sorted(archives):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        logger.debug(f"Evicted precompiled submission {os.path.basename(path)}")
+
+
+def compiled_archive(submission_hash: str, submission_path: str, cache_dir: str,
+                     max_bytes: int = 256 * 1024 ** 2) -> Optional[str]:
+    """
+    Gets an archive of the bytecode for every Python file in a submission, laid out as in the submission, compiling
+    it the first time it is asked for. The bytecode is made by this interpreter, so is only used by sandboxes running
+    the same Python version, which otherwise compile the sources as they import them. Returns None if it cannot be made.
+    Archives are kept in cache_dir, which is kept under max_bytes by removing the least recently used
+    """
+    archive_path = os.path.join(cache_dir, f"{submission_hash}.{sys.implementation.cache_tag}.tar")
+    try:
+        # Marked as used, so that it is evicted last
+        os.utime(archive_path)
+        return archive_path
+    except OSError:
+        pass
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        _compile(submission_path, archive_path)
+        _evict(cache_dir, max_bytes, archive_path)
+    except (OSError, tarfile.TarError) as e:
+        logger.warning(f"Could not precompile submission {submission_hash}: {e!r}")
+        return None
+
+    logger.debug(f"Precompiled submission {submission_hash}")
+    return archive_path
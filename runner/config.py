@@ -6,3 +6,9 @@ with open("/run/secrets/secret_key") as secrets_file:
 
 DEBUG = config_file.get("debug")
 PROFILE = config_file.get("profile")
+
+
+def get_option(key: str, default=None):
+    """Gets a value from the config file, falling back to the default given if it has not been set"""
+    value = config_file.get(key)
+    return default if value is None else value
@@ -0,0 +1,146 @@
+import asyncio
+import time
+import traceback
+from collections import deque
+from typing import Awaitable, Callable, Deque, Optional, List
+
+import aiodocker
+from aiodocker import DockerError
+
+from runner.logger import logger
+from runner.reaper import reaper
+
+
+class _PooledContainer:
+    def __init__(self, container: aiodocker.docker.DockerContainer):
+        self.container = container
+        self.created = time.monotonic()
+
+
+class ContainerPool:
+    """
+    Keeps a number of sandbox containers already created, started and loaded with the sandbox scripts
+    so that a game only has to copy its submission in before starting.
+    The pool refills itself in the background, and idle members are health checked and recycled
+    """
+    def __init__(self, factory: Callable[[aiodocker.Docker], Awaitable[aiodocker.docker.DockerContainer]]):
+        self._factory = factory
+        self._size = 0
+        self._max_idle = 0.0
+        self._health_check_interval = 0.0
+
+        self._docker: Optional[aiodocker.Docker] = None
+        self._idle: Deque[_PooledContainer] = deque()
+        self._pending = 0
+        self._refill_needed: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def enabled(self) -> bool:
+        return self._size > 0 and self._docker is not None
+
+    @property
+    def idle_count(self) -> int:
+        return len(self._idle)
+
+    async def start(self, docker: aiodocker.Docker, size: int, max_idle_seconds: float, health_check_seconds: float):
+        self._size = int(size)
+        self._max_idle = float(max_idle_seconds)
+        self._health_check_interval = float(health_check_seconds)
+        if self._size <= 0:
+            logger.debug("Container pool disabled")
+            return
+
+        logger.debug(f"Starting container pool of size {self._size}")
+        self._docker = docker
+        self._refill_needed = asyncio.Event()
+        self._refill_needed.set()
+        self._tasks = [asyncio.create_task(self._refill_loop()),
+                       asyncio.create_task(self._health_loop())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        idle = list(self._idle)
+        self._idle.clear()
+        await asyncio.gather(*[self._discard(member) for member in idle], return_exceptions=True)
+        self._docker = None
+
+    def take(self) -> Optional[aiodocker.docker.DockerContainer]:
+        """Hands out a ready container, or None if the pool is disabled or currently empty.
+        The caller becomes responsible for deleting the container"""
+        if not self.enabled:
+            return None
+
+        self._refill_needed.set()
+        if len(self._idle) == 0:
+            logger.debug("Container pool empty")
+            return None
+
+        member = self._idle.popleft()
+        logger.debug(f"Container {member.container.id}: taken from pool")
+        return member.container
+
+    async def _create_member(self):
+        try:
+            container = await self._factory(self._docker)
+        except Exception:
+            logger.error(traceback.format_exc())
+            return False
+        finally:
+            self._pending -= 1
+
+        self._idle.append(_PooledContainer(container))
+        logger.debug(f"Container {container.id}: added to pool")
+        return True
+
+    async def _refill_loop(self):
+        while True:
+            await self._refill_needed.wait()
+            self._refill_needed.clear()
+
+            missing = self._size - len(self._idle) - self._pending
+            if missing <= 0:
+                continue
+
+            self._pending += missing
+            try:
+                created = await asyncio.gather(*[self._create_member() for _ in range(missing)])
+            except Exception:
+                # Keep refilling, the pool is no use to anyone once this loop stops
+                logger.error(traceback.format_exc())
+                created = [False]
+            if not all(created):
+                # Back off before retrying, Docker is probably struggling
+                await asyncio.sleep(self._health_check_interval)
+                self._refill_needed.set()
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self._health_check_interval)
+
+            now = time.monotonic()
+            for member in list(self._idle):
+                if now - member.created > self._max_idle or not await self._is_healthy(member):
+                    try:
+                        self._idle.remove(member)
+                    except ValueError:
+                        continue  # Taken while we were checking
+                    logger.debug(f"Container {member.container.id}: recycling pool member")
+                    await self._discard(member)
+                    self._refill_needed.set()
+
+    @staticmethod
+    async def _is_healthy(member: _PooledContainer) -> bool:
+        try:
+            info = await member.container.show()
+        except DockerError:
+            return False
+        return bool(info.get("State", {}).get("Running", False))
+
+    @staticmethod
+    async def _discard(member: _PooledContainer):
+        await reaper.delete(member.container)
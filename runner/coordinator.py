@@ -0,0 +1,296 @@
+import asyncio
+import bisect
+import hashlib
+import json
+import time
+import traceback
+from typing import Callable, Dict, Iterator, List, Optional
+
+import aiohttp
+from cuwais.gamemodes import Gamemode
+
+from runner.admission import Priority, QueueFullError
+from runner.logger import logger
+from runner.results import ParsedResult
+
+
+class RemoteGameError(RuntimeError):
+    """A runner node turned down or failed a game in a way that trying another node would not fix"""
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+class _NodeLostError(RuntimeError):
+    pass
+
+
+# The statuses a node answers with when it, or a proxy in front of it, could not get to the game at all,
+# so that another node might. Any other error is the game's own and is passed back
+_FAILOVER_STATUSES = {502, 503, 504}
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hashing of keys onto nodes. Each node is placed at many points on the ring, and a key belongs to
+    the first node after it, so adding or losing a node only moves the keys of that node
+    """
+    def __init__(self, replicas: int = 64):
+        self.replicas = replicas
+        self._points: List[int] = []
+        self._owners: List[str] = []
+
+    def add(self, node: str):
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node: str):
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def walk(self, key: str) -> Iterator[str]:
+        """Every node once, starting with the owner of the key and going round the ring"""
+        if len(self._points) == 0:
+            return
+        start = bisect.bisect(self._points, _hash(key))
+        seen = set()
+        for i in range(len(self._points)):
+            owner = self._owners[(start + i) % len(self._points)]
+            if owner not in seen:
+                seen.add(owner)
+                yield owner
+
+
+class Node:
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.healthy = True
+        self.free_sandboxes = -1
+        self.queued = 0
+        self.in_flight = 0
+        self.in_flight_at_poll = 0
+        self.last_seen: Optional[float] = None
+        self.failures = 0
+        self.games = 0
+
+    def has_room(self, sandboxes: int) -> bool:
+        """Whether the node had room for this many more sandboxes when it last said, less the games sent since"""
+        if self.free_sandboxes < 0:
+            return True
+        sent = max(0, self.in_flight - self.in_flight_at_poll)
+        return self.free_sandboxes - sent * sandboxes >= sandboxes
+
+    def as_dict(self) -> dict:
+        return {"url": self.url, "healthy": self.healthy, "free_sandboxes": self.free_sandboxes,
+                "queued": self.queued, "in_flight": self.in_flight, "last_seen": self.last_seen,
+                "failures": self.failures, "games": self.games}
+
+
+class Coordinator:
+    """
+    Spreads games over several runner nodes. Games are routed by consistent hashing on their submission hashes,
+    so the same node keeps getting the same submissions and its prepared images, volumes and warm pool stay useful.
+    Nodes are polled for the capacity they advertise on /status, a full node passes its games on to the next node
+    round the ring, and a lost node's games are retried elsewhere, up to a limit on the nodes tried per game
+    """
+    def __init__(self):
+        self._nodes: Dict[str, Node] = dict()
+        self._ring = HashRing()
+        self._poll_interval = 2.0
+        self._max_attempts = 3
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._poll_task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return len(self._nodes) != 0
+
+    def stats(self) -> dict:
+        return {"nodes": [node.as_dict() for node in self._nodes.values()]}
+
+    async def start(self, urls: List[str], poll_interval_seconds: float = 2.0, replicas: int = 64,
+                    connect_timeout_seconds: float = 5.0, max_attempts: int = 3):
+        self._poll_interval = float(poll_interval_seconds)
+        self._max_attempts = max(1, int(max_attempts))
+        self._ring = HashRing(int(replicas))
+        self._nodes = dict()
+        for url in urls:
+            node = Node(url)
+            self._nodes[node.url] = node
+            self._ring.add(node.url)
+
+        # Games can run for a long time, so only connecting is timed
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=float(connect_timeout_seconds))
+        self._session = aiohttp.ClientSession(timeout=timeout)
+
+        await self.poll()
+        self._poll_task = asyncio.create_task(self._poll_loop())
+        logger.debug(f"Coordinating {len(self._nodes)} runner nodes")
+
+    async def stop(self):
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            await asyncio.gather(self._poll_task, return_exceptions=True)
+            self._poll_task = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.sleep(self._poll_interval)
+            await self.poll()
+
+    async def poll(self):
+        await asyncio.gather(*[self._poll_node(node) for node in self._nodes.values()])
+
+    async def _poll_node(self, node: Node):
+        try:
+            timeout = aiohttp.ClientTimeout(total=self._poll_interval)
+            async with self._session.get(f"{node.url}/status", timeout=timeout) as response:
+                response.raise_for_status()
+                status = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            if node.healthy:
+                logger.warning(f"Lost runner node {node.url}: {e!r}")
+            node.healthy = False
+            return
+
+        if not node.healthy:
+            logger.warning(f"Runner node {node.url} is back")
+        admission = status.get("admission", {})
+        node.healthy = True
+        node.free_sandboxes = int(admission.get("free_sandboxes", -1))
+        node.queued = int(admission.get("queued", 0))
+        node.in_flight_at_poll = node.in_flight
+        node.last_seen = time.time()
+
+    def free_sandboxes(self) -> int:
+        """How many more sandboxes the reachable nodes had room for when they last said, or -1 if any has no limit"""
+        healthy = [node for node in self._nodes.values() if node.healthy]
+        if any(node.free_sandboxes < 0 for node in healthy):
+            return -1
+        return sum(node.free_sandboxes for node in healthy)
+
+    def candidates(self, submissions: List[str]) -> List[Node]:
+        """The nodes to try for a game, best first. Each submission's owner on the ring comes first, then the rest
+        of the ring after the first submission. Nodes with room come before full ones, and lost nodes come last"""
+        needed = max(1, len(submissions))
+        order: List[str] = []
+        for submission in submissions:
+            for url in self._ring.walk(submission):
+                if self._nodes[url].healthy:
+                    if url not in order:
+                        order.append(url)
+                    break
+        for url in self._ring.walk(submissions[0] if len(submissions) != 0 else ""):
+            if url not in order:
+                order.append(url)
+
+        nodes = [self._nodes[url] for url in order]
+        # Sorting is stable, so ring order is kept within each group
+        return sorted(nodes, key=lambda node: (not node.healthy, not node.has_room(needed)))
+
+    async def run(self, gamemode: Gamemode, submission_hashes: List[str], options: Optional[dict] = None,
+                  turns: int = 2 << 32, priority: Priority = Priority.NORMAL,
+                  listener: Optional[Callable[[dict], None]] = None, trace: bool = False,
+                  deterministic: bool = False) -> ParsedResult:
+        """Runs a game on a runner node, taking the same arguments as gamemode_runner.run. With a listener the game
+        is streamed from the node and only the submission results are returned. Whether the submissions are
+        deterministic is passed on, so that the node can cache the result"""
+        params = {"submissions": json.dumps(submission_hashes), "options": json.dumps(options or {}),
+                  "gamemode": gamemode.name, "moves": str(turns), "priority": priority.name.lower()}
+        if trace:
+            params["trace"] = "true"
+        if deterministic:
+            params["deterministic"] = "true"
+
+        retry_after: Optional[float] = None
+        for node in self.candidates(submission_hashes)[:self._max_attempts]:
+            state = {"started": False}
+            node.in_flight += 1
+            try:
+                if listener is None:
+                    result = await self._run_on(node, params)
+                else:
+                    result = await self._stream_from(node, params, listener, state)
+            except QueueFullError as e:
+                retry_after = e.retry_after if retry_after is None else min(retry_after, e.retry_after)
+                continue
+            except _NodeLostError as e:
+                logger.warning(f"Runner node {node.url} failed a game: {e}")
+                node.healthy = False
+                node.failures += 1
+                if state["started"]:
+                    # The moves so far have already been sent on, so the game cannot be quietly started over
+                    raise RemoteGameError(502, f"Runner node lost mid-game: {e}")
+                continue
+            finally:
+                node.in_flight -= 1
+            node.games += 1
+            return result
+
+        if retry_after is not None:
+            raise QueueFullError(retry_after)
+        raise RemoteGameError(503, f"No runner node could take the game in {self._max_attempts} attempts")
+
+    @staticmethod
+    async def _check(response: aiohttp.ClientResponse):
+        if response.status == 429:
+            raise QueueFullError(float(response.headers.get("Retry-After", 1)))
+        if response.status in _FAILOVER_STATUSES:
+            raise _NodeLostError(f"status {response.status}")
+        if response.status >= 400:
+            try:
+                detail = (await response.json()).get("detail", response.reason)
+            except (aiohttp.ClientError, ValueError):
+                detail = response.reason
+            raise RemoteGameError(response.status, str(detail))
+
+    async def _run_on(self, node: Node, params: dict) -> ParsedResult:
+        try:
+            async with self._session.get(f"{node.url}/run", params=params) as response:
+                await self._check(response)
+                return ParsedResult.from_dict(await response.json())
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise _NodeLostError(repr(e))
+
+    async def _stream_from(self, node: Node, params: dict, listener: Callable[[dict], None],
+                           state: dict) -> ParsedResult:
+        # Only the submission results come at the end of a stream, so the recording is rebuilt from its events
+        initial_board = ""
+        moves: List[str] = []
+        try:
+            async with self._session.get(f"{node.url}/run/stream", params={**params, "format": "ndjson"}) as response:
+                await self._check(response)
+                async for line in response.content:
+                    if len(line.strip()) == 0:
+                        continue
+                    event = json.loads(line)
+                    if event["type"] == "result":
+                        return ParsedResult.from_dict({"recording": {"initial_board": initial_board, "moves": moves},
+                                                       "submission_results": event["submission_results"]})
+                    if event["type"] == "error":
+                        raise RemoteGameError(502, event.get("error", "Game failed on runner node"))
+                    if event["type"] == "start":
+                        initial_board = event.get("initial_board", "")
+                    elif event["type"] == "move":
+                        moves.append(event["move"])
+                    state["started"] = True
+                    listener(event)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as e:
+            logger.debug(traceback.format_exc())
+            raise _NodeLostError(repr(e))
+        raise _NodeLostError("stream ended without a result")
+
+
+coordinator = Coordinator()
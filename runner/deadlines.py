@@ -0,0 +1,88 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import List, Optional, Tuple
+
+
+class Deadline:
+    """A pending deadline for a task, to be passed to DeadlineScheduler.cancel once the task no longer needs timing"""
+    __slots__ = ("when", "task", "expired", "cancelled")
+
+    def __init__(self, when: float, task: asyncio.Task):
+        self.when = when
+        self.task = task
+        self.expired = False
+        self.cancelled = False
+
+
+class DeadlineScheduler:
+    """
+    Times out many tasks with a single event loop timer. Deadlines are kept in a heap on the monotonic clock
+    and the loop timer is only ever set for the earliest. When a deadline passes its task is cancelled
+    directly, so no extra task or timer is made per timed operation as with asyncio.wait_for
+    """
+    def __init__(self):
+        self._heap: List[Tuple[float, int, Deadline]] = []
+        self._sequence = itertools.count()
+        self._cancelled = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_when = float("inf")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def __len__(self):
+        return len(self._heap) - self._cancelled
+
+    def schedule(self, when: float, task: asyncio.Task) -> Deadline:
+        """Cancels the task at the given time.monotonic() time unless the returned deadline is cancelled first"""
+        deadline = Deadline(when, task)
+        heapq.heappush(self._heap, (when, next(self._sequence), deadline))
+
+        loop = task.get_loop()
+        if loop is not self._loop:
+            # Timers belong to a loop, so start afresh if the loop has changed
+            self._loop = loop
+            self._timer_when = float("inf")
+        if when < self._timer_when:
+            self._set_timer(when)
+        return deadline
+
+    def cancel(self, deadline: Deadline):
+        if deadline.cancelled or deadline.expired:
+            return
+        deadline.cancelled = True
+        self._cancelled += 1
+
+        # Finished operations leave their deadlines behind, tidy up once they are most of the heap
+        if self._cancelled > 64 and self._cancelled * 2 > len(self._heap):
+            self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled = 0
+
+    def _set_timer(self, when: float):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_when = when
+        # The loop's clock is monotonic too, but may not be time.monotonic itself
+        delay = max(0.0, when - time.monotonic())
+        self._timer = self._loop.call_at(self._loop.time() + delay, self._fire)
+
+    def _fire(self):
+        self._timer = None
+        self._timer_when = float("inf")
+
+        now = time.monotonic()
+        heap = self._heap
+        while len(heap) != 0 and (heap[0][2].cancelled or heap[0][0] <= now):
+            _, _, deadline = heapq.heappop(heap)
+            if deadline.cancelled:
+                self._cancelled -= 1
+                continue
+            deadline.expired = True
+            deadline.task.cancel()
+
+        if len(heap) != 0:
+            self._set_timer(heap[0][0])
+
+
+scheduler = DeadlineScheduler()
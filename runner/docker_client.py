@@ -0,0 +1,95 @@
+import os
+import re
+import time
+from types import SimpleNamespace
+from typing import Dict, Optional, Tuple
+
+import aiodocker
+import aiohttp
+
+from runner.logger import logger
+
+
+class DockerCallStats:
+    """Counts the Docker API calls made through the shared client, and how many are in flight"""
+    def __init__(self):
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.calls_by_method: Dict[str, int] = dict()
+
+    def make_trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_request_end.append(self._on_request_end)
+        trace_config.on_request_exception.append(self._on_request_exception)
+        return trace_config
+
+    def as_dict(self) -> dict:
+        return {"in_flight": self.in_flight, "peak_in_flight": self.peak_in_flight, "calls": self.calls,
+                "errors": self.errors, "total_seconds": self.total_seconds,
+                "calls_by_method": dict(self.calls_by_method)}
+
+    async def _on_request_start(self, session, context: SimpleNamespace, params: aiohttp.TraceRequestStartParams):
+        context.start = time.monotonic()
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        self.calls += 1
+        self.calls_by_method[params.method] = self.calls_by_method.get(params.method, 0) + 1
+
+    async def _on_request_end(self, session, context: SimpleNamespace, params: aiohttp.TraceRequestEndParams):
+        self._finish(context)
+        if params.response.status >= 400:
+            self.errors += 1
+
+    async def _on_request_exception(self, session, context: SimpleNamespace,
+                                    params: aiohttp.TraceRequestExceptionParams):
+        self._finish(context)
+        self.errors += 1
+
+    def _finish(self, context: SimpleNamespace):
+        self.in_flight -= 1
+        self.total_seconds += time.monotonic() - context.start
+
+
+_docker: Optional[aiodocker.Docker] = None
+_stats = DockerCallStats()
+
+
+def _make_connector(max_connections: int) -> Tuple[str, aiohttp.BaseConnector]:
+    # Mirrors how aiodocker finds the daemon, but with a bounded connection pool
+    docker_host = os.environ.get("DOCKER_HOST", "unix:///var/run/docker.sock")
+    if docker_host.startswith("unix://"):
+        return "unix://localhost", aiohttp.UnixConnector(docker_host[len("unix://"):], limit=max_connections)
+
+    url = re.sub("^tcp://", "http://", docker_host)
+    return url, aiohttp.TCPConnector(limit=max_connections)
+
+
+async def start(max_connections: int):
+    """Opens the Docker API client shared by every game.
+    Each running sandbox holds one connection for its exec stream, so the limit should allow for that"""
+    global _docker
+    url, connector = _make_connector(max_connections)
+    session = aiohttp.ClientSession(connector=connector, trace_configs=[_stats.make_trace_config()])
+    _docker = aiodocker.Docker(url=url, connector=connector, session=session)
+    logger.debug(f"Docker client connected to {url} with up to {max_connections} connections")
+
+
+async def stop():
+    global _docker
+    if _docker is not None:
+        await _docker.close()
+        _docker = None
+
+
+def get() -> aiodocker.Docker:
+    if _docker is None:
+        raise RuntimeError("The Docker client has not been started")
+    return _docker
+
+
+def stats() -> dict:
+    return _stats.as_dict()
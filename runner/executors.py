@@ -0,0 +1,333 @@
+import asyncio
+import itertools
+import json
+import multiprocessing
+import traceback
+from multiprocessing.connection import Connection
+from typing import Callable, Dict, List, Optional
+
+from cuwais.gamemodes import Gamemode
+
+from runner import gamemode_runner, sandbox, docker_client, admission, metrics, spectators
+from runner.audits import sandbox_audits
+from runner.admission import Priority, QueueFullError
+from runner.config import get_option
+from runner.logger import logger
+from runner.reaper import reaper
+from runner.results import ParsedResult
+from shared.message_connection import Encoder
+
+
+async def start_local(runner_id: str, admission_share: float = 1.0):
+    """Starts everything needed to run games in this process, given its share of the host's capacity"""
+    await docker_client.start(max_connections=int(get_option("submission_runner.docker_max_connections", 256)))
+    await reaper.start(docker_client.get(), runner_id=runner_id,
+                       batch_size=int(get_option("submission_runner.reaper_batch_size", 16)),
+                       orphan_interval_seconds=float(get_option("submission_runner.reaper_interval_seconds", 60)))
+    await sandbox.start_provisioning(owner=reaper.runner_id, share=admission_share)
+    sandbox_cpus, sandbox_memory = sandbox.sandbox_reservation()
+    await admission.controller.start(docker_client.get(), sandbox_cpus, sandbox_memory,
+                                     cpu_budget=get_option("submission_runner.cpu_budget"),
+                                     memory_budget=get_option("submission_runner.memory_budget_bytes"),
+                                     max_queue_length=int(get_option("submission_runner.max_queue_length", 256)),
+                                     share=admission_share)
+
+
+async def stop_local():
+    await sandbox.stop_provisioning()
+    await reaper.stop()
+    await docker_client.stop()
+
+
+def local_stats() -> dict:
+    return {"admission": admission.controller.stats(), "docker": docker_client.stats(), "reaper": reaper.stats(),
+            "audits": sandbox_audits.stats()}
+
+
+class ExecutorLostError(RuntimeError):
+    pass
+
+
+class _PendingGame:
+    def __init__(self, listener: Optional[Callable[[dict], None]], hub_game_id: str):
+        self.future = asyncio.get_event_loop().create_future()
+        self.listener = listener
+        self.hub_game_id = hub_game_id
+
+
+class _Executor:
+    def __init__(self, index: int, process: multiprocessing.Process, connection: Connection):
+        self.index = index
+        self.process = process
+        self.connection = connection
+        self.ready = asyncio.get_event_loop().create_future()
+        self.games: Dict[int, _PendingGame] = dict()
+        self.requests: Dict[int, asyncio.Future] = dict()
+        self.dispatched = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.ready.done() and not self.ready.cancelled() and self.ready.exception() is None
+
+
+class ExecutorPool:
+    """
+    Runs games in a pool of executor processes, so that the per move work of many games is spread over every core
+    rather than sharing this process's event loop. Each executor runs its own Docker client, reaper and admission
+    controller, with an equal share of the host's budget. Games go to the executor with the fewest running, and
+    their events and results are relayed back over a pipe. An executor that dies fails its games and is replaced
+    """
+    def __init__(self):
+        self._executors: List[Optional[_Executor]] = []
+        self._runner_id = ""
+        self._game_ids = itertools.count()
+        self._request_ids = itertools.count()
+        self._stopping = False
+
+    @property
+    def enabled(self) -> bool:
+        return len(self._executors) != 0
+
+    async def start(self, processes: int, runner_id: str):
+        self._runner_id = str(runner_id)
+        self._stopping = False
+        self._executors = [None] * int(processes)
+        await asyncio.gather(*[self._launch(index) for index in range(len(self._executors))])
+        logger.debug(f"Started {len(self._executors)} game executors")
+
+    async def stop(self):
+        self._stopping = True
+        executors = [executor for executor in self._executors if executor is not None]
+        for executor in executors:
+            self._send(executor, ("stop",))
+
+        # Executors finish their games and tear down before exiting
+        loop = asyncio.get_event_loop()
+        await asyncio.gather(*[loop.run_in_executor(None, executor.process.join, 60) for executor in executors])
+        for executor in executors:
+            if executor.process.is_alive():
+                executor.process.terminate()
+            self._lost(executor)
+        self._executors = []
+
+    async def _launch(self, index: int):
+        # Each executor labels its sandboxes with its own ID, so that they do not reap each other's
+        context = multiprocessing.get_context("spawn")
+        parent_connection, child_connection = context.Pipe()
+        process = context.Process(target=_executor_main, name=f"executor-{index}", daemon=True,
+                                  args=(child_connection, f"{self._runner_id}-{index}", 1 / len(self._executors)))
+        process.start()
+        child_connection.close()
+
+        executor = _Executor(index, process, parent_connection)
+        self._executors[index] = executor
+        asyncio.get_event_loop().add_reader(parent_connection.fileno(), self._receive, executor)
+        await executor.ready
+
+    def _send(self, executor: _Executor, message: tuple):
+        try:
+            executor.connection.send(message)
+        except (OSError, ValueError):
+            self._lost(executor)
+
+    def _receive(self, executor: _Executor):
+        try:
+            while executor.connection.poll():
+                self._handle(executor, executor.connection.recv())
+        except (EOFError, OSError):
+            self._lost(executor)
+
+    def _handle(self, executor: _Executor, message: tuple):
+        kind = message[0]
+        if kind == "ready":
+            executor.ready.set_result(None)
+            return
+        if kind in ("stats", "metrics"):
+            request = executor.requests.pop(message[1], None)
+            if request is not None and not request.done():
+                request.set_result(message[2])
+            return
+
+        game = executor.games.get(message[1])
+        if game is None:
+            return
+        if kind == "event":
+            event = json.loads(message[2])
+            if event["type"] == "start":
+                event["game_id"] = game.hub_game_id
+            spectators.hub.publish(game.hub_game_id, event)
+            if game.listener is not None:
+                game.listener(event)
+        elif kind == "result":
+            del executor.games[message[1]]
+            game.future.set_result(ParsedResult.from_dict(json.loads(message[2])))
+        elif kind == "queue_full":
+            del executor.games[message[1]]
+            game.future.set_exception(QueueFullError(message[2]))
+        elif kind == "error":
+            del executor.games[message[1]]
+            game.future.set_exception(RuntimeError(message[2]))
+
+    def _lost(self, executor: _Executor):
+        if self._executors[executor.index] is not executor:
+            return
+        self._executors[executor.index] = None
+        loop = asyncio.get_event_loop()
+        loop.remove_reader(executor.connection.fileno())
+        executor.connection.close()
+
+        error = ExecutorLostError(f"Game executor {executor.index} exited")
+        if not executor.ready.done():
+            executor.ready.set_exception(error)
+        for game in executor.games.values():
+            if not game.future.done():
+                game.future.set_exception(error)
+        for request in executor.requests.values():
+            if not request.done():
+                request.set_exception(error)
+
+        if not self._stopping:
+            logger.error(f"Game executor {executor.index} exited, replacing it")
+            asyncio.ensure_future(self._relaunch(executor.index))
+
+    async def _relaunch(self, index: int):
+        # Wait a little so that an executor failing at startup is not restarted in a tight loop
+        await asyncio.sleep(1)
+        try:
+            await self._launch(index)
+        except ExecutorLostError:
+            pass  # Already being replaced again
+
+    def _least_loaded(self) -> _Executor:
+        executors = [executor for executor in self._executors if executor is not None and executor.alive]
+        if len(executors) == 0:
+            raise ExecutorLostError("No game executors are running")
+        return min(executors, key=lambda executor: (len(executor.games), executor.dispatched))
+
+    async def run(self, gamemode: Gamemode, submission_hashes: List[str], options: Optional[dict] = None,
+                  turns: int = 2 << 32, priority: Priority = Priority.NORMAL,
+                  listener: Optional[Callable[[dict], None]] = None, trace: bool = False) -> ParsedResult:
+        """Runs a game on the least loaded executor, taking the same arguments as gamemode_runner.run"""
+        executor = self._least_loaded()
+        game_id = next(self._game_ids)
+        game = _PendingGame(listener, spectators.hub.open_game(gamemode.name, submission_hashes))
+        executor.games[game_id] = game
+        executor.dispatched += 1
+
+        # Game metrics are recorded by the executor, and added in when /metrics is rendered
+        last_event = {"type": "error", "error": "The game could not be completed"}
+        try:
+            self._send(executor, ("run", game_id, gamemode.name, list(submission_hashes), options or {},
+                                  turns, int(priority), trace))
+            try:
+                parsed_result = await game.future
+            except asyncio.CancelledError:
+                executor.games.pop(game_id, None)
+                self._send(executor, ("cancel", game_id))
+                raise
+            last_event = {"type": "result", "submission_results": parsed_result["submission_results"]}
+        finally:
+            spectators.hub.close_game(game.hub_game_id, last_event)
+
+        return parsed_result
+
+    async def _request(self, executor: _Executor, kind: str):
+        """Asks an executor for something about itself, waiting for its answer"""
+        request_id = next(self._request_ids)
+        request = asyncio.get_event_loop().create_future()
+        executor.requests[request_id] = request
+        self._send(executor, (kind, request_id))
+        try:
+            return await asyncio.wait_for(request, 5)
+        finally:
+            executor.requests.pop(request_id, None)
+
+    async def _ask_all(self, kind: str) -> list:
+        executors = [executor for executor in self._executors if executor is not None and executor.alive]
+        results = await asyncio.gather(*[self._request(executor, kind) for executor in executors],
+                                       return_exceptions=True)
+        return [result for result in results if isinstance(result, dict)]
+
+    async def stats(self) -> dict:
+        """The stats of every executor, with their admission stats added up as if they were one runner"""
+        each = await self._ask_all("stats")
+
+        totals = dict()
+        for key in ["running", "queued", "max_queue_length", "admitted", "rejected", "cpus_used", "cpu_budget",
+                    "memory_used", "memory_budget", "free_sandboxes"]:
+            totals[key] = sum(stats["admission"][key] for stats in each)
+        if any(stats["admission"]["free_sandboxes"] < 0 for stats in each):
+            totals["free_sandboxes"] = -1
+
+        return {"admission": totals, "executors": each}
+
+    async def metrics(self) -> List[dict]:
+        """A snapshot of every executor's metrics, to be added to this process's when rendering"""
+        return await self._ask_all("metrics")
+
+
+pool = ExecutorPool()
+
+
+def _executor_main(connection: Connection, runner_id: str, admission_share: float):
+    asyncio.run(_serve(connection, runner_id, admission_share))
+
+
+async def _serve(connection: Connection, runner_id: str, admission_share: float):
+    await start_local(runner_id, admission_share)
+
+    loop = asyncio.get_event_loop()
+    stopped = loop.create_future()
+    games: Dict[int, asyncio.Task] = dict()
+
+    def send(message: tuple):
+        try:
+            connection.send(message)
+        except (OSError, ValueError):
+            # The pool has gone, so there is no one left to tell
+            if not stopped.done():
+                stopped.set_result(None)
+
+    async def play(game_id: int, gamemode_name: str, submission_hashes: List[str], options: dict, turns: int,
+                   priority: int, trace: bool):
+        def relay(event: dict):
+            send(("event", game_id, json.dumps(event, cls=Encoder)))
+
+        try:
+            parsed_result = await gamemode_runner.run(Gamemode.get(gamemode_name), submission_hashes, options, turns,
+                                                      priority=Priority(priority), listener=relay, trace=trace)
+        except QueueFullError as e:
+            send(("queue_full", game_id, e.retry_after))
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            send(("error", game_id, str(e) or type(e).__name__))
+        else:
+            send(("result", game_id, json.dumps(parsed_result, cls=Encoder)))
+
+    def receive():
+        try:
+            while connection.poll():
+                message = connection.recv()
+                if message[0] == "run":
+                    task = asyncio.ensure_future(play(*message[1:]))
+                    games[message[1]] = task
+                    task.add_done_callback(lambda _, game_id=message[1]: games.pop(game_id, None))
+                elif message[0] == "cancel" and message[1] in games:
+                    games[message[1]].cancel()
+                elif message[0] == "stats":
+                    send(("stats", message[1], local_stats()))
+                elif message[0] == "metrics":
+                    send(("metrics", message[1], metrics.snapshot()))
+                elif message[0] == "stop" and not stopped.done():
+                    stopped.set_result(None)
+        except (EOFError, OSError):
+            if not stopped.done():
+                stopped.set_result(None)
+
+    loop.add_reader(connection.fileno(), receive)
+    send(("ready",))
+    await stopped
+
+    loop.remove_reader(connection.fileno())
+    await asyncio.gather(*games.values(), return_exceptions=True)
+    await stop_local()
@@ -1,28 +1,82 @@
 import asyncio
+import random
 import time
 from contextlib import asynccontextmanager
-from typing import List, Tuple, AsyncIterator, Union
+from typing import Dict, List, Tuple, AsyncIterator, Union, Optional, Callable, Awaitable
 
+import chess
 from cuwais.common import Outcome, Result
 from cuwais.gamemodes import Gamemode
 
-from runner.logger import logger
+from runner.admission import Priority
+from runner.audits import UnsafeSandboxError
+from runner.config import get_option
+from runner.logger import logger, game_log, hold_game_log
 from runner.middleware import Middleware
+from runner.reaper import reaper
 from runner.results import ParsedResult, SingleResult
-from runner import sandbox
+from runner import sandbox, admission, metrics, tracing, spectators
 from runner.timed_connection import TimedConnection
+from shared.board_session import BoardDelta, BoardResync, board_checksum
 from shared.exceptions import MissingFunctionError, ExceptionTraceback
-from shared.message_connection import HandshakeFailedError
+from shared.framing import Framing
+from shared.message_connection import HandshakeFailedError, MessagePrintConnection
 from shared.connection import Connection, ConnectionNotActiveError, ConnectionTimedOutError
 
 
+# The functions of a submission's ai module that games call
+_ENTRY_POINTS = ["make_move"]
+
+# How many pings each player's latency is measured with
+_CALIBRATION_PINGS = 5
+
+
+def _time_limit(gamemode: Gamemode, options: dict) -> int:
+    return (gamemode.player_count + 1) * int(options.get("turn_time", 10))
+
+
 @asynccontextmanager
-async def _make_container_connection(gamemode: Gamemode,
-                                     submission_hash: str) -> AsyncIterator[Union[Connection, ParsedResult]]:
+async def _make_container_connection(gamemode: Gamemode, submission_hash: str, player: int, preload_timeout: float,
+                                     calibrations: Dict[int, List[float]]) \
+        -> AsyncIterator[Union[Connection, ParsedResult]]:
     try:
         async with sandbox.run(submission_hash) as new_connection:
-            new_connection: Connection
-            await new_connection.ping()
+            new_connection: MessagePrintConnection
+            with metrics.phase_seconds.time(phase="handshake"), tracing.span("handshake"):
+                await new_connection.handshake(Framing(get_option("submission_runner.framing", Framing.JSON.value)))
+
+            # Measure latency before any of the submission's code has run, so that nothing it does at import time
+            # can skew the pings that its clock allowance is worked out from
+            with metrics.phase_seconds.time(phase="calibration"), tracing.span("calibration"):
+                try:
+                    calibrations[player] = await asyncio.wait_for(
+                        _calibrate(new_connection, player, _CALIBRATION_PINGS), preload_timeout)
+                except (asyncio.TimeoutError, ConnectionNotActiveError, ConnectionTimedOutError):
+                    # Shouldn't crash, it's our fault if it does :(
+                    yield ParsedResult("", [], [SingleResult(Outcome.Draw, False, name, Result.UnknownResultType, "")
+                                                for name in gamemode.players])
+                    return
+
+            # Import the submission now so that it does not count against the player's clock,
+            # but still lose on time if importing takes longer than the whole game could
+            with metrics.phase_seconds.time(phase="preload"), tracing.span("preload"):
+                try:
+                    missing = await asyncio.wait_for(new_connection.preload("ai", _ENTRY_POINTS), preload_timeout)
+                except asyncio.TimeoutError:
+                    missing = None
+                except (ConnectionNotActiveError, ConnectionTimedOutError):
+                    missing = []  # Left for the first call to find, so the game ends as it always has
+            if missing is None:
+                logger.debug("Player %s timed out importing submission %s", player, submission_hash)
+                outcomes = [Outcome.Win] * gamemode.player_count
+                outcomes[player] = Outcome.Loss
+                prints = [""] * gamemode.player_count
+                prints[player] = new_connection.get_prints()
+                yield ParsedResult("", [], [SingleResult(outcome, False, name, Result.Timeout, printed)
+                                            for outcome, name, printed in zip(outcomes, gamemode.players, prints)])
+                return
+            if len(missing) != 0:
+                logger.debug("Submission %s is missing %s", submission_hash, missing)
             yield new_connection
     except HandshakeFailedError as e:
         each_res = [SingleResult(Outcome.Draw, False, "", Result.UnknownResultType, "")
@@ -31,6 +85,12 @@ async def _make_container_connection(gamemode: Gamemode,
 
         logger.error(f"Failed to handshake with container! {e.prints}")
         yield ParsedResult("", [], each_res)
+    except UnsafeSandboxError as e:
+        # The sandbox image is at fault rather than the submission, so nobody wins
+        each_res = [SingleResult(Outcome.Draw, False, name, Result.UnknownResultType, "")
+                    for name in gamemode.players]
+        each_res[player].printed = str(e)
+        yield ParsedResult("", [], each_res)
 
 
 @asynccontextmanager
@@ -62,7 +122,51 @@ async def with_multiple(*args) -> list:
     await asyncio.gather(*exit_coroutines, return_exceptions=True)
 
 
-async def run(gamemode: Gamemode, submission_hashes=None, options=None, turns=2 << 32, connections=None) -> ParsedResult:
+async def run(gamemode: Gamemode, submission_hashes=None, options=None, turns=2 << 32, connections=None,
+              priority: Priority = Priority.NORMAL, listener: Optional[Callable[[dict], None]] = None,
+              trace: bool = False) -> ParsedResult:
+    """Runs a game, returning its result. If a listener is given it is called with a start event once the
+    game is set up and a move event for every move accepted. The same events go to any spectators.
+    If trace is set, a timeline of the game in the Chrome trace format is attached to the result"""
+    game_id = spectators.hub.open_game(gamemode.name, submission_hashes or [])
+
+    def broadcast(event: dict):
+        if event["type"] == "start":
+            event["game_id"] = game_id
+        spectators.hub.publish(game_id, event)
+        if listener is not None:
+            listener(event)
+
+    trace_dir = get_option("submission_runner.trace_dir")
+    last_event = {"type": "error", "error": "The game could not be completed"}
+    try:
+        with game_log() as log:
+            if not trace and trace_dir is None:
+                with metrics.games_in_progress.track():
+                    parsed_result = await _run(gamemode, submission_hashes, options, turns, connections, priority,
+                                               broadcast)
+            else:
+                with metrics.games_in_progress.track(), tracing.record(gamemode.name) as game_trace:
+                    with tracing.span("game", submissions=list(submission_hashes or [])):
+                        parsed_result = await _run(gamemode, submission_hashes, options, turns, connections,
+                                                   priority, broadcast)
+                if trace:
+                    parsed_result["trace"] = game_trace.as_dict()
+                if trace_dir is not None:
+                    await tracing.save(game_trace, trace_dir)
+
+            log.failed = any(r.result != Result.ValidGame for r in parsed_result.submission_results)
+        last_event = {"type": "result", "submission_results": parsed_result["submission_results"]}
+    finally:
+        spectators.hub.close_game(game_id, last_event)
+
+    if parsed_result.count != 0:
+        metrics.game_results.inc(result=parsed_result.submission_results[0].result.value)
+    return parsed_result
+
+
+async def _run(gamemode: Gamemode, submission_hashes, options, turns, connections, priority: Priority,
+               listener: Optional[Callable[[dict], None]]) -> ParsedResult:
     if submission_hashes is None:
         submission_hashes = []
     submission_hashes = list(submission_hashes)
@@ -80,22 +184,60 @@ async def run(gamemode: Gamemode, submission_hashes=None, options=None, turns=2
     if len(connections) + len(submission_hashes) != gamemode.player_count:
         raise RuntimeError("Invalid number of players total")
 
-    # Create containers and recurse
+    # Create containers, then play with them
     if len(submission_hashes) != 0:
-        socket_awaitables = [_make_container_connection(gamemode, sub_hash) for sub_hash in submission_hashes]
-        async with with_multiple(*socket_awaitables) as new_connections:
-            for connection in new_connections:
-                if isinstance(connection, ParsedResult):
-                    return connection
+        async def play_in_containers(result: asyncio.Future):
+            async with admission.controller.admit(len(submission_hashes), priority):
+                first_player = len(connections)
+                calibrations: Dict[int, List[float]] = dict()
+                socket_awaitables = [_make_container_connection(gamemode, sub_hash, first_player + i,
+                                                                _time_limit(gamemode, options), calibrations)
+                                     for i, sub_hash in enumerate(submission_hashes)]
+                async with with_multiple(*socket_awaitables) as new_connections:
+                    for connection in new_connections:
+                        if isinstance(connection, ParsedResult):
+                            result.set_result(connection)
+                            return
+
+                        if isinstance(connection, BaseException):
+                            raise connection
+                        if not isinstance(connection, Connection):
+                            raise RuntimeError(f"Unknown connection type: {connection}")
+
+                        connections.append(connection)
+                    await _play(gamemode, options, turns, connections, listener, result, calibrations)
+
+        return await _run_until_result(play_in_containers)
+
+    return await _run_until_result(lambda result: _play(gamemode, options, turns, connections, listener, result, {}))
+
+
+async def _run_until_result(game: Callable[[asyncio.Future], Awaitable[None]]) -> ParsedResult:
+    """Runs a game in the background, returning its result as soon as it is known.
+    The game then carries on draining its players and tearing down without holding up the caller"""
+    result = asyncio.get_event_loop().create_future()
+    task = reaper.defer(game(result))
+    hold_game_log(task)
+    try:
+        await asyncio.wait({task, result}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        if not result.done():
+            task.cancel()
+        raise
 
-                if not isinstance(connection, Connection):
-                    raise RuntimeError(f"Unknown connection type: {connection}")
+    if result.done():
+        return result.result()
 
-                connections.append(connection)
-            return await run(gamemode, [], options, turns, connections)
+    if task.exception() is not None:
+        raise task.exception()
+    raise RuntimeError("Game finished without a result")
 
+
+async def _play(gamemode: Gamemode, options, turns, connections: List[Connection],
+                listener: Optional[Callable[[dict], None]], result: asyncio.Future,
+                calibrations: Dict[int, List[float]]):
     # Wrap all containers in timeouts
-    timeout = (gamemode.player_count + 1) * int(options.get("turn_time", 10))
+    timeout = _time_limit(gamemode, options)
     connections = [TimedConnection(connection, timeout) for connection in connections]
 
     # Set up linking through middleware
@@ -104,48 +246,150 @@ async def run(gamemode: Gamemode, submission_hashes=None, options=None, turns=2
 
     # Run
     logger.debug("Running...")
-    outcomes, result, moves, initial_board = await _run_loop(gamemode, middleware, options, turns)
+    outcomes, game_result, moves, initial_board = await _run_loop(gamemode, middleware, options, turns, listener,
+                                                                  calibrations)
 
     # Gather
-    logger.debug("Completed game, shutting down containers...")
-    await middleware.complete_all()
     prints = []
     for i in range(gamemode.player_count):
         prints.append(middleware.get_player_prints(i))
 
-    results = [SingleResult(outcome, result == Result.ValidGame, name, result, prints)
+    results = [SingleResult(outcome, game_result == Result.ValidGame, name, game_result, prints)
                for outcome, name, prints in zip(outcomes, gamemode.players, prints)]
 
     parsed_result = ParsedResult(initial_board, moves, results)
 
-    logger.debug(f"Done running gamemode {gamemode.name}! Result: {parsed_result}")
-    return parsed_result
+    logger.debug("Done running gamemode %s! Result: %s", gamemode.name, parsed_result)
+    result.set_result(parsed_result)
 
+    # The result is out, so draining the players no longer holds anyone up
+    logger.debug("Completed game, shutting down containers...")
+    await middleware.complete_all()
 
-async def _run_loop(gamemode: Gamemode, middleware, options, turns) -> Tuple[List[Outcome], Result, List[str], str]:
+
+class _BoardSync:
+    """
+    Tracks what each player has been sent so that, once a player has the whole board, they are only sent
+    the moves made since along with a checksum. Only used for unfiltered chess boards, where every
+    player sees the same board and can rebuild it themselves
+    """
+    def __init__(self, enabled: List[bool]):
+        self._enabled = enabled
+        self._synced_ply: List[Optional[int]] = [None] * len(enabled)
+
+    def board_for(self, gamemode: Gamemode, board, player: int):
+        filtered = gamemode.filter_board(board, player)
+        if not self._enabled[player] or filtered is not board or not isinstance(board, chess.Board):
+            return filtered
+
+        synced_ply = self._synced_ply[player]
+        self._synced_ply[player] = len(board.move_stack)
+        if synced_ply is None:
+            return board
+
+        return BoardDelta([move.uci() for move in board.move_stack[synced_ply:]], board_checksum(board))
+
+    def full_board_for(self, gamemode: Gamemode, board, player: int):
+        self._synced_ply[player] = len(board.move_stack) if isinstance(board, chess.Board) else None
+        return gamemode.filter_board(board, player)
+
+
+class _LatencyEstimator:
+    """
+    Keeps an estimate of each player's round trip time, separate from the time they spend computing.
+    Seeded by calibration pings, then refreshed as an exponentially weighted moving average after every move
+    using the compute time the sandbox reports alongside its result. That compute time comes from the sandbox,
+    so can only bring an estimate down from its calibrated value, never up, and estimates are capped besides
+    """
+    def __init__(self, player_count: int, alpha: float = 0.2, cap: float = 0.2):
+        self._alpha = alpha
+        self._cap = cap
+        self._estimates = [0.0] * player_count
+        self._calibrated = [0.0] * player_count
+
+    def __getitem__(self, player: int) -> float:
+        return self._estimates[player]
+
+    def __repr__(self):
+        return repr(self._estimates)
+
+    def _clamp(self, rtt: float) -> float:
+        return min(max(rtt, 0.0), self._cap)
+
+    def seed(self, player: int, samples: List[float]):
+        self._estimates[player] = self._clamp(sum(samples) / len(samples))
+        self._calibrated[player] = self._estimates[player]
+
+    def update(self, player: int, elapsed: float, compute_time: Optional[float]):
+        """Folds in a round trip that took elapsed seconds, of which the sandbox said compute_time was spent working"""
+        if compute_time is None:
+            return
+        sample = min(self._clamp(elapsed - compute_time), self._calibrated[player])
+        self._estimates[player] = self._alpha * sample + (1 - self._alpha) * self._estimates[player]
+
+
+async def _calibrate(connection: Connection, player: int, pings: int) -> List[float]:
+    samples = []
+    for _ in range(pings):
+        with tracing.span("ping", player=player):
+            rtt = await connection.ping()
+        samples.append(rtt - (connection.last_compute_time or 0.0))
+    return samples
+
+
+def _setup(gamemode: Gamemode, options: dict):
+    """Sets up the board. A seed option makes any randomness in setting up, such as a Chess960 position, repeatable"""
+    options = dict(options)
+    seed = options.pop("seed", None)
+    if seed is None:
+        return gamemode.setup(**options)
+
+    state = random.getstate()
+    random.seed(seed)
+    try:
+        return gamemode.setup(**options)
+    finally:
+        random.setstate(state)
+
+
+async def _run_loop(gamemode: Gamemode, middleware, options, turns,
+                    listener: Optional[Callable[[dict], None]] = None,
+                    calibrations: Optional[Dict[int, List[float]]] = None) \
+        -> Tuple[List[Outcome], Result, List[str], str]:
     moves = []
     time_remaining = [int(options["turn_time"])] * gamemode.player_count
-    board = gamemode.setup(**options)
+    board = _setup(gamemode, options)
     initial_encoded_board = gamemode.encode_board(board)
 
     player_turn = 0
-
-    try:
-        # Calculate latencies
-        pings = 5
-        latency = []
-        for i in range(gamemode.player_count):
-            tot = 0.0
-            for _ in range(pings):
-                tot += await middleware.ping(i)
-            tot /= pings
-            tot = min(tot, 0.2)  # Cap latency at 0.2s to prevent slow loris attack
-            latency.append(tot)
-    except (ConnectionNotActiveError, ConnectionTimedOutError):
-        # Shouldn't crash, it's our fault if it does :(
-        return [Outcome.Draw] * gamemode.player_count, Result.UnknownResultType, moves, initial_encoded_board
-    latency = sum(latency) / len(latency)
-    logger.debug(f"Latency for container communication: {latency}s")
+    use_board_deltas = bool(get_option("submission_runner.board_deltas", False))
+    board_sync = _BoardSync([use_board_deltas and middleware.supports_board_deltas(i)
+                             for i in range(gamemode.player_count)])
+
+    # Calculate latencies of players not measured as their sandbox started, pinging every player at once
+    calibrations = calibrations or dict()
+    uncalibrated = [i for i in range(gamemode.player_count) if i not in calibrations]
+    samples = [calibrations.get(i) for i in range(gamemode.player_count)]
+    if len(uncalibrated) != 0:
+        with metrics.phase_seconds.time(phase="calibration"), tracing.span("calibration"):
+            measured = await asyncio.gather(*[_calibrate(middleware.connection(i), i, _CALIBRATION_PINGS)
+                                              for i in uncalibrated], return_exceptions=True)
+        for i, player_samples in zip(uncalibrated, measured):
+            samples[i] = player_samples
+    for player_samples in samples:
+        if isinstance(player_samples, (ConnectionNotActiveError, ConnectionTimedOutError)):
+            # Shouldn't crash, it's our fault if it does :(
+            return [Outcome.Draw] * gamemode.player_count, Result.UnknownResultType, moves, initial_encoded_board
+        if isinstance(player_samples, BaseException):
+            raise player_samples
+
+    latency = _LatencyEstimator(gamemode.player_count)
+    for i, player_samples in enumerate(samples):
+        latency.seed(i, player_samples)
+    logger.debug("Latency for container communication: %ss", latency)
+
+    if listener is not None:
+        listener({"type": "start", "initial_board": initial_encoded_board, "players": list(gamemode.players)})
 
     def make_win(winner):
         res = [Outcome.Loss] * gamemode.player_count
@@ -160,8 +404,16 @@ async def _run_loop(gamemode: Gamemode, middleware, options, turns) -> Tuple[Lis
     for _ in range(turns):
         start_time = time.time_ns()
         try:
-            move = await middleware.call(player_turn, "make_move", board=gamemode.filter_board(board, player_turn),
+            move = await middleware.call(player_turn, "make_move",
+                                         board=board_sync.board_for(gamemode, board, player_turn),
                                          time_remaining=time_remaining[player_turn])
+            round_trips = 1
+            if isinstance(move, BoardResync):
+                logger.debug("Player %s asked for a board resync", player_turn)
+                move = await middleware.call(player_turn, "make_move",
+                                             board=board_sync.full_board_for(gamemode, board, player_turn),
+                                             time_remaining=time_remaining[player_turn])
+                round_trips = 2
         except ConnectionNotActiveError:
             return make_loss(player_turn), Result.ProcessKilled, moves, initial_encoded_board
         except ConnectionTimedOutError:
@@ -169,8 +421,12 @@ async def _run_loop(gamemode: Gamemode, middleware, options, turns) -> Tuple[Lis
         end_time = time.time_ns()
 
         t = (end_time - start_time) / 1e9
-        t -= latency
+        metrics.phase_seconds.observe(t, phase="move")
+        # Never credited back more than the move took, so no move can add to a player's clock
+        t = max(t - round_trips * latency[player_turn], 0.0)
         time_remaining[player_turn] -= t
+        if round_trips == 1:
+            latency.update(player_turn, (end_time - start_time) / 1e9, middleware.last_compute_time(player_turn))
 
         if time_remaining[player_turn] <= 0:
             return make_loss(player_turn), Result.Timeout, moves, initial_encoded_board
@@ -181,16 +437,27 @@ async def _run_loop(gamemode: Gamemode, middleware, options, turns) -> Tuple[Lis
         if isinstance(move, ExceptionTraceback):
             return make_loss(player_turn), Result.Exception, moves, initial_encoded_board
 
-        move = gamemode.parse_move(move)
+        if isinstance(move, BoardResync):
+            # The whole board has just been sent, so asking again can only stall the game
+            logger.debug("Player %s asked for a resync of a whole board", player_turn)
+            return make_loss(player_turn), Result.IllegalMove, moves, initial_encoded_board
+
+        with tracing.span("parse_move"):
+            move = gamemode.parse_move(move)
 
-        logger.debug(f"Got move {move}")
+        logger.debug("Got move %s", move)
 
-        if not gamemode.is_move_legal(board, move):
-            logger.debug(f"Move is not legal {move}")
+        with tracing.span("is_move_legal"):
+            legal = gamemode.is_move_legal(board, move)
+        if not legal:
+            logger.debug("Move is not legal %s", move)
             return make_loss(player_turn), Result.IllegalMove, moves, initial_encoded_board
 
         moves.append(gamemode.encode_move(move, player_turn))
-        board = gamemode.apply_move(board, move)
+        if listener is not None:
+            listener({"type": "move", "player": player_turn, "move": moves[-1]})
+        with tracing.span("apply_move"):
+            board = gamemode.apply_move(board, move)
 
         if gamemode.is_win(board, player_turn):
             return make_win(player_turn), Result.ValidGame, moves, initial_encoded_board
@@ -0,0 +1,134 @@
+import json
+import re
+import traceback
+from typing import Awaitable, Callable, Optional
+
+import aiodocker
+from aiodocker import DockerError
+
+from runner.artifact_cache import Artifact, ArtifactCache
+from runner.logger import logger
+
+SUBMISSION_IMAGE_REPOSITORY = "aiwarssoc/sandbox-submission"
+
+
+def submission_image_repository(owner: str) -> str:
+    """The repository an owner's submission images are kept in, so that runners sharing a Docker daemon
+    never adopt or evict each other's images"""
+    owner = re.sub(r"[^a-z0-9]+", "-", owner.lower()).strip("-")
+    return f"{SUBMISSION_IMAGE_REPOSITORY}-{owner}" if owner else SUBMISSION_IMAGE_REPOSITORY
+
+
+class SubmissionImageCache:
+    """
+    Builds a prepared, locked down sandbox image once per submission hash so that later games
+    can start straight from it. Images are evicted least recently used first once either the
+    number of images or their total size goes over the configured bounds, but never while a game is using them.
+    Each tag carries the provisioning digest, so images made from other sandbox scripts or another base image are
+    never used
+    """
+    def __init__(self, builder: Callable[[aiodocker.Docker, str, str, str], Awaitable[None]], base_image: str):
+        self._builder = builder
+        self._base_image = base_image
+        self._max_images = 0
+        self._max_bytes = 0
+        self._repository = SUBMISSION_IMAGE_REPOSITORY
+        self._digest = ""
+
+        self._docker: Optional[aiodocker.Docker] = None
+        self._base_size = 0
+        self._images = ArtifactCache()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._docker is not None
+
+    @property
+    def total_bytes(self) -> int:
+        return self._images.total_size()
+
+    def stats(self) -> dict:
+        return {"images": len(self._images), "bytes": self.total_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    async def start(self, docker: aiodocker.Docker, max_images: int, max_bytes: int, owner: str = "",
+                    digest: str = ""):
+        self._max_images = int(max_images)
+        self._max_bytes = int(max_bytes)
+        self._repository = submission_image_repository(owner)
+        self._digest = digest
+        self._docker = docker
+
+        base = await self._docker.images.inspect(self._base_image)
+        self._base_size = int(base.get("Size", 0))
+
+        # Adopt any images left over from a previous run by the same owner, and delete those
+        # made by a different version of the sandbox
+        stale = 0
+        existing = await self._docker.images.list(filters=json.dumps({"reference": [self._repository]}))
+        for image in existing:
+            for name in image.get("RepoTags") or []:
+                repository, _, tag = name.rpartition(":")
+                if repository != self._repository:
+                    continue
+                submission_hash, _, digest = tag.partition("-")
+                if digest == self._digest:
+                    self._images.adopt(submission_hash, Artifact(name, self._layer_size(image)))
+                else:
+                    stale += 1
+                    await self._delete(Artifact(name))
+        logger.debug(f"Submission image cache started with {len(self._images)} images, deleted {stale} stale images")
+        await self._evict()
+
+    async def stop(self):
+        await self._images.stop()
+        self._docker = None
+
+    def _tag(self, submission_hash: str) -> str:
+        return f"{submission_hash}-{self._digest}" if self._digest else submission_hash
+
+    async def acquire(self, submission_hash: str) -> str:
+        """Gets the name of the prepared image for the given submission, building it if needed.
+        Every call must be matched by a call to release once the container using the image is gone"""
+        image, made = await self._images.acquire(submission_hash, lambda: self._build(submission_hash))
+        if made:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._images.background(self._evict())
+        return image.name
+
+    def release(self, submission_hash: str):
+        image = self._images.release(submission_hash)
+        if image is not None and image.users <= 0:
+            self._images.background(self._evict())
+
+    async def _build(self, submission_hash: str) -> Artifact:
+        tag = self._tag(submission_hash)
+        name = f"{self._repository}:{tag}"
+        logger.debug(f"Building submission image {name}")
+        await self._builder(self._docker, submission_hash, self._repository, tag)
+        info = await self._docker.images.inspect(name)
+        return Artifact(name, self._layer_size(info))
+
+    def _layer_size(self, info: dict) -> int:
+        return max(0, int(info.get("Size", 0)) - self._base_size)
+
+    async def _evict(self):
+        while len(self._images) > self._max_images or self.total_bytes > self._max_bytes:
+            victim = self._images.least_recently_used()
+            if victim is None:
+                return  # Everything is in use
+            if await self._images.remove(victim, self._delete):
+                self.evictions += 1
+
+    async def _delete(self, image: Artifact):
+        logger.debug(f"Deleting submission image {image.name}")
+        try:
+            await self._docker.images.delete(image.name, force=True)
+        except DockerError:
+            logger.error(traceback.format_exc())
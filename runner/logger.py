@@ -1,10 +1,134 @@
+import asyncio
+import atexit
+import contextvars
 import logging
+import logging.handlers
+import queue
+import random
+from collections import deque
+from contextlib import contextmanager
 
 from cuwais.config import config_file
 
-logging.basicConfig(
-    format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s' if config_file.get("debug") else '%(message)s',
-    level=logging.DEBUG if config_file.get("debug") else logging.WARNING,
-    datefmt='%Y-%m-%d %H:%M:%S')
+_debug = bool(config_file.get("debug"))
+_level = logging.DEBUG if _debug else logging.WARNING
+
+# Records are put on a queue by whichever thread logs them and written out by a listener thread,
+# so that slow output never blocks the event loop
+_output = logging.StreamHandler()
+_output.setFormatter(logging.Formatter(
+    fmt='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s' if _debug else '%(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'))
+
+_queue = queue.SimpleQueue()
+_handler = logging.handlers.QueueHandler(_queue)
+_handler.setLevel(_level)
+_listener = logging.handlers.QueueListener(_queue, _output, respect_handler_level=False)
+_listener.start()
+atexit.register(_listener.stop)
+
+logging.basicConfig(level=_level, handlers=[_handler])
 
 logger = logging.getLogger("submission-runner")
+
+# Per game log buffers
+_game_logs_enabled = bool(config_file.get("submission_runner.game_logs"))
+_game_log_sample_rate = float(config_file.get("submission_runner.game_log_sample_rate") or 0.0)
+_game_log_max_records = int(config_file.get("submission_runner.game_log_max_records") or 10000)
+_game_buffer = contextvars.ContextVar("game_log", default=None)
+
+
+class _GameBufferFilter(logging.Filter):
+    """Holds back records below warning made during a game, to be written out only if the game needs looking at"""
+    def filter(self, record: logging.LogRecord) -> bool:
+        game = _game_buffer.get()
+        if game is None or game.flushed or record.levelno >= logging.WARNING:
+            return True
+        game.records.append(record)
+        return False
+
+
+if _game_logs_enabled:
+    logger.addFilter(_GameBufferFilter())
+
+# Debug records must reach the filter to be buffered, so the logger only lets them through while a game is buffering
+_buffering_games = 0
+
+
+def _start_buffering():
+    global _buffering_games
+    _buffering_games += 1
+    if _buffering_games == 1:
+        logger.setLevel(logging.DEBUG)
+
+
+def _stop_buffering():
+    global _buffering_games
+    _buffering_games -= 1
+    if _buffering_games == 0:
+        logger.setLevel(logging.NOTSET)
+
+
+class GameLog:
+    def __init__(self):
+        self.failed = False
+        self.records = deque(maxlen=_game_log_max_records)
+        self.flushed = False
+        self._closed = False
+        self._holds = 0
+
+    def hold(self, task: asyncio.Future):
+        """Keeps the buffer open until the task has finished, so that work the game leaves running in the background,
+        such as tearing down its sandboxes, is logged along with it"""
+        self._holds += 1
+        task.add_done_callback(self._release)
+
+    def _release(self, task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            self.failed = True
+        self._holds -= 1
+        if self._closed and self._holds == 0:
+            self._flush()
+
+    def _close(self):
+        self._closed = True
+        if self._holds == 0:
+            self._flush()
+
+    def _flush(self):
+        if self.flushed:
+            return
+        self.flushed = True
+        if self.failed or random.random() < _game_log_sample_rate:
+            for record in self.records:
+                _handler.handle(record)
+        self.records.clear()
+        _stop_buffering()
+
+
+def hold_game_log(task: asyncio.Future):
+    """Keeps the current game's log buffer open until the task has finished"""
+    game = _game_buffer.get()
+    if game is not None:
+        game.hold(task)
+
+
+@contextmanager
+def game_log():
+    """Buffers this game's debug and info logs, writing them out at the end only if the game was marked as failed,
+    raised, or was picked by sampling. Does nothing unless submission_runner.game_logs is set"""
+    game = GameLog()
+    if not _game_logs_enabled:
+        yield game
+        return
+
+    _start_buffering()
+    token = _game_buffer.set(game)
+    try:
+        yield game
+    except BaseException:
+        game.failed = True
+        raise
+    finally:
+        _game_buffer.reset(token)
+        game._close()
@@ -0,0 +1,189 @@
+import abc
+import bisect
+import math
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry: List["_Metric"] = []
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if len(pairs) == 0:
+        return ""
+    escaped = (name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+               for name, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    @abc.abstractmethod
+    def state(self) -> Any:
+        """A picklable copy of the values, so that another process can add them to its own"""
+        pass
+
+    @abc.abstractmethod
+    def samples(self, others: Sequence[Any] = ()) -> List[str]:
+        """The sample lines, with the states of the same metric in other processes added in"""
+        pass
+
+    def render(self, others: Sequence[Any] = ()) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples(others))
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = dict()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def state(self) -> Dict[Tuple[str, ...], float]:
+        return dict(self._values)
+
+    def samples(self, others: Sequence[Dict[Tuple[str, ...], float]] = ()) -> List[str]:
+        totals = dict(self._values)
+        for other in others:
+            for key, value in other.items():
+                totals[key] = totals.get(key, 0.0) + value
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in totals.items()]
+
+
+class Gauge(_Metric):
+    """A value that goes up and down. If a callback is given it is called for the value on every scrape instead"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation)
+        self._value = 0.0
+        self._callback = callback
+
+    def inc(self, amount: float = 1.0):
+        self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        self._value -= amount
+
+    @contextmanager
+    def track(self):
+        """Counts everything inside the with block"""
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    def state(self) -> float:
+        return self._callback() if self._callback is not None else self._value
+
+    def samples(self, others: Sequence[float] = ()) -> List[str]:
+        return [f"{self.name} {_format_value(self.state() + sum(others))}"]
+
+
+class _HistogramSeries:
+    def __init__(self, buckets: int):
+        self.counts = [0] * buckets
+        self.total = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self._buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], _HistogramSeries] = dict()
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _HistogramSeries(len(self._buckets))
+        i = bisect.bisect_left(self._buckets, value)
+        if i < len(self._buckets):
+            series.counts[i] += 1
+        series.total += value
+        series.count += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes how long the with block took, in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def state(self) -> Dict[Tuple[str, ...], Tuple[List[int], float, int]]:
+        return {key: (list(series.counts), series.total, series.count) for key, series in self._series.items()}
+
+    def samples(self, others: Sequence[Dict[Tuple[str, ...], Tuple[List[int], float, int]]] = ()) -> List[str]:
+        merged: Dict[Tuple[str, ...], _HistogramSeries] = dict()
+        for state in [self.state()] + list(others):
+            for key, (counts, total, count) in state.items():
+                series = merged.get(key)
+                if series is None:
+                    series = merged[key] = _HistogramSeries(len(self._buckets))
+                series.counts = [a + b for a, b in zip(series.counts, counts)]
+                series.total += total
+                series.count += count
+
+        lines = []
+        for key, series in merged.items():
+            cumulative = 0
+            for bound, count in zip(self._buckets, series.counts):
+                cumulative += count
+                le = (("le", _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            inf = (("le", "+Inf"),)
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, inf)} {series.count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(series.total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {series.count}")
+        return lines
+
+
+def snapshot() -> Dict[str, Any]:
+    """The values of every registered metric by name, for another process to add to its own when rendering"""
+    return {metric.name: metric.state() for metric in _registry}
+
+
+def render(snapshots: Sequence[Dict[str, Any]] = ()) -> str:
+    """Every registered metric in the Prometheus text exposition format, with any snapshots taken in other
+    processes added in"""
+    return "\n".join(metric.render([snapshot[metric.name] for snapshot in snapshots if metric.name in snapshot])
+                     for metric in _registry) + "\n"
+
+
+phase_seconds = Histogram("submission_runner_phase_seconds", "Time spent in each phase of running a game",
+                          labels=("phase",))
+game_results = Counter("submission_runner_games_total", "Games finished, by result code", labels=("result",))
+games_in_progress = Gauge("submission_runner_games_in_progress", "Games currently being set up or played")
+live_containers = Gauge("submission_runner_live_containers", "Sandbox containers currently used by games")
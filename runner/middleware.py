@@ -1,5 +1,6 @@
-from typing import Any, Iterable
+from typing import Any, Iterable, Optional
 
+from runner import tracing
 from shared.connection import Connection
 
 
@@ -18,13 +19,24 @@ class Middleware:
         """Calls a function with name method_name and args and kwargs as given.
         Raises ConnectionNotActiveError if the container is no longer active,
         or raises ConnectionTimedOutError if the container times out while we are waiting"""
-        return await self._connections[player_id].call(method_name, *args, **kwargs)
+        with tracing.span(f"call {method_name}", player=player_id):
+            return await self._connections[player_id].call(method_name, *args, **kwargs)
 
     async def ping(self, player_id) -> float:
         """Records the time taken for a message to be sent, parsed and responded to.
         Raises ConnectionNotActiveError if the container is no longer active,
         or raises ConnectionTimedOutError if the container times out while we are waiting"""
-        return await self._connections[player_id].ping()
+        with tracing.span("ping", player=player_id):
+            return await self._connections[player_id].ping()
+
+    def connection(self, player_id) -> Connection:
+        return self._connections[player_id]
 
     def get_player_prints(self, i):
         return self._connections[i].get_prints()
+
+    def supports_board_deltas(self, player_id) -> bool:
+        return self._connections[player_id].supports_board_deltas
+
+    def last_compute_time(self, player_id) -> Optional[float]:
+        return self._connections[player_id].last_compute_time
@@ -0,0 +1,200 @@
+import asyncio
+import json
+import os
+import time
+import traceback
+import uuid
+from typing import Awaitable, List, Optional, Set, Tuple
+
+import aiodocker
+from aiodocker import DockerError
+
+from runner.logger import logger
+
+SANDBOX_LABEL = "aiwarssoc.sandbox"
+SANDBOX_INSTANCE_LABEL = "aiwarssoc.sandbox-instance"
+
+
+def persistent_runner_id(id_file: str) -> str:
+    """Reads the runner ID kept in the given file, making one up and saving it there the first time,
+    so that a runner with no configured ID keeps the same one across restarts for as long as the file lasts"""
+    for _ in range(2):
+        try:
+            with open(id_file) as f:
+                runner_id = f.read().strip()
+            if runner_id != "":
+                return runner_id
+        except FileNotFoundError:
+            pass
+
+        runner_id = f"runner-{uuid.uuid4().hex[:12]}"
+        try:
+            os.makedirs(os.path.dirname(id_file) or ".", exist_ok=True)
+            with open(id_file, "x") as f:
+                f.write(runner_id)
+            return runner_id
+        except FileExistsError:
+            continue  # Another runner sharing the file saved one first
+        except OSError:
+            logger.error(f"Could not save a runner ID to {id_file}, so orphaned sandboxes will not be found after "
+                         f"a restart: {traceback.format_exc()}")
+            return runner_id
+    raise RuntimeError(f"Could not read a runner ID from {id_file}")
+
+
+class Reaper:
+    """
+    Deletes sandbox containers in the background, in batches, so that nothing waiting on a game's result
+    also waits on Docker. Also runs the rest of finished games, such as draining players, off the critical path.
+    Every sandbox is labelled with the runner that made it, so that any left behind after a crash are found
+    and removed at startup, and any leaked while running are removed periodically. Sandboxes are also labelled
+    with the process that made them, so that a runner never reaps those of another process that is still running
+    """
+    def __init__(self):
+        self.runner_id = ""
+        self.instance_id = uuid.uuid4().hex
+        self._started = 0.0
+        self._running_instances: Set[str] = set()
+        self._batch_size = 16
+        self._orphan_interval = 60.0
+
+        self._docker: Optional[aiodocker.Docker] = None
+        self._live: Set[str] = set()
+        self._queue: Optional[asyncio.Queue] = None
+        self._deferred: Set[asyncio.Task] = set()
+        self._tasks: List[asyncio.Task] = []
+
+        self.deleted = 0
+        self.orphans_reaped = 0
+
+    @property
+    def labels(self) -> dict:
+        return {SANDBOX_LABEL: self.runner_id, SANDBOX_INSTANCE_LABEL: self.instance_id}
+
+    def stats(self) -> dict:
+        return {"live": len(self._live),
+                "pending_deletes": self._queue.qsize() if self._queue is not None else 0,
+                "deferred": len(self._deferred),
+                "deleted": self.deleted,
+                "orphans_reaped": self.orphans_reaped}
+
+    async def start(self, docker: aiodocker.Docker, runner_id: str, batch_size: int = 16,
+                    orphan_interval_seconds: float = 60.0):
+        if not runner_id:
+            raise ValueError("Sandboxes cannot be labelled without a runner ID")
+        self.runner_id = str(runner_id)
+        self._started = time.time()
+        self._batch_size = max(1, int(batch_size))
+        self._orphan_interval = float(orphan_interval_seconds)
+        self._docker = docker
+        self._queue = asyncio.Queue()
+
+        # Nothing of ours is running yet, so anything with our ID still around was left behind by an earlier run.
+        # Only those at least an orphan interval old are taken, in case another process has been given the same ID
+        await self.reap_orphans(min_age_seconds=self._orphan_interval)
+
+        self._tasks = [asyncio.create_task(self._delete_loop()),
+                       asyncio.create_task(self._orphan_loop())]
+
+    async def stop(self):
+        # Let finished games tear down, then flush every delete they queued
+        await asyncio.gather(*self._deferred, return_exceptions=True)
+        if self._queue is not None:
+            await self._queue.join()
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._docker = None
+
+    def track(self, container: aiodocker.docker.DockerContainer):
+        """Marks a container as in use, so it is not mistaken for an orphan"""
+        self._live.add(container.id)
+
+    def defer(self, coroutine: Awaitable) -> asyncio.Task:
+        """Runs the coroutine in the background, waiting for it to finish before the reaper stops"""
+        task = asyncio.ensure_future(coroutine)
+        self._deferred.add(task)
+        task.add_done_callback(self._deferred_done)
+        return task
+
+    def _deferred_done(self, task: asyncio.Task):
+        self._deferred.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug("".join(traceback.format_exception(type(task.exception()), task.exception(),
+                                                            task.exception().__traceback__)))
+
+    async def delete(self, container: aiodocker.docker.DockerContainer):
+        """Deletes the container with the next batch, returning once it is gone.
+        The delete still goes ahead if the caller is cancelled"""
+        self._live.discard(container.id)
+        if self._queue is None:
+            await self._delete(container)
+            return
+
+        future = asyncio.get_event_loop().create_future()
+        self._queue.put_nowait((container, future))
+        await asyncio.shield(future)
+
+    async def _delete_loop(self):
+        while True:
+            batch: List[Tuple[aiodocker.docker.DockerContainer, asyncio.Future]] = [await self._queue.get()]
+            while len(batch) < self._batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            logger.debug(f"Deleting {len(batch)} containers")
+            await asyncio.gather(*[self._delete(container) for container, _ in batch])
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+                self._queue.task_done()
+
+    async def _delete(self, container: aiodocker.docker.DockerContainer):
+        try:
+            await container.delete(force=True)
+            self.deleted += 1
+        except DockerError as e:
+            if e.status != 404:  # Already gone, likely removed automatically on exit
+                logger.error(traceback.format_exc())
+        except Exception:
+            # Keep going, one bad delete must not stop the rest of the queue
+            logger.error(traceback.format_exc())
+
+    async def _orphan_loop(self):
+        while True:
+            await asyncio.sleep(self._orphan_interval)
+            try:
+                await self.reap_orphans(min_age_seconds=self._orphan_interval)
+            except DockerError:
+                logger.error(traceback.format_exc())
+
+    async def reap_orphans(self, min_age_seconds: float):
+        """Deletes every container labelled as ours that is not in use. Only containers older than the minimum
+        age are deleted, so that one being created as we list them is left alone. Containers made by another
+        process that has made any since we started are never deleted, as that process is still running"""
+        filters = json.dumps({"label": [f"{SANDBOX_LABEL}={self.runner_id}"]})
+        containers = await self._docker.containers.list(all=True, filters=filters)
+
+        for container in containers:
+            instance = (container["Labels"] or {}).get(SANDBOX_INSTANCE_LABEL)
+            if instance != self.instance_id and container["Created"] >= self._started \
+                    and instance not in self._running_instances:
+                self._running_instances.add(instance)
+                logger.error(f"Another running process is using the runner ID {self.runner_id}, so its sandboxes "
+                             f"are left alone. Every runner sharing a Docker daemon needs its own ID")
+
+        now = time.time()
+        orphans = [container for container in containers
+                   if container.id not in self._live and now - container["Created"] >= min_age_seconds
+                   and (container["Labels"] or {}).get(SANDBOX_INSTANCE_LABEL) not in self._running_instances]
+        if len(orphans) == 0:
+            return
+
+        logger.warning(f"Reaping {len(orphans)} orphaned sandbox containers")
+        await asyncio.gather(*[self._delete(container) for container in orphans])
+        self.orphans_reaped += len(orphans)
+
+
+reaper = Reaper()
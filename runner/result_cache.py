@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from cuwais.common import Result
+from cuwais.gamemodes import Gamemode
+
+from runner import metrics
+from runner.admission import Priority
+from runner.logger import logger
+from runner.results import ParsedResult
+from shared.message_connection import Encoder
+
+# Results that depend on the host rather than on the submissions, so would not come out the same again
+_UNREPEATABLE_RESULTS = {Result.Timeout, Result.ProcessKilled, Result.UnknownResultType}
+
+_requests = metrics.Counter("submission_runner_result_cache_requests_total",
+                            "Game requests by whether they were served from the result cache, shared a game "
+                            "already running, or ran their own game", labels=("outcome",))
+
+
+class _SharedGame:
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class ResultCache:
+    """
+    Lets identical game requests share one game. Requests that arrive while the same game is already running wait
+    for its result rather than starting their own containers. Once finished, results of gamemodes configured as
+    deterministic are kept for requests that declare their submissions deterministic and give a seed, and are
+    returned without running anything until they expire or are evicted, least recently used first
+    """
+    def __init__(self):
+        self.gamemodes = set()
+        self.ttl_seconds = 3600.0
+        self.max_entries = 1024
+        self._results: "OrderedDict[str, Tuple[float, ParsedResult]]" = OrderedDict()
+        self._in_flight: Dict[str, _SharedGame] = dict()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def configure(self, gamemodes: Iterable[str], ttl_seconds: float, max_entries: int):
+        self.gamemodes = {str(gamemode).lower() for gamemode in gamemodes}
+        self.ttl_seconds = float(ttl_seconds)
+        self.max_entries = int(max_entries)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._results), "in_flight": len(self._in_flight), "hits": self.hits,
+                "misses": self.misses, "coalesced": self.coalesced, "evictions": self.evictions}
+
+    @staticmethod
+    def key(gamemode: Gamemode, submission_hashes: List[str], options: dict, turns: int, trace: bool) -> str:
+        request = json.dumps([gamemode.name, list(submission_hashes), options, int(turns), bool(trace)],
+                             sort_keys=True, cls=Encoder)
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    def cacheable(self, gamemode: Gamemode, options: dict, deterministic: bool, trace: bool) -> bool:
+        """Only games that would come out the same every time are cached. Traces are of a particular run,
+        so are never cached"""
+        return deterministic and not trace and gamemode.name.lower() in self.gamemodes and "seed" in options
+
+    def get(self, key: str) -> Optional[ParsedResult]:
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        expires, result = entry
+        if expires <= time.monotonic():
+            del self._results[key]
+            return None
+        self._results.move_to_end(key)
+        return result
+
+    def put(self, key: str, result: ParsedResult):
+        if any(r.result in _UNREPEATABLE_RESULTS for r in result.submission_results):
+            return
+        self._results[key] = (time.monotonic() + self.ttl_seconds, result)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+            self.evictions += 1
+
+    async def run(self, run_game: Callable[..., Awaitable[ParsedResult]], gamemode: Gamemode,
+                  submission_hashes: List[str], options: dict, turns: int, priority: Priority = Priority.NORMAL,
+                  trace: bool = False, deterministic: bool = False) -> ParsedResult:
+        """Runs a game with run_game, which takes the same arguments as gamemode_runner.run,
+        unless its result is cached or the same game is already running"""
+        key = self.key(gamemode, submission_hashes, options, turns, trace)
+        cacheable = self.cacheable(gamemode, options, deterministic, trace)
+
+        if cacheable:
+            cached = self.get(key)
+            if cached is not None:
+                self.hits += 1
+                _requests.inc(outcome="hit")
+                return cached
+
+        shared = self._in_flight.get(key)
+        if shared is not None:
+            self.coalesced += 1
+            _requests.inc(outcome="coalesced")
+            logger.debug("Sharing game %s with a request already running it", key)
+        else:
+            self.misses += 1
+            _requests.inc(outcome="miss")
+            shared = _SharedGame(asyncio.ensure_future(run_game(gamemode, submission_hashes, options, turns,
+                                                                priority=priority, trace=trace)))
+            self._in_flight[key] = shared
+            shared.task.add_done_callback(lambda task: self._finished(key, shared, cacheable))
+
+        shared.waiters += 1
+        try:
+            return await asyncio.shield(shared.task)
+        except asyncio.CancelledError:
+            # Only give up on the game once nobody is waiting for it
+            if shared.waiters == 1 and not shared.task.done():
+                shared.task.cancel()
+            raise
+        finally:
+            shared.waiters -= 1
+
+    def _finished(self, key: str, shared: _SharedGame, cacheable: bool):
+        if self._in_flight.get(key) is shared:
+            del self._in_flight[key]
+        if shared.task.cancelled() or shared.task.exception() is not None:
+            return
+        if cacheable:
+            self.put(key, shared.task.result())
+
+
+result_cache = ResultCache()
@@ -23,6 +23,18 @@ class ParsedResult(dict):
 
         super().__init__(recording=self._recording, submission_results=[dict(r) for r in submission_results])
 
+    @staticmethod
+    def from_dict(data: dict) -> "ParsedResult":
+        """Rebuilds a result from its JSON form, keeping any extra keys such as a trace"""
+        submission_results = [SingleResult(Outcome(r["outcome"]), r["healthy"], r["player_id"],
+                                           Result(r["result_code"]), r["printed"])
+                              for r in data["submission_results"]]
+        recording = data["recording"]
+        result = ParsedResult(recording["initial_board"], recording["moves"], submission_results)
+        for key, value in data.items():
+            result.setdefault(key, value)
+        return result
+
     @property
     def outcomes(self):
         return [r.outcome for r in self._submission_results]
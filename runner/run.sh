@@ -1,3 +1,8 @@
 #!/bin/bash
-docker pull aiwarssoc/sandbox:latest
-python -m gunicorn --workers=1 --threads=3 --worker-class=uvicorn.workers.UvicornWorker --worker-connections=1000 --bind 0.0.0.0:8080 --log-level debug main:app --timeout 30
+# PORT and DOCKER_HOST choose where this runner listens and which Docker daemon it runs sandboxes on, so several
+# runners can share one machine. Setting COORDINATOR_NODES to a comma separated list of runner URLs makes this a
+# coordinator that routes games to those runners instead
+if [ -z "$COORDINATOR_NODES" ]; then
+  docker pull aiwarssoc/sandbox:latest
+fi
+python -m gunicorn --workers=1 --threads=3 --worker-class=uvicorn.workers.UvicornWorker --worker-connections=1000 --bind 0.0.0.0:${PORT:-8080} --log-level debug main:app --timeout 30
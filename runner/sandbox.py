@@ -1,23 +1,39 @@
+import asyncio
+import hashlib
+import importlib.util
 import io
+import math
 import os
+import posixpath
 import re
 import tarfile
 import traceback
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator, AsyncIterator
+from typing import AsyncGenerator, AsyncIterator, BinaryIO, Iterator, List, Optional, Tuple, Union
 
 import aiodocker
 from aiodocker import DockerError
 from aiodocker.stream import Stream
 from cuwais.config import config_file
 
-from runner.config import DEBUG
+from runner import docker_client, metrics, tracing, bytecode
+from runner.audits import sandbox_audits
+from runner.config import get_option
+from runner.container_pool import ContainerPool
+from runner.image_cache import SubmissionImageCache
 from runner.logger import logger
+from runner.reaper import reaper
+from runner.streams import FramedSplitter, LineSplitter
+from runner.volume_cache import SubmissionVolumes
 from shared.connection import Connection
 from shared.message_connection import MessagePrintConnection
 
 DOCKER_IMAGE_NAME = "aiwarssoc/sandbox:latest"
 
+PROVISIONING_COPY = "copy"
+PROVISIONING_IMAGE = "image"
+PROVISIONING_VOLUME = "volume"
+
 
 class InvalidEntryFile(RuntimeError):
     pass
@@ -27,16 +43,24 @@ class InvalidSubmissionError(RuntimeError):
     pass
 
 
-# Converts 100K into 102400, 1g into 1024**3, etc
-def _to_bytes(s: str) -> int:
-    s = s.strip().lower()
+# Converts 100K into 102400, 1g or 1gb into 1024**3, etc
+def _to_bytes(s) -> int:
+    s = str(s).strip().lower()
+    if s.endswith("b") and len(s) > 1 and s[-2] in {"k", "m", "g"}:
+        s = s[:-1]
     if s[-1] in {"b", "k", "m", "g"}:
         e = {"b": 0, "k": 1, "m": 2, "g": 3}[s[-1]]
-        return int(s[:-2].strip()) * (1024 ** e)
+        return int(s[:-1].strip()) * (1024 ** e)
 
     return int(s)
 
 
+def sandbox_reservation() -> Tuple[float, int]:
+    """The CPUs and bytes of memory that each sandbox container is limited to"""
+    return float(config_file.get("submission_runner.sandbox_cpu_count")), \
+        _to_bytes(config_file.get("submission_runner.sandbox_memory_limit"))
+
+
 def _get_env_vars() -> dict:
     env_vars = dict()
     env_vars['PYTHONPATH'] = "/home/sandbox/"
@@ -45,7 +69,12 @@ def _get_env_vars() -> dict:
     return env_vars
 
 
-async def _make_sandbox_container(client: aiodocker.docker.Docker, env_vars: dict) -> aiodocker.docker.DockerContainer:
+def _get_provisioning_mode() -> str:
+    return str(get_option("submission_runner.provisioning", PROVISIONING_COPY)).lower()
+
+
+async def _make_sandbox_container(client: aiodocker.docker.Docker, env_vars: dict, image: str = DOCKER_IMAGE_NAME,
+                                  binds: Optional[List[str]] = None) -> aiodocker.docker.DockerContainer:
     mem_limit = _to_bytes(config_file.get("submission_runner.sandbox_memory_limit"))
     max_repo_size_bytes = int(config_file.get("max_repo_size_bytes"))
     cpu_quota = int(100000 * float(config_file.get("submission_runner.sandbox_cpu_count")))
@@ -54,11 +83,12 @@ async def _make_sandbox_container(client: aiodocker.docker.Docker, env_vars: dic
 
     # See https://docs.docker.com/engine/api/v1.30/#operation/ContainerCreate
     config = {
-        "Image": DOCKER_IMAGE_NAME,
+        "Image": image,
         # "Cmd": f"ls -al /",
         "Tty": True,
         "User": 'sandbox',
         "Env": [f"{key}={env_vars[key]}" for key in env_vars],
+        "Labels": reaper.labels,
         "NetworkDisabled": True,
         "HostConfig": {
             # See https://docs.docker.com/engine/reference/run/#runtime-privilege-and-linux-capabilities
@@ -96,87 +126,308 @@ async def _make_sandbox_container(client: aiodocker.docker.Docker, env_vars: dic
         }
     }
 
-    container = await client.containers.create(config)
-    await container.start()
-
-    return container
+    if binds is not None:
+        config["HostConfig"]["Binds"] = binds
 
+    with metrics.phase_seconds.time(phase="create"), tracing.span("create"):
+        container = await client.containers.create(config)
+        reaper.track(container)
+        await container.start()
 
-def _compress_sandbox_files(fh):
-    with tarfile.open(fileobj=fh, mode='w') as tar:
-        tar.add("./sandbox", arcname="sandbox")
-        tar.add("./shared", arcname="shared")
+    return container
 
 
-async def _exec_root(container: aiodocker.docker.DockerContainer, command: str):
-    logger.debug(f"Container {container.id}: running {command}")
-    exec_ctxt = await container.exec(command, user='root', tty=True, stdout=True)
-    exec_stream: Stream = exec_ctxt.start(timeout=30)
-    output = b''
-    while True:
-        message: aiodocker.stream.Message = await exec_stream.read_out()
-        if message is None:
-            break
-        output += message.data
-    logger.debug(f"Container {container.id}: result of command {command}: '{output.decode()}'")
+# The equivalent of running chmod -R ugo=rx over everything copied into a sandbox
+_LOCKED_DOWN_MODE = 0o555
+
+_ARCHIVE_CHUNK_SIZE = 64 * 1024
+
+_sandbox_scripts: Optional[bytes] = None
+
+
+def _lock_down_member(info: tarfile.TarInfo) -> tarfile.TarInfo:
+    # Owned by root and read only, so nothing in the sandbox can change its own files.
+    # Any PAX headers would override the fields set here when written out, so are dropped
+    info.pax_headers = dict()
+    info.uid = 0
+    info.gid = 0
+    info.uname = "root"
+    info.gname = "root"
+    info.mode = _LOCKED_DOWN_MODE
+    return info
+
+
+def _compress_sandbox_files() -> bytes:
+    """Gets the tar members for the sandbox scripts, without the end of archive marker so that
+    a submission can be appended to them. These never change so are only compressed once"""
+    global _sandbox_scripts
+    if _sandbox_scripts is None:
+        fh = io.BytesIO()
+        with tarfile.open(fileobj=fh, mode='w') as tar:
+            tar.add("./sandbox", arcname="sandbox", filter=_lock_down_member)
+            tar.add("./shared", arcname="shared", filter=_lock_down_member)
+            members_size = tar.offset
+        _sandbox_scripts = fh.getvalue()[:members_size]
+
+    return _sandbox_scripts
+
+
+def _iter_provisioning_archive(submission_path: Optional[str], include_scripts: bool,
+                               max_size: int, bytecode_path: Optional[str] = None) -> Iterator[bytes]:
+    """Generates a single archive holding everything a sandbox needs under /home/sandbox/, already locked down.
+    The submission is read from disk as it is needed, so only around _ARCHIVE_CHUNK_SIZE bytes are held at once.
+    Any precompiled bytecode for the submission is added alongside its sources if it fits"""
+    buffer = bytearray()
+
+    def add(info: tarfile.TarInfo):
+        nonlocal buffer
+        buffer += _lock_down_member(info).tobuf(tarfile.DEFAULT_FORMAT, tarfile.ENCODING, "surrogateescape")
+
+    # /home/sandbox/ itself, so that nothing can be added next to the files copied in
+    root_info = tarfile.TarInfo(".")
+    root_info.type = tarfile.DIRTYPE
+    add(root_info)
+
+    if include_scripts:
+        buffer += _compress_sandbox_files()
+
+    if submission_path is not None:
+        dest_path = "submission"
+
+        # Make destination
+        dest_info = tarfile.TarInfo(dest_path)
+        dest_info.type = tarfile.DIRTYPE
+        add(dest_info)
+
+        # Make required init file for python
+        add(tarfile.TarInfo(posixpath.join(dest_path, "__init__.py")))
+
+        total_size = 0
+
+        def add_members(archive_file: BinaryIO) -> Iterator[bytes]:
+            nonlocal buffer, total_size
+            with tarfile.open(fileobj=archive_file, mode='r|') as archive:
+                for member in archive:
+                    total_size += member.size
+                    if total_size > max_size:
+                        raise InvalidSubmissionError(f"Submission is larger than {max_size} bytes")
+
+                    # Devices and pipes could be made by Docker when copied in, so only plain files are allowed
+                    if not (member.isfile() or member.isdir() or member.issym() or member.islnk()):
+                        raise InvalidSubmissionError(f"Archive member is not a file or directory: {member.name}")
+
+                    data = archive.extractfile(member) if member.isfile() else None
+                    member.name = _submission_member_path(dest_path, member.name)
+                    if member.islnk():
+                        member.linkname = _submission_member_path(dest_path, member.linkname)
+                    elif member.issym():
+                        _submission_symlink_target(dest_path, member.name, member.linkname)
+                    add(member)
+
+                    while data is not None:
+                        if len(buffer) >= _ARCHIVE_CHUNK_SIZE:
+                            yield bytes(buffer)
+                            buffer = bytearray()
+                        chunk = data.read(_ARCHIVE_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        buffer += chunk
+                    remainder = member.size % tarfile.BLOCKSIZE
+                    if remainder != 0:
+                        buffer += tarfile.NUL * (tarfile.BLOCKSIZE - remainder)
+
+        with open(submission_path, "rb") as submission_file:
+            yield from add_members(submission_file)
+
+        # The bytecode is only a speed up, so is left out rather than fail a submission that is near the limit,
+        # or if it has been evicted from the cache since it was asked for
+        try:
+            bytecode_file = open(bytecode_path, "rb") if bytecode_path is not None else None
+        except OSError:
+            bytecode_file = None
+        if bytecode_file is not None:
+            with bytecode_file:
+                if total_size + os.fstat(bytecode_file.fileno()).st_size <= max_size:
+                    yield from add_members(bytecode_file)
+
+    # End of archive marker
+    buffer += tarfile.NUL * (tarfile.BLOCKSIZE * 2)
+    yield bytes(buffer)
+
+
+class _ArchiveStream:
+    """Feeds an archive generator to the Docker API chunk by chunk, reading from disk on a worker thread.
+    Any error raised while generating is kept so that it can be reported instead of the aborted upload"""
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self.error: Optional[Exception] = None
+
+    async def stream(self) -> AsyncGenerator[bytes, None]:
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                chunk = await loop.run_in_executor(None, next, self._chunks, None)
+            except Exception as e:
+                self.error = e
+                raise
+            if chunk is None:
+                return
+            yield chunk
+
+
+def _submission_member_path(dest_path: str, name: str) -> str:
+    path = posixpath.normpath(posixpath.join(dest_path, name))
+    if path != dest_path and not path.startswith(dest_path + "/"):
+        raise InvalidSubmissionError(f"Archive member outside of submission: {name}")
+    return path
+
+
+def _submission_symlink_target(dest_path: str, name: str, linkname: str) -> str:
+    """Checks that a symlink in the submission points to somewhere else in the submission"""
+    if linkname.startswith("/"):
+        raise InvalidSubmissionError(f"Archive symlink to an absolute path: {name}")
+    target = posixpath.normpath(posixpath.join(posixpath.dirname(name), linkname))
+    if target != dest_path and not target.startswith(dest_path + "/"):
+        raise InvalidSubmissionError(f"Archive symlink outside of submission: {name}")
+    return target
 
 
 async def _copy_sandbox_scripts(container: aiodocker.docker.DockerContainer):
-    _sandbox_scripts = io.BytesIO()
-    # Compress files to tar
-    _compress_sandbox_files(_sandbox_scripts)
+    await container.put_archive("/home/sandbox/", b"".join(_iter_provisioning_archive(None, True, 0)))
 
-    # Send
-    _sandbox_scripts.seek(0)
-    await container.put_archive("/home/sandbox/", _sandbox_scripts.getvalue())
 
-
-async def _copy_submission(container: aiodocker.docker.DockerContainer, submission_hash: str):
+async def _copy_submission(container: aiodocker.docker.DockerContainer, submission_hash: str,
+                           include_scripts: bool = True):
+    """Copies the submission, and the sandbox scripts unless they are already there, with a single request.
+    Ownership and modes are set in the archive so the container needs no lock down afterwards"""
     submission_path = f"/home/subrunner/repositories/{submission_hash}.tar"
     # Ensure that submission is valid
     if not _is_submission_valid(submission_hash, submission_path):
         raise InvalidSubmissionError(submission_hash)
 
-    # Make destination
-    dest_path = "/home/sandbox/submission"
-    await _exec_root(container, f"mkdir {dest_path}")
-
-    # Make required init file for python
-    init_path = os.path.join(dest_path, "__init__.py")
-    await _exec_root(container, f"touch {init_path}")
-
-    logger.debug(f"Container {container.id}: opening submission {submission_hash}")
-    with open(submission_path, 'rb') as f:
-        logger.debug(f"Container {container.id}: reading submission {submission_hash}")
-        data = f.read()
+    bytecode_path = None
+    if bool(get_option("submission_runner.precompile_submissions", True)):
+        # Compiled once per submission on this host, then shipped with every copy of it
+        cache_dir = str(get_option("submission_runner.bytecode_cache_dir", "/tmp/sandbox/bytecode"))
+        cache_max_bytes = int(get_option("submission_runner.bytecode_cache_max_bytes", 256 * 1024 ** 2))
+        bytecode_path = await asyncio.get_event_loop().run_in_executor(None, bytecode.compiled_archive,
+                                                                       submission_hash, submission_path, cache_dir,
+                                                                       cache_max_bytes)
 
-    logger.debug(f"Container {container.id}: putting submission {submission_hash}")
-    await container.put_archive(dest_path, data)
+    max_repo_size_bytes = int(config_file.get("max_repo_size_bytes"))
+    archive = _ArchiveStream(_iter_provisioning_archive(submission_path, include_scripts, max_repo_size_bytes,
+                                                        bytecode_path))
 
+    logger.debug(f"Container {container.id}: streaming submission {submission_hash}")
+    try:
+        await container.put_archive("/home/sandbox/", archive.stream())
+    except Exception:
+        if archive.error is not None:
+            raise archive.error
+        raise
+
+
+def _zygote_enabled() -> bool:
+    return bool(get_option("submission_runner.zygote", False))
+
+
+async def _start_zygote(container: aiodocker.docker.DockerContainer, env_vars: dict):
+    """Starts an interpreter in the background that has already imported everything a game needs,
+    as the same user that games are played as, ready to fork the game when it starts"""
+    zygote_exec = await container.exec(cmd="python3 -u /home/sandbox/sandbox/zygote.py serve",
+                                       user='read_only_user',
+                                       stdin=False,
+                                       stdout=False,
+                                       stderr=False,
+                                       tty=False,
+                                       environment=env_vars,
+                                       workdir="/home/sandbox/")
+    await zygote_exec.start(detach=True)
+
+
+async def _make_pooled_container(client: aiodocker.docker.Docker) -> aiodocker.docker.DockerContainer:
+    env_vars = _get_env_vars()
+    container = await _make_sandbox_container(client, env_vars)
+    try:
+        await _copy_sandbox_scripts(container)
+        if _zygote_enabled():
+            await _start_zygote(container, env_vars)
+    except DockerError:
+        await reaper.delete(container)
+        raise
 
-async def _lock_down(container: aiodocker.docker.DockerContainer):
-    # Set write limits
-    await _exec_root(container, "chmod -R ugo=rx /home/sandbox/")  # TODO: Very slow (~2s) because of CoW?
+    return container
 
-    if DEBUG:
-        await _exec_root(container, "ls -alR /home/sandbox/")
 
+async def _build_submission_image(client: aiodocker.docker.Docker, submission_hash: str, repository: str, tag: str):
+    container = await _make_sandbox_container(client, _get_env_vars())
+    try:
+        await _copy_submission(container, submission_hash)
+        await container.commit(repository=repository, tag=tag, message=f"Prepared submission {submission_hash}")
+    finally:
+        await reaper.delete(container)
 
-async def _get_lines(strings: AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
-    line = []
-    async for string in strings:
-        if string is None or string == b'' or string == "":
-            continue
-        for char in string:
-            if char == "\r" or char == "\n":
-                if len(line) != 0:
-                    yield "".join(line)
-                line = []
-            else:
-                line.append(char)
 
-    if len(line) != 0:
-        yield "".join(line)
+async def _populate_submission_volume(client: aiodocker.docker.Docker, submission_hash: str, volume: str):
+    container = await _make_sandbox_container(client, _get_env_vars(), binds=[f"{volume}:/home/sandbox"])
+    try:
+        await _copy_submission(container, submission_hash)
+    finally:
+        await reaper.delete(container)
+
+
+container_pool = ContainerPool(_make_pooled_container)
+submission_images = SubmissionImageCache(_build_submission_image, DOCKER_IMAGE_NAME)
+submission_volumes = SubmissionVolumes(_populate_submission_volume)
+
+
+async def _provisioning_digest(client: aiodocker.docker.Docker) -> str:
+    """Identifies everything besides the submission that goes into a prepared image or volume, so that those
+    made before the sandbox scripts, the base image or the shipped bytecode changed are never used"""
+    digest = hashlib.sha256(_compress_sandbox_files())
+    digest.update((await client.images.inspect(DOCKER_IMAGE_NAME))["Id"].encode())
+    if bool(get_option("submission_runner.precompile_submissions", True)):
+        digest.update(importlib.util.MAGIC_NUMBER)
+    return digest.hexdigest()[:16]
+
+
+async def start_provisioning(owner: str = "", share: float = 1.0):
+    """Starts the caches and warm pool, named for the given owner and sized to its share of the host"""
+    _compress_sandbox_files()
+    sandbox_audits.configure(enabled=bool(get_option("submission_runner.audit", True)),
+                             time_budget_seconds=float(get_option("submission_runner.audit_time_budget_seconds", 2)),
+                             timeout_seconds=float(get_option("submission_runner.audit_timeout_seconds", 30)))
+
+    if _get_provisioning_mode() == PROVISIONING_VOLUME:
+        await submission_volumes.start(docker_client.get(),
+                                       gc_grace_seconds=float(get_option("submission_runner.volume_gc_grace_seconds",
+                                                                         60)),
+                                       owner=owner, digest=await _provisioning_digest(docker_client.get()))
+    if _get_provisioning_mode() == PROVISIONING_IMAGE:
+        await submission_images.start(docker_client.get(),
+                                      max_images=_share_of(get_option("submission_runner.image_cache_max_images", 64),
+                                                           share),
+                                      max_bytes=_share_of(get_option("submission_runner.image_cache_max_bytes",
+                                                                     8 * 1024 ** 3), share),
+                                      owner=owner, digest=await _provisioning_digest(docker_client.get()))
+    if _get_provisioning_mode() != PROVISIONING_COPY:
+        return  # Only copied sandboxes are taken from the warm pool
+    await container_pool.start(docker_client.get(),
+                               size=_share_of(get_option("submission_runner.warm_pool_size", 0), share),
+                               max_idle_seconds=float(get_option("submission_runner.warm_pool_max_idle_seconds", 300)),
+                               health_check_seconds=float(get_option("submission_runner.warm_pool_health_check_seconds",
+                                                                     30)))
+
+
+def _share_of(total, share: float) -> int:
+    # Rounded up, so that every process sharing a configured total gets at least one
+    return int(math.ceil(int(total) * float(share)))
+
+
+async def stop_provisioning():
+    await container_pool.stop()
+    await submission_images.stop()
+    await submission_volumes.stop()
 
 
 def _is_script_valid(script_name: str):
@@ -191,70 +442,126 @@ def _is_submission_valid(submission_hash: str, submission_path: str):
 
 @asynccontextmanager
 async def run(submission_hash: str) -> AsyncIterator[Connection]:
-    docker = None
+    docker = docker_client.get()
     container = None
+    image = DOCKER_IMAGE_NAME
+    image_hash = None
+    volume_hash = None
+    script_name = "play.py"
 
     try:
-        # Attach to docker
-        docker = aiodocker.Docker()
-
-        # Create container
-        logger.debug(f"Creating container for hash {submission_hash}")
         env_vars = _get_env_vars()
-        try:
-            container = await _make_sandbox_container(docker, env_vars)
-        except DockerError:
-            logger.error(traceback.format_exc())
-            raise
 
-        # Copy information
-        logger.debug(f"Container {container.id}: copying scripts")
-        await _copy_sandbox_scripts(container)
-        logger.debug(f"Container {container.id}: copying submission")
-        await _copy_submission(container, submission_hash)
-        logger.debug(f"Container {container.id}: locking down")
-        await _lock_down(container)
+        if submission_images.enabled:
+            # Start straight from the prepared image for this submission
+            with metrics.phase_seconds.time(phase="provision"), tracing.span("provision"):
+                image = await submission_images.acquire(submission_hash)
+            image_hash = submission_hash
+
+            logger.debug(f"Creating container from image {image}")
+            try:
+                container = await _make_sandbox_container(docker, env_vars, image)
+            except DockerError:
+                logger.error(traceback.format_exc())
+                raise
+            metrics.live_containers.inc()
+        elif submission_volumes.enabled:
+            # Mount the populated scripts and submission, read only so no lock down is needed
+            with metrics.phase_seconds.time(phase="provision"), tracing.span("provision"):
+                volume = await submission_volumes.acquire(submission_hash)
+            volume_hash = submission_hash
+
+            logger.debug(f"Creating container with volume {volume}")
+            try:
+                container = await _make_sandbox_container(docker, env_vars, binds=[f"{volume}:/home/sandbox:ro"])
+            except DockerError:
+                logger.error(traceback.format_exc())
+                raise
+            metrics.live_containers.inc()
+        else:
+            # Use a warm container if one is ready, otherwise make a new one
+            container = container_pool.take()
+            has_scripts = container is not None
+            # Only warm containers have had time to start a zygote
+            script_name = "zygote.py" if has_scripts and _zygote_enabled() else "play.py"
+            if container is None:
+                # Create container
+                logger.debug(f"Creating container for hash {submission_hash}")
+                try:
+                    container = await _make_sandbox_container(docker, env_vars)
+                except DockerError:
+                    logger.error(traceback.format_exc())
+                    raise
+            metrics.live_containers.inc()
+
+            # Copy information
+            logger.debug(f"Container {container.id}: copying submission")
+            with metrics.phase_seconds.time(phase="provision"), tracing.span("provision"):
+                await _copy_submission(container, submission_hash, include_scripts=not has_scripts)
 
         # Start script
         logger.debug(f"Container {container.id}: running script")
         run_t = int(config_file.get('submission_runner.sandbox_run_timeout_seconds'))
-        run_script_cmd = f"./sandbox/run.sh 'play.py' {run_t}"
-        cmd_exec = await container.exec(cmd=run_script_cmd,
-                                        user='read_only_user',
-                                        stdin=True,
-                                        stdout=True,
-                                        stderr=True,
-                                        tty=False,
-                                        environment=env_vars,
-                                        workdir="/home/sandbox/")
+        run_script_cmd = f"./sandbox/run.sh '{script_name}' {run_t}"
+        with metrics.phase_seconds.time(phase="start"), tracing.span("start"):
+            cmd_exec = await container.exec(cmd=run_script_cmd,
+                                            user='read_only_user',
+                                            stdin=True,
+                                            stdout=True,
+                                            stderr=True,
+                                            tty=False,
+                                            environment=env_vars,
+                                            workdir="/home/sandbox/")
         unrun_t = int(config_file.get('submission_runner.sandbox_unrun_timeout_seconds'))
         cmd_stream: Stream = cmd_exec.start(timeout=unrun_t)
 
         # Set up input to the container
-        async def send_handler(m: str):
-            logger.debug(f"Container {container.id} <-- '{m.encode()}'")
-            await cmd_stream.write_in((m + "\n").encode())
+        async def send_handler(m: Union[str, bytes]):
+            data = m if isinstance(m, bytes) else (m + "\n").encode()
+            logger.debug("Container %s <-- '%s'", container.id, data)
+            await cmd_stream.write_in(data)
+
+        # Process output from the container
+        logger.debug(f"Container {container.id}: setting up output processing")
+        max_line_length = int(get_option("submission_runner.max_line_length", 1024 * 1024))
+        splitter = FramedSplitter(max_line_length)
+        # Only stdout can carry frames, whatever is written to stderr is kept apart and only ever read as text
+        stderr_lines = LineSplitter(max_line_length)
 
         # Set up output from the container
-        async def receive_handler() -> AsyncGenerator[str, None]:
+        async def receive_handler() -> AsyncGenerator[Union[str, bytes], None]:
             while True:
                 message: aiodocker.stream.Message = await cmd_stream.read_out()
                 if message is None:
                     break
-                logger.debug(f"Container {container.id} --> '{message}'")
-                yield bytes(message.data).decode()
+                logger.debug("Container %s --> '%s'", container.id, message)
+                items = stderr_lines.feed(message.data) if message.stream == 2 else splitter.feed(message.data)
+                for item in items:
+                    yield item
 
-        # Process output from the container
-        logger.debug(f"Container {container.id}: setting up output processing")
-        lines = _get_lines(receive_handler())
+            for item in splitter.flush() + stderr_lines.flush():
+                yield item
+
+        lines = receive_handler()
 
         logger.debug(f"Container {container.id}: connecting")
-        yield MessagePrintConnection(send_handler, lines, container.id)
+        connection = MessagePrintConnection(send_handler, lines, container.id, on_framing=splitter.set_framing)
+
+        # Make sure there is nowhere the game could fill up before its submission is imported
+        if sandbox_audits.enabled:
+            with metrics.phase_seconds.time(phase="audit"), tracing.span("audit"):
+                await sandbox_audits.check(docker, image, connection)
+
+        yield connection
 
     finally:
         # Clean everything up
         if container is not None:
             logger.debug(f"Container {container.id}: cleaning up")
-            await container.delete(force=True)
-        if docker is not None:
-            await docker.close()
+            with metrics.phase_seconds.time(phase="teardown"), tracing.span("teardown"):
+                await reaper.delete(container)
+            metrics.live_containers.dec()
+        if image_hash is not None:
+            submission_images.release(image_hash)
+        if volume_hash is not None:
+            submission_volumes.release(volume_hash)
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import time
+import uuid
+from collections import deque
+from typing import AsyncGenerator, Deque, Dict, List, Optional, Set
+
+from runner.logger import logger
+from shared.message_connection import Encoder
+
+_DROPPED_FRAME = json.dumps({"type": "dropped", "error": "Fell too far behind the game"})
+
+
+class _Subscriber:
+    def __init__(self, game: "_Game", buffer_size: int, max_coalesces: int):
+        self._game = game
+        self._buffer: Deque[str] = deque()
+        self._buffer_size = buffer_size
+        self._max_coalesces = max_coalesces
+        self._coalesces = 0
+        self._ready = asyncio.Event()
+        self.closed = False
+        self.dropped = False
+
+    def offer(self, frame: str):
+        """Adds a frame without ever waiting. If the buffer is full, everything in it is replaced by one snapshot
+        of the game so far, and a subscriber that keeps falling that far behind is dropped"""
+        if self.closed:
+            return
+        if len(self._buffer) >= self._buffer_size:
+            self._coalesces += 1
+            if self._coalesces > self._max_coalesces:
+                logger.debug("Dropping slow spectator of game %s", self._game.game_id)
+                self._buffer.clear()
+                self._buffer.append(_DROPPED_FRAME)
+                self.dropped = True
+                self.close()
+                return
+            self._buffer.clear()
+            self._buffer.append(self._game.snapshot())
+            # The snapshot already includes this frame if it was a move
+            if self._game.is_move(frame):
+                self._ready.set()
+                return
+        self._buffer.append(frame)
+        self._ready.set()
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+    async def frames(self) -> AsyncGenerator[str, None]:
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while len(self._buffer) != 0:
+                yield self._buffer.popleft()
+            self._coalesces = 0
+            if self.closed:
+                return
+
+
+class _Game:
+    def __init__(self, game_id: str, gamemode: str, submissions: List[str]):
+        self.game_id = game_id
+        self.gamemode = gamemode
+        self.submissions = submissions
+        self.started = time.time()
+        self.initial_board: Optional[str] = None
+        self.players: List[str] = []
+        self.moves: List[str] = []
+        self.subscribers: Set[_Subscriber] = set()
+        self._last_move_frame: Optional[str] = None
+
+    def is_move(self, frame: str) -> bool:
+        return frame is self._last_move_frame
+
+    def snapshot(self) -> str:
+        return json.dumps({"type": "snapshot", "game_id": self.game_id, "initial_board": self.initial_board,
+                           "players": self.players, "moves": self.moves}, cls=Encoder)
+
+    def record(self, event: dict, frame: str):
+        if event["type"] == "start":
+            self.initial_board = event["initial_board"]
+            self.players = event["players"]
+        elif event["type"] == "move":
+            self.moves.append(event["move"])
+            self._last_move_frame = frame
+
+    def as_dict(self) -> dict:
+        return {"game_id": self.game_id, "gamemode": self.gamemode, "submissions": self.submissions,
+                "started": self.started, "moves": len(self.moves), "spectators": len(self.subscribers)}
+
+
+class SpectatorHub:
+    """
+    Fans the events of every running game out to any number of spectators. Each event is encoded once and
+    offered to every subscriber without waiting, so a slow spectator can never hold up the game loop. Instead
+    each subscriber has a bounded buffer that is coalesced into a snapshot of the game when it fills
+    """
+    def __init__(self, buffer_size: int = 64, max_coalesces: int = 8):
+        self.buffer_size = buffer_size
+        self.max_coalesces = max_coalesces
+        self._games: Dict[str, _Game] = dict()
+
+    def games(self) -> List[dict]:
+        return [game.as_dict() for game in self._games.values()]
+
+    def open_game(self, gamemode: str, submissions: List[str]) -> str:
+        game_id = uuid.uuid4().hex
+        self._games[game_id] = _Game(game_id, gamemode, list(submissions))
+        return game_id
+
+    def publish(self, game_id: str, event: dict):
+        game = self._games.get(game_id)
+        if game is None:
+            return
+        frame = json.dumps(event, cls=Encoder)
+        game.record(event, frame)
+        for subscriber in list(game.subscribers):
+            subscriber.offer(frame)
+            if subscriber.closed:
+                game.subscribers.discard(subscriber)
+
+    def close_game(self, game_id: str, event: Optional[dict] = None):
+        """Sends the last event, if given, then ends every subscription"""
+        if event is not None:
+            self.publish(game_id, event)
+        game = self._games.pop(game_id, None)
+        if game is None:
+            return
+        for subscriber in game.subscribers:
+            subscriber.close()
+
+    def subscribe(self, game_id: str) -> Optional[AsyncGenerator[str, None]]:
+        """Gets the encoded events of a game, starting with a snapshot of it so far, or None if it is not running"""
+        game = self._games.get(game_id)
+        if game is None:
+            return None
+
+        subscriber = _Subscriber(game, self.buffer_size, self.max_coalesces)
+        subscriber.offer(game.snapshot())
+        game.subscribers.add(subscriber)
+        return self._frames(game, subscriber)
+
+    @staticmethod
+    async def _frames(game: _Game, subscriber: _Subscriber) -> AsyncGenerator[str, None]:
+        try:
+            async for frame in subscriber.frames():
+                yield frame
+        finally:
+            subscriber.close()
+            game.subscribers.discard(subscriber)
+
+
+hub = SpectatorHub()
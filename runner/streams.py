@@ -0,0 +1,143 @@
+from typing import AsyncGenerator, AsyncIterable, List, Optional, Union
+
+from shared.framing import Framing, FRAME_MARKER, FRAME_HEADER, MAX_FRAME_SIZE, FramingError
+
+
+class LineSplitter:
+    """
+    Incrementally splits a stream of bytes into lines, treating both \\r and \\n as line breaks and skipping
+    empty lines. Splitting is done on bytes so that only complete lines are decoded, meaning multi-byte
+    characters split across chunks survive. Lines longer than max_line_length are broken up so that
+    a stream without any line breaks cannot grow the buffer forever
+    """
+    def __init__(self, max_line_length: int = 1024 * 1024):
+        self._max_line_length = int(max_line_length)
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[str]:
+        """Adds a chunk of bytes, returning any lines it completed"""
+        if b"\r" in data:
+            data = data.replace(b"\r", b"\n")
+        buffer = self._buffer
+        buffer += data
+
+        # Everything up to the last line break is complete
+        end = buffer.rfind(b"\n")
+        complete = bytes(buffer[:end]) if end != -1 else b""
+        del buffer[:end + 1]
+
+        # Break up whatever is too long to wait for the rest of
+        if len(buffer) >= self._max_line_length:
+            cut = len(buffer) - len(buffer) % self._max_line_length
+            complete += b"\n" + bytes(buffer[:cut])
+            del buffer[:cut]
+
+        return self._decode(complete)
+
+    def flush(self) -> List[str]:
+        """Returns whatever is left as a final line once the stream has ended"""
+        remaining = bytes(self._buffer)
+        self._buffer.clear()
+        return self._decode(remaining)
+
+    def take_remaining(self) -> bytes:
+        """Removes and returns any bytes not yet making up a whole line"""
+        remaining = bytes(self._buffer)
+        self._buffer.clear()
+        return remaining
+
+    async def lines(self, chunks: AsyncIterable[Optional[bytes]]) -> AsyncGenerator[str, None]:
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            for line in self.feed(chunk):
+                yield line
+
+        for line in self.flush():
+            yield line
+
+    def _decode(self, data: bytes) -> List[str]:
+        lines = []
+        max_length = self._max_line_length
+        for line in data.split(b"\n"):
+            if not line:
+                continue
+            if len(line) > max_length:
+                for i in range(0, len(line), max_length):
+                    lines.append(line[i:i + max_length].decode(errors="replace"))
+            else:
+                lines.append(line.decode(errors="replace"))
+        return lines
+
+
+class FramedSplitter:
+    """
+    Splits sandbox output that starts as JSON lines and may switch to binary frames once negotiated.
+    In binary mode frame payloads are returned as bytes, and any text between frames is split
+    into lines as prints. The sandbox only switches after answering the handshake and then waits for
+    the runner, so a switch never happens part way through a chunk
+    """
+    def __init__(self, max_line_length: int = 1024 * 1024, max_frame_size: int = MAX_FRAME_SIZE):
+        self._lines = LineSplitter(max_line_length)
+        self._max_frame_size = max_frame_size
+        self._buffer = bytearray()
+        self.framing = Framing.JSON
+
+    def set_framing(self, framing: Framing):
+        if framing == Framing.BINARY and self.framing != Framing.BINARY:
+            self._buffer += self._lines.take_remaining()
+        self.framing = framing
+
+    def feed(self, data: bytes) -> List[Union[str, bytes]]:
+        if self.framing != Framing.BINARY:
+            return self._lines.feed(data)
+
+        buffer = self._buffer
+        buffer += data
+        items = []
+        pos = 0
+        while pos < len(buffer):
+            marker = buffer.find(FRAME_MARKER, pos)
+            if marker == -1:
+                # Only text left, keep any incomplete line for later
+                items += self._lines.feed(bytes(buffer[pos:]))
+                pos = len(buffer)
+                break
+
+            if marker > pos:
+                # Text before a frame was flushed before it, so it is complete
+                items += self._lines.feed(bytes(buffer[pos:marker]))
+                items += self._lines.flush()
+                pos = marker
+
+            if len(buffer) - pos < FRAME_HEADER.size:
+                break
+            _, length = FRAME_HEADER.unpack_from(buffer, pos)
+            if length > self._max_frame_size:
+                raise FramingError(f"Frame too large: {length}")
+            end = pos + FRAME_HEADER.size + length
+            if end > len(buffer):
+                break
+            items.append(bytes(buffer[pos + FRAME_HEADER.size:end]))
+            pos = end
+
+        del buffer[:pos]
+        return items
+
+    def flush(self) -> List[Union[str, bytes]]:
+        remaining = self._lines.flush()
+        if len(self._buffer) != 0:
+            # A frame cut short, keep what was sent as a print
+            remaining.append(bytes(self._buffer).decode(errors="replace"))
+            self._buffer.clear()
+        return remaining
+
+    async def items(self, chunks: AsyncIterable[Optional[bytes]]) -> AsyncGenerator[Union[str, bytes], None]:
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            for item in self.feed(chunk):
+                yield item
+
+        for item in self.flush():
+            yield item
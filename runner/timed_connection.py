@@ -1,9 +1,9 @@
 import asyncio
 import time
-from asyncio import wait_for
-from contextlib import asynccontextmanager
-from typing import Coroutine
+from typing import Coroutine, Optional
 
+from runner import tracing
+from runner.deadlines import scheduler
 from runner.logger import logger
 from shared.connection import Connection, ConnectionTimedOutError
 
@@ -17,34 +17,54 @@ class TimedConnection(Connection):
         self._connection = connection
         self._time_remaining = timeout
 
-    @asynccontextmanager
-    async def _timed(self, task: Coroutine):
-        start = time.time()
+    async def _timed(self, operation: Coroutine):
+        """Runs the operation, raising ConnectionTimedOutError if it takes longer than the time remaining.
+        The shared deadline scheduler cancels this task if the time runs out"""
+        logger.debug("Connection %s: Time remaining: %s, running %s", self._connection, self._time_remaining, operation)
+        if self._time_remaining <= 0:
+            operation.close()
+            logger.debug("Connection %s: Timeout", self._connection)
+            raise ConnectionTimedOutError()
+
+        task = asyncio.current_task()
+        start = time.monotonic()
+        deadline = scheduler.schedule(start + self._time_remaining, task)
         try:
-            logger.debug(f"Connection {self._connection}: Time remaining: {self._time_remaining}, running {task}")
-            yield await wait_for(task, self._time_remaining)
-        except asyncio.TimeoutError:
-            logger.debug(f"Connection {self._connection}: Timeout")
-            while True:
-                raise ConnectionTimedOutError()
-        end = time.time()
-        self._time_remaining -= (end - start)
+            return await operation
+        except asyncio.CancelledError:
+            if not deadline.expired:
+                raise
+            if hasattr(task, "uncancel"):
+                task.uncancel()
+            logger.debug("Connection %s: Timeout", self._connection)
+            raise ConnectionTimedOutError()
+        finally:
+            scheduler.cancel(deadline)
+            self._time_remaining -= time.monotonic() - start
 
     def get_prints(self) -> str:
         return self._connection.get_prints()
 
+    @property
+    def supports_board_deltas(self) -> bool:
+        return self._connection.supports_board_deltas
+
+    @property
+    def last_compute_time(self) -> Optional[float]:
+        return self._connection.last_compute_time
+
     async def get_next_message_data(self):
-        async with self._timed(self._connection.get_next_message_data()) as res:
-            return res
+        with tracing.span("receive"):
+            return await self._timed(self._connection.get_next_message_data())
 
     async def close(self):
-        async with self._timed(self._connection.close()) as res:
-            return res
+        with tracing.span("close"):
+            return await self._timed(self._connection.close())
 
     async def send_call(self, method_name, method_args, method_kwargs):
-        async with self._timed(self._connection.send_call(method_name, method_args, method_kwargs)) as res:
-            return res
+        with tracing.span("send_call", method=method_name):
+            return await self._timed(self._connection.send_call(method_name, method_args, method_kwargs))
 
     async def send_ping(self):
-        async with self._timed(self._connection.send_ping()) as res:
-            return res
+        with tracing.span("send_ping"):
+            return await self._timed(self._connection.send_ping())
@@ -0,0 +1,159 @@
+import asyncio
+import itertools
+import traceback
+from collections import Counter, deque
+from typing import List, Dict, Optional, Tuple, Iterable, Callable, Awaitable
+
+from cuwais.common import Outcome
+from cuwais.gamemodes import Gamemode
+
+from runner import gamemode_runner
+from runner.admission import Priority, QueueFullError
+from runner.logger import logger
+from runner.results import ParsedResult
+
+FORMAT_EXPLICIT = "explicit"
+FORMAT_ROUND_ROBIN = "round_robin"
+FORMAT_SWISS = "swiss"
+
+
+class InvalidPairingsError(ValueError):
+    pass
+
+
+def round_robin(submissions: List[str], player_count: int, double: bool = False) -> List[List[str]]:
+    """Every group of player_count submissions plays once, or once in every seating order if double is set"""
+    groups = itertools.permutations(submissions, player_count) if double \
+        else itertools.combinations(submissions, player_count)
+    return [list(group) for group in groups]
+
+
+def swiss_round(submissions: List[str], scores: Dict[str, float],
+                previous_pairings: Iterable[Iterable[str]] = ()) -> Tuple[List[List[str]], Optional[str]]:
+    """Pairs submissions with similar scores for a single two player swiss round, avoiding rematches where
+    possible. Returns the pairings and the submission given a bye, if there are an odd number"""
+    played = {frozenset(pairing) for pairing in previous_pairings}
+    ranked = sorted(submissions, key=lambda s: (-scores.get(s, 0.0), s))
+
+    bye = None
+    if len(ranked) % 2 == 1:
+        bye = ranked.pop()
+
+    pairings = []
+    while len(ranked) != 0:
+        first = ranked.pop(0)
+        opponent = next((s for s in ranked if frozenset((first, s)) not in played), ranked[0])
+        ranked.remove(opponent)
+        pairings.append([first, opponent])
+
+    return pairings, bye
+
+
+def group_by_submission(pairings: List[List[str]]) -> List[List[str]]:
+    """Orders games so that those sharing a submission run next to each other, starting with the busiest
+    submissions, so that the warm containers and prepared images for a submission are reused while hot"""
+    remaining = list(pairings)
+    ordered = []
+    while len(remaining) != 0:
+        counts = Counter(s for pairing in remaining for s in set(pairing))
+        busiest = max(counts, key=lambda s: (counts[s], s))
+        ordered += [pairing for pairing in remaining if busiest in pairing]
+        remaining = [pairing for pairing in remaining if busiest not in pairing]
+    return ordered
+
+
+class Standing:
+    def __init__(self, submission: str):
+        self.submission = submission
+        self.played = 0
+        self.wins = 0
+        self.losses = 0
+        self.draws = 0
+        self.errors = 0
+
+    @property
+    def points(self) -> float:
+        return self.wins + 0.5 * self.draws
+
+    def as_dict(self) -> dict:
+        return {"submission": self.submission, "points": self.points, "played": self.played, "wins": self.wins,
+                "losses": self.losses, "draws": self.draws, "errors": self.errors}
+
+
+def standings(pairings: List[List[str]], results: List[Optional[ParsedResult]]) -> List[dict]:
+    table: Dict[str, Standing] = dict()
+    for pairing, result in zip(pairings, results):
+        for i, submission in enumerate(pairing):
+            standing = table.setdefault(submission, Standing(submission))
+            if result is None:
+                standing.errors += 1
+                continue
+            standing.played += 1
+            outcome = result.outcomes[i]
+            if outcome == Outcome.Win:
+                standing.wins += 1
+            elif outcome == Outcome.Loss:
+                standing.losses += 1
+            else:
+                standing.draws += 1
+
+    ranked = sorted(table.values(), key=lambda s: (-s.points, -s.wins, s.submission))
+    return [standing.as_dict() for standing in ranked]
+
+
+# How often a batch waiting for room looks again, in case games from elsewhere have finished
+_CAPACITY_POLL_SECONDS = 1.0
+
+
+async def run_batch(gamemode: Gamemode, pairings: List[List[str]], options: dict, turns: int,
+                    concurrency: int, run_game: Callable[..., Awaitable[ParsedResult]] = gamemode_runner.run,
+                    free_sandboxes: Optional[Callable[[], Awaitable[int]]] = None) -> dict:
+    """Runs every pairing given, returning each game's result and the standings. Games are started whenever
+    free_sandboxes says there is room for their players, up to concurrency at a time, and always at least one.
+    Games are run with gamemode_runner.run unless another function taking the same arguments is given"""
+    for pairing in pairings:
+        if len(pairing) != gamemode.player_count:
+            raise InvalidPairingsError(f"Expected {gamemode.player_count} submissions per game, got {pairing}")
+
+    ordered = group_by_submission(pairings)
+    limit = max(1, int(concurrency))
+
+    async def play(pairing: List[str]) -> Tuple[Optional[ParsedResult], Optional[str]]:
+        try:
+            while True:
+                try:
+                    return await run_game(gamemode, pairing, dict(options), turns, priority=Priority.BATCH), None
+                except QueueFullError as e:
+                    # Batches are in no hurry, so wait for the queue to drain rather than lose the game
+                    await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            return None, str(e) or type(e).__name__
+
+    logger.debug(f"Running batch of {len(ordered)} games of {gamemode.name}")
+    waiting = deque(enumerate(ordered))
+    running: Dict[asyncio.Task, int] = dict()
+    outcomes: List[Tuple[Optional[ParsedResult], Optional[str]]] = [(None, None)] * len(ordered)
+    try:
+        while len(waiting) != 0 or len(running) != 0:
+            room = await free_sandboxes() if free_sandboxes is not None else -1
+            unlimited = room < 0
+            while len(waiting) != 0 and len(running) < limit \
+                    and (unlimited or room >= gamemode.player_count or len(running) == 0):
+                index, pairing = waiting.popleft()
+                running[asyncio.create_task(play(pairing))] = index
+                room -= gamemode.player_count
+
+            # Nothing from this batch finishing in time means the room was taken by other games, so look again
+            done, _ = await asyncio.wait(running, timeout=_CAPACITY_POLL_SECONDS if len(waiting) != 0 else None,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                outcomes[running.pop(task)] = task.result()
+    finally:
+        for task in running:
+            task.cancel()
+    results = [result for result, _ in outcomes]
+
+    return {"games": [{"submissions": pairing, "result": result, "error": error}
+                      for pairing, (result, error) in zip(ordered, outcomes)],
+            "standings": standings(ordered, results)}
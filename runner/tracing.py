@@ -0,0 +1,108 @@
+import asyncio
+import contextvars
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+from runner.logger import logger
+
+
+class _NoSpan:
+    """Stands in for a span when no trace is being recorded, so that disabled tracing costs one lookup"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    def __init__(self, trace: "Trace", name: str, args: dict):
+        self._trace = trace
+        self._name = name
+        self._args = args
+        self._start = 0
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self._args["error"] = exc_type.__name__
+        self._trace.add(self._name, self._start, end - self._start, self._args)
+        return False
+
+
+class Trace:
+    """
+    Records spans in the Chrome trace event format, viewable in chrome://tracing or Perfetto.
+    Each asyncio task gets its own track, so that work done concurrently, such as setting up
+    each player's container, does not overlap on one track
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self._origin = time.perf_counter_ns()
+        self._events: List[dict] = []
+        self._tracks: Dict[int, int] = dict()
+
+    def _track(self) -> int:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        key = id(task)
+        track = self._tracks.get(key)
+        if track is None:
+            track = self._tracks[key] = len(self._tracks)
+        return track
+
+    def add(self, name: str, start_ns: int, duration_ns: int, args: dict):
+        self._events.append({"name": name, "ph": "X", "pid": 0, "tid": self._track(),
+                             "ts": (start_ns - self._origin) / 1000, "dur": duration_ns / 1000,
+                             "args": args})
+
+    def as_dict(self) -> dict:
+        metadata = [{"name": "process_name", "ph": "M", "pid": 0, "args": {"name": self.name}}]
+        return {"traceEvents": metadata + self._events, "displayTimeUnit": "ms"}
+
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+def span(name: str, **args):
+    """A context manager recording how long its block took in the current trace, if there is one"""
+    trace = _current.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name, args)
+
+
+@contextmanager
+def record(name: str):
+    """Records every span made within the with block, and any tasks it starts, into a new trace"""
+    trace = Trace(name)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def _write(path: str, trace: Trace):
+    with open(path, "w") as f:
+        json.dump(trace.as_dict(), f)
+
+
+async def save(trace: Trace, trace_dir: str):
+    path = os.path.join(trace_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{trace.name}-{id(trace):x}.json")
+    try:
+        await asyncio.get_event_loop().run_in_executor(None, _write, path, trace)
+    except OSError as e:
+        logger.error(f"Could not write trace to {path}: {e}")
@@ -1,29 +1,74 @@
+import asyncio
+import functools
 import json
 import logging
+import os
 import traceback
+from typing import List, Dict, Optional
 
 from cuwais.gamemodes import Gamemode
 from fastapi import FastAPI, HTTPException, WebSocket
+from starlette.websockets import WebSocketDisconnect
 from fastapi_utils.timing import add_timing_middleware
-from starlette.responses import Response
+from pydantic import BaseModel
+from starlette.responses import Response, StreamingResponse, PlainTextResponse
 
-from runner import gamemode_runner
+from runner import gamemode_runner, tournament, metrics, executors, admission
+from runner.coordinator import coordinator, RemoteGameError
+from runner.result_cache import result_cache
+from runner.spectators import hub
+from runner.admission import Priority, QueueFullError
 from runner.logger import logger
+from runner.reaper import persistent_runner_id
 from runner.web_connection import websocket_game
 from shared.message_connection import Encoder
 
-from config import DEBUG, PROFILE
+from config import DEBUG, PROFILE, get_option
 
 app = FastAPI(root_path="/")
 if DEBUG and PROFILE:
     add_timing_middleware(app, record=logging.info, prefix="app", exclude="untimed")
 
 
-@app.get('/run')
-async def run_endpoint(submissions: str, options: str = None, gamemode: str = "chess", moves: int = 2 << 32):
+@app.on_event("startup")
+async def startup():
+    result_cache.configure(get_option("submission_runner.result_cache_gamemodes", []),
+                           ttl_seconds=float(get_option("submission_runner.result_cache_ttl_seconds", 3600)),
+                           max_entries=int(get_option("submission_runner.result_cache_max_entries", 1024)))
+    # A coordinator only routes games to the runner nodes it is given, so needs no Docker daemon of its own
+    nodes = [url.strip() for url in os.environ.get("COORDINATOR_NODES", "").split(",") if url.strip() != ""]
+    if len(nodes) != 0:
+        poll_interval = float(get_option("submission_runner.coordinator_poll_seconds", 2))
+        await coordinator.start(nodes, poll_interval_seconds=poll_interval,
+                                replicas=int(get_option("submission_runner.coordinator_replicas", 64)),
+                                max_attempts=int(get_option("submission_runner.coordinator_max_attempts", 3)))
+        return
+
+    hub.buffer_size = int(get_option("submission_runner.spectator_buffer_size", 64))
+    hub.max_coalesces = int(get_option("submission_runner.spectator_max_coalesces", 8))
+    runner_id = os.environ.get("RUNNER_ID") or get_option("submission_runner.runner_id") \
+        or persistent_runner_id(str(get_option("submission_runner.runner_id_file", "/tmp/sandbox/runner_id")))
+    processes = int(get_option("submission_runner.executor_processes", 0))
+    if processes > 0:
+        await executors.pool.start(processes, runner_id)
+    else:
+        await executors.start_local(runner_id)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if coordinator.enabled:
+        await coordinator.stop()
+    elif executors.pool.enabled:
+        await executors.pool.stop()
+    else:
+        await executors.stop_local()
+
+
+def _parse_run_request(submissions: str, options: str, gamemode: str, priority: str):
     try:
         submissions = json.loads(submissions)
-        options = json.loads(options)
+        options = json.loads(options) if options is not None else None
     except json.JSONDecodeError:
         raise HTTPException(status_code=422,
                             detail=f"Invalid json string")
@@ -42,7 +87,51 @@ async def run_endpoint(submissions: str, options: str = None, gamemode: str = "c
         options = {}
 
     try:
-        parsed = await gamemode_runner.run(gamemode, submissions, options, moves)
+        priority = Priority.from_name(priority)
+    except KeyError:
+        raise HTTPException(status_code=422,
+                            detail=f"Unknown priority: {priority}")
+
+    return submissions, options, gamemode, priority
+
+
+def _queue_full(e: QueueFullError) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
+
+
+def _run_game(deterministic: bool = False):
+    """Games are run here, in an executor process, or passed on to a runner node when coordinating.
+    Runner nodes are told whether the submissions are deterministic, so that they can cache the result too"""
+    if coordinator.enabled:
+        return functools.partial(coordinator.run, deterministic=deterministic)
+    if executors.pool.enabled:
+        return executors.pool.run
+    return gamemode_runner.run
+
+
+async def _free_sandboxes() -> int:
+    """How many more sandboxes there is room for wherever games are run, or -1 if there is no limit"""
+    if coordinator.enabled:
+        return coordinator.free_sandboxes()
+    if executors.pool.enabled:
+        return (await executors.pool.stats())["admission"]["free_sandboxes"]
+    return admission.controller.free_sandboxes()
+
+
+@app.get('/run')
+async def run_endpoint(submissions: str, options: str = None, gamemode: str = "chess", moves: int = 2 << 32,
+                       priority: str = "normal", trace: bool = False, seed: int = None, deterministic: bool = False):
+    submissions, options, gamemode, priority = _parse_run_request(submissions, options, gamemode, priority)
+    if seed is not None:
+        options["seed"] = seed
+
+    try:
+        parsed = await result_cache.run(_run_game(deterministic), gamemode, submissions, options, moves, priority=priority,
+                                        trace=trace, deterministic=deterministic)
+    except QueueFullError as e:
+        raise _queue_full(e)
+    except RemoteGameError as e:
+        raise HTTPException(status_code=e.status, detail=e.detail)
     except:
         logger.error(traceback.format_exc())
         raise
@@ -50,10 +139,174 @@ async def run_endpoint(submissions: str, options: str = None, gamemode: str = "c
     return Response(content=json.dumps(parsed, cls=Encoder), media_type="application/json")
 
 
+def _encode_event(event: dict, stream_format: str) -> str:
+    data = json.dumps(event, cls=Encoder)
+    if stream_format == "sse":
+        return f"event: {event['type']}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+@app.get('/run/stream')
+async def run_stream_endpoint(submissions: str, options: str = None, gamemode: str = "chess", moves: int = 2 << 32,
+                              priority: str = "normal", format: str = "ndjson", seed: int = None):
+    if format not in {"ndjson", "sse"}:
+        raise HTTPException(status_code=422,
+                            detail=f"Unknown stream format: {format}")
+    submissions, options, gamemode, priority = _parse_run_request(submissions, options, gamemode, priority)
+    if seed is not None:
+        options["seed"] = seed
+
+    # Events are put on the queue as the game runs, then None once it has finished
+    events = asyncio.Queue()
+
+    async def play():
+        try:
+            return await _run_game()(gamemode, submissions, options, moves, priority=priority,
+                                     listener=events.put_nowait)
+        finally:
+            events.put_nowait(None)
+
+    game = asyncio.create_task(play())
+
+    # Wait for the game to start so that a full queue or a failure during set up gets a proper status code
+    try:
+        first = await events.get()
+    except asyncio.CancelledError:
+        game.cancel()
+        raise
+    if first is None:
+        try:
+            await game
+        except QueueFullError as e:
+            raise _queue_full(e)
+        except RemoteGameError as e:
+            raise HTTPException(status_code=e.status, detail=e.detail)
+        except:
+            logger.error(traceback.format_exc())
+            raise
+
+    async def stream():
+        try:
+            event = first
+            while event is not None:
+                yield _encode_event(event, format)
+                event = await events.get()
+
+            try:
+                parsed = await game
+            except Exception as e:
+                logger.error(traceback.format_exc())
+                yield _encode_event({"type": "error", "error": str(e) or type(e).__name__}, format)
+                return
+
+            # The moves have already been sent, so only the results are left
+            yield _encode_event({"type": "result", "submission_results": parsed["submission_results"]}, format)
+        finally:
+            game.cancel()
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(stream(), media_type=media_type)
+
+
+@app.get('/status')
+async def status_endpoint():
+    if coordinator.enabled:
+        status = {"coordinator": coordinator.stats()}
+    elif executors.pool.enabled:
+        status = await executors.pool.stats()
+    else:
+        status = executors.local_stats()
+    status["result_cache"] = result_cache.stats()
+    return status
+
+
+@app.get('/metrics')
+async def metrics_endpoint():
+    # Games run in executor processes are measured there, so their metrics are added in
+    snapshots = await executors.pool.metrics() if executors.pool.enabled else []
+    return PlainTextResponse(metrics.render(snapshots), media_type="text/plain; version=0.0.4")
+
+
+class BatchRequest(BaseModel):
+    gamemode: str = "chess"
+    format: str = tournament.FORMAT_EXPLICIT
+    submissions: List[str] = []
+    pairings: List[List[str]] = []
+    double_round_robin: bool = False
+    scores: Dict[str, float] = {}
+    previous_pairings: List[List[str]] = []
+    options: Optional[dict] = None
+    moves: int = 2 << 32
+
+
+@app.post('/batch')
+async def batch_endpoint(request: BatchRequest):
+    gamemode = Gamemode.get(request.gamemode)
+
+    bye = None
+    if request.format == tournament.FORMAT_EXPLICIT:
+        pairings = request.pairings
+    elif request.format == tournament.FORMAT_ROUND_ROBIN:
+        pairings = tournament.round_robin(request.submissions, gamemode.player_count, request.double_round_robin)
+    elif request.format == tournament.FORMAT_SWISS:
+        if gamemode.player_count != 2:
+            raise HTTPException(status_code=422,
+                                detail="Swiss rounds need a two player gamemode")
+        pairings, bye = tournament.swiss_round(request.submissions, request.scores, request.previous_pairings)
+    else:
+        raise HTTPException(status_code=422,
+                            detail=f"Unknown batch format: {request.format}")
+
+    options = request.options if request.options is not None else {}
+    concurrency = int(get_option("submission_runner.batch_concurrency", 4))
+
+    try:
+        batch = await tournament.run_batch(gamemode, pairings, options, request.moves, concurrency,
+                                           run_game=_run_game(), free_sandboxes=_free_sandboxes)
+    except tournament.InvalidPairingsError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    batch["bye"] = bye
+
+    return Response(content=json.dumps(batch, cls=Encoder), media_type="application/json")
+
+
 @app.websocket("/ws/run")
 async def websocket_endpoint(websocket: WebSocket):
+    if coordinator.enabled or executors.pool.enabled:
+        # The players' moves come over this websocket, so the game has to be run in this process
+        await websocket.accept()
+        await websocket.send_text(json.dumps({"type": "error",
+                                              "error": "Websocket games are not run by coordinators or runners with "
+                                                       "executor processes"}))
+        await websocket.close()
+        return
+
     try:
         await websocket_game(websocket)
     except:
         logger.error(traceback.format_exc())
         raise
+
+
+@app.get('/games')
+async def games_endpoint():
+    return {"games": hub.games()}
+
+
+@app.websocket("/ws/spectate/{game_id}")
+async def spectate_endpoint(websocket: WebSocket, game_id: str):
+    await websocket.accept()
+    frames = hub.subscribe(game_id)
+    if frames is None:
+        await websocket.send_text(json.dumps({"type": "error", "error": f"No running game {game_id}"}))
+        await websocket.close()
+        return
+
+    try:
+        async for frame in frames:
+            await websocket.send_text(frame)
+    except WebSocketDisconnect:
+        return
+    finally:
+        await frames.aclose()
+    await websocket.close()
@@ -0,0 +1,121 @@
+import asyncio
+import re
+import traceback
+from typing import Awaitable, Callable, Optional
+
+import aiodocker
+from aiodocker import DockerError
+from aiodocker.volumes import DockerVolume
+
+from runner.artifact_cache import Artifact, ArtifactCache
+from runner.logger import logger
+
+SUBMISSION_VOLUME_PREFIX = "aiwarssoc-submission-"
+SUBMISSION_VOLUME_LABEL = "aiwarssoc.submission"
+SUBMISSION_VOLUME_OWNER_LABEL = "aiwarssoc.submission-owner"
+SUBMISSION_VOLUME_DIGEST_LABEL = "aiwarssoc.submission-digest"
+
+
+class SubmissionVolumes:
+    """
+    Fills a named volume with the sandbox scripts and a submission once per submission hash,
+    ready to be mounted read only into sandboxes. Volumes are reference counted and garbage
+    collected once no game has used them for a grace period. Each volume is named and labelled with the
+    provisioning digest, so volumes filled from other sandbox scripts or another base image are never used
+    """
+    def __init__(self, populator: Callable[[aiodocker.Docker, str, str], Awaitable[None]]):
+        self._populator = populator
+        self._grace = 0.0
+        self._owner = ""
+        self._digest = ""
+        self._prefix = SUBMISSION_VOLUME_PREFIX
+
+        self._docker: Optional[aiodocker.Docker] = None
+        self._volumes = ArtifactCache()
+        self._gc_task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._docker is not None
+
+    def stats(self) -> dict:
+        return {"volumes": len(self._volumes), "in_use": self._volumes.in_use()}
+
+    async def start(self, docker: aiodocker.Docker, gc_grace_seconds: float, owner: str = "", digest: str = ""):
+        self._grace = float(gc_grace_seconds)
+        self._owner = owner
+        self._digest = digest
+        if owner:
+            self._prefix = SUBMISSION_VOLUME_PREFIX + re.sub(r"[^a-zA-Z0-9_.-]+", "-", owner) + "-"
+        self._docker = docker
+
+        # Adopt any volumes left over from a previous run by the same owner, they will be collected if unused,
+        # and delete those filled by a different version of the sandbox.
+        # Runners sharing a Docker daemon each have their own volumes, so never collect each other's
+        stale = 0
+        existing = await self._docker.volumes.list()
+        for volume in existing.get("Volumes") or []:
+            labels = volume.get("Labels") or {}
+            submission_hash = labels.get(SUBMISSION_VOLUME_LABEL)
+            if submission_hash is None or labels.get(SUBMISSION_VOLUME_OWNER_LABEL, "") != self._owner:
+                continue
+            if labels.get(SUBMISSION_VOLUME_DIGEST_LABEL, "") == self._digest:
+                self._volumes.adopt(submission_hash, Artifact(volume["Name"]))
+            else:
+                stale += 1
+                await self._delete(Artifact(volume["Name"]))
+        logger.debug(f"Submission volumes started with {len(self._volumes)} volumes, deleted {stale} stale volumes")
+
+        self._gc_task = asyncio.create_task(self._gc_loop())
+
+    async def stop(self):
+        if self._gc_task is not None:
+            self._gc_task.cancel()
+            await asyncio.gather(self._gc_task, return_exceptions=True)
+            self._gc_task = None
+        await self._volumes.stop()
+        self._docker = None
+
+    async def acquire(self, submission_hash: str) -> str:
+        """Gets the name of the populated volume for the given submission, creating it if needed.
+        Every call must be matched by a call to release once the container mounting the volume is gone"""
+        volume, _ = await self._volumes.acquire(submission_hash, lambda: self._populate(submission_hash))
+        return volume.name
+
+    def release(self, submission_hash: str):
+        self._volumes.release(submission_hash)
+
+    async def _populate(self, submission_hash: str) -> Artifact:
+        name = self._prefix + submission_hash
+        if self._digest:
+            name += "-" + self._digest
+        logger.debug(f"Populating submission volume {name}")
+        await self._docker.volumes.create({"Name": name, "Labels": {SUBMISSION_VOLUME_LABEL: submission_hash,
+                                                                    SUBMISSION_VOLUME_OWNER_LABEL: self._owner,
+                                                                    SUBMISSION_VOLUME_DIGEST_LABEL: self._digest}})
+        volume = Artifact(name)
+        try:
+            await self._populator(self._docker, submission_hash, name)
+        except BaseException:
+            await self._delete(volume)
+            raise
+        return volume
+
+    async def _gc_loop(self):
+        while True:
+            await asyncio.sleep(max(self._grace / 2, 1))
+            await self.collect()
+
+    async def collect(self):
+        """Deletes every volume that no game has used for at least the grace period"""
+        for submission_hash, _ in self._volumes.items():
+            # Checked again right before each volume is taken, as a game may have acquired it while
+            # the last one was being deleted. Once removed, a game wanting it populates a new one
+            await self._volumes.remove(submission_hash, self._delete, unused_for=self._grace)
+
+    async def _delete(self, volume: Artifact):
+        logger.debug(f"Deleting submission volume {volume.name}")
+        try:
+            await DockerVolume(self._docker, volume.name).delete()
+        except DockerError:
+            logger.error(traceback.format_exc())
@@ -9,6 +9,7 @@ import queue
 from starlette.websockets import WebSocketDisconnect
 
 from runner import gamemode_runner
+from runner.admission import Priority, QueueFullError
 from runner.gamemode_runner import Gamemode
 from runner.logger import logger
 from shared.message_connection import Encoder, Decoder
@@ -66,7 +67,12 @@ def _make_send_fn(websocket: WebSocket):
 async def _run_game_coroutine(submissions, connection, send_fn):
     gamemode, options = Gamemode.get_from_config()
     options["turn_time"] = config_file.get("gamemode.options.player_turn_time")
-    result = await gamemode_runner.run(gamemode, submissions, options, connections=[connection])
+    try:
+        result = await gamemode_runner.run(gamemode, submissions, options, connections=[connection],
+                                           priority=Priority.INTERACTIVE)
+    except QueueFullError as e:
+        await send_fn({"type": "error", "error": str(e), "retry_after": e.retry_after})
+        return
 
     send_fn({"type": "result", "result": dict(result)})
 
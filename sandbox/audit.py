@@ -0,0 +1,155 @@
+"""
+Finds everything in the sandbox that a game could fill without limit. The filesystem is walked with os.scandir on
+several threads at once, skipping mounts that nothing can be written to, and each writable path is judged by the
+free space of its filesystem rather than by writing to it.
+"""
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Set, Tuple
+
+# A writable path with more space than this behind it could be used to fill the host's disk
+UNBOUNDED_BYTES = 16 * 1024 * 1024
+
+# Filesystems made up by the kernel, which hold no data a game could grow
+_SAFE_FILESYSTEMS = {"proc", "sysfs", "cgroup", "cgroup2", "devpts", "mqueue", "securityfs", "debugfs", "tracefs",
+                     "pstore", "bpf", "configfs", "fusectl", "binfmt_misc", "hugetlbfs"}
+
+_OCTAL_ESCAPE = re.compile(r"\\([0-7]{3})")
+
+
+def _unescape(path: str) -> str:
+    return _OCTAL_ESCAPE.sub(lambda m: chr(int(m.group(1), 8)), path)
+
+
+def safe_mounts(mountinfo_path: str = "/proc/self/mountinfo") -> Set[str]:
+    """The mount points that need not be walked, as they are read only or not real storage"""
+    safe = set()
+    try:
+        with open(mountinfo_path) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return safe
+
+    for line in lines:
+        fields, _, super_fields = line.partition(" - ")
+        fields = fields.split()
+        super_fields = super_fields.split()
+        if len(fields) < 6 or len(super_fields) < 3:
+            continue
+        mount_point = _unescape(fields[4])
+        read_only = "ro" in fields[5].split(",") or "ro" in super_fields[2].split(",")
+        if read_only or super_fields[0] in _SAFE_FILESYSTEMS:
+            safe.add(mount_point)
+    # Whatever is mounted on the root is always walked, as it is where everything else is found
+    safe.discard("/")
+    return safe
+
+
+# Directories this near the root are handed out to the threads one at a time, and everything deeper is walked by
+# whichever thread found it, so that the threads share the work without a task for every directory
+_SPLIT_DEPTH = 2
+
+
+def _walk(path: str, safe: Set[str], whole_tree: bool, deadline: float) -> Tuple[List[str], List[str], int, bool]:
+    """Walks a directory, and everything under it if whole_tree is set, returning the subdirectories left to walk,
+    every writable file and directory found, how many entries were looked at, and whether it finished in time"""
+    left = []
+    writable = []
+    scanned = 0
+    stack = [path]
+    while len(stack) != 0:
+        if time.perf_counter() > deadline:
+            return left + stack, writable, scanned, False
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    scanned += 1
+                    try:
+                        if entry.is_symlink():
+                            continue  # Checked where it points, if that is anywhere in the walk
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        if is_dir and entry.path in safe:
+                            continue
+                        # Devices, pipes and sockets hold nothing, so only files and directories take space
+                        if not is_dir and not entry.is_file(follow_symlinks=False):
+                            continue
+                    except OSError:
+                        continue
+                    if os.access(entry.path, os.W_OK):
+                        writable.append(entry.path)
+                    if is_dir:
+                        (stack if whole_tree else left).append(entry.path)
+        except OSError:
+            pass  # Not readable, so not walkable by the game either
+    return left, writable, scanned, True
+
+
+def _free_bytes(path: str) -> int:
+    try:
+        stats = os.statvfs(path)
+    except OSError:
+        return 0
+    return stats.f_bavail * stats.f_frsize
+
+
+def audit(root: str = "/", time_budget: float = 2.0, workers: int = 8) -> dict:
+    """
+    Walks everything under root that could be written to, returning the writable paths by whether they are bounded.
+    Stops at the time budget, in which case the audit is marked incomplete and only covers what was walked
+    """
+    start = time.perf_counter()
+    deadline = start + float(time_budget)
+    safe = safe_mounts()
+
+    writable = [root] if os.access(root, os.W_OK) else []
+    scanned = 0
+    complete = True
+
+    pool = ThreadPoolExecutor(max_workers=int(workers))
+    try:
+        depths = {pool.submit(_walk, root, safe, False, deadline): 0}
+        pending = set(depths)
+        while len(pending) != 0:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                complete = False
+                for future in pending:
+                    future.cancel()
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                directories, found, count, finished = future.result()
+                writable.extend(found)
+                scanned += count
+                complete = complete and finished
+                if not finished:
+                    continue
+                depth = depths.pop(future) + 1
+                for directory in directories:
+                    walk = pool.submit(_walk, directory, safe, depth >= _SPLIT_DEPTH, deadline)
+                    depths[walk] = depth
+                    pending.add(walk)
+    finally:
+        pool.shutdown(wait=False)
+
+    # Paths on the same filesystem share their free space, so each filesystem is only asked once
+    free_by_device: Dict[int, int] = dict()
+    bounded: Dict[str, int] = dict()
+    unbounded: List[str] = []
+    for path in writable:
+        try:
+            device = os.stat(path, follow_symlinks=False).st_dev
+        except OSError:
+            continue
+        if device not in free_by_device:
+            free_by_device[device] = _free_bytes(path)
+        if free_by_device[device] >= UNBOUNDED_BYTES:
+            unbounded.append(path)
+        else:
+            bounded[path] = free_by_device[device]
+
+    return {"complete": complete, "seconds": time.perf_counter() - start, "scanned": scanned,
+            "unbounded": sorted(unbounded), "bounded": bounded}
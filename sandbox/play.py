@@ -1,42 +1,65 @@
 import asyncio
 import builtins
-import os
 import sys
+import time
 import traceback
 
-from sandbox import player_import, info
-from shared.exceptions import MissingFunctionError, ExceptionTraceback, FailsafeError
+import chess
+
+from sandbox import player_import, info, audit
+from shared.board_session import BoardSession, BoardResync, BoardDelta
+from shared.exceptions import MissingFunctionError, ExceptionTraceback
+from shared.framing import Framing
 from shared.message_connection import MessagePrintConnection
 from shared.connection import ConnectionTimedOutError, ConnectionNotActiveError
 
 
-def failsafes():
-    # Check nothing is writable
-    for path in info.get_all_writable():
-        is_dir = os.path.isdir(path)
-        if is_dir:
-            path = os.path.join(path, "test.txt")
-        if not is_dir:
-            if path.startswith("/dev") or path.startswith("/proc"):
-                continue
-        if info.write_until_full(path, remove=is_dir) == "No Limit":
-            raise FailsafeError(f"Writable {'directory' if is_dir else 'file'}: " + path)
+_board_session = BoardSession()
 
 
 def call(method_name, method_args, method_kwargs):
+    # Swap any board deltas for our copy of the board, asking for the whole board if we are out of sync
+    for key, value in method_kwargs.items():
+        if not isinstance(value, (chess.Board, BoardDelta)):
+            continue
+        board = _board_session.resolve(value)
+        if board is None:
+            return BoardResync()
+        method_kwargs[key] = board
+
     fun = player_import.get_player_function("ai", method_name)
     result = fun(*method_args, **method_kwargs)
     return "" if result is None else result
 
 
-def ping():
-    return "pong"
+def preload(module_name, function_names):
+    # Any error importing the submission is left to be raised again by the first call, as it would have been
+    try:
+        missing = player_import.preload(module_name, function_names)
+    except Exception:
+        traceback.print_exc()
+        return {"missing": [], "error": True}
+    return {"missing": missing, "error": False}
+
+
+def ping(framing=None):
+    if framing is None:
+        return "pong"
+
+    # Agree to any framing we know of, falling back to JSON lines otherwise
+    supported = [f.value for f in Framing]
+    return {"framing": framing if framing in supported else Framing.JSON.value}
 
 
 def get_info():
     return info.get_info()
 
 
+def get_audit(time_budget=2.0):
+    # Asked for before the submission is imported, so nothing it does can hide what is writable
+    return audit.audit(time_budget=time_budget)
+
+
 async def get_instructions(connection: MessagePrintConnection):
     while True:
         try:
@@ -50,13 +73,6 @@ async def main():
     connection = MessagePrintConnection()
     instructions = get_instructions(connection)
 
-    # Check that we haven't got any security holes
-    if os.getenv("DEBUG").lower().startswith("t"):
-        try:
-            pass  # failsafes()
-        except FailsafeError:
-            return
-
     # Reduce things that can accidentally go wrong
     def fake_input(*args, **kwargs):
         return ""
@@ -74,13 +90,21 @@ async def main():
             del instruction["type"]
             dispatch = {"call": call,
                         "ping": ping,
-                        "info": get_info}[t]
+                        "preload": preload,
+                        "info": get_info,
+                        "audit": get_audit}[t]
 
             # Execute
+            start = time.perf_counter()
             data = dispatch(**instruction)
+            compute_time = time.perf_counter() - start
+
+            # Sendback, saying how long we took so the runner can work out the latency
+            await connection.send_result(data, compute_time=compute_time)
 
-            # Sendback
-            await connection.send_result(data)
+            # Switch framing only once the answer to the handshake has gone out
+            if t == "ping" and isinstance(data, dict):
+                connection.set_framing(Framing(data["framing"]))
         except MissingFunctionError as e:
             await connection.send_result(e)
             break
@@ -1,15 +1,38 @@
 import importlib
+from typing import Callable, Dict, List, Tuple
 
 from shared.exceptions import MissingFunctionError
 
+_functions: Dict[Tuple[str, str], Callable] = dict()
+
 
 def get_player_function(module_name: str, function_name: str):
+    # Resolved once, so later calls skip the import machinery
+    function = _functions.get((module_name, function_name))
+    if function is not None:
+        return function
+
     try:
         module = importlib.import_module(f'submission.{module_name}')
     except ModuleNotFoundError:
         raise MissingFunctionError()
 
     try:
-        return module.__getattribute__(function_name)
+        function = module.__getattribute__(function_name)
     except AttributeError:
         raise MissingFunctionError()
+
+    _functions[(module_name, function_name)] = function
+    return function
+
+
+def preload(module_name: str, function_names: List[str]) -> List[str]:
+    """Imports the submission and resolves the functions given ahead of the first call to them,
+    returning the names of any that are missing"""
+    missing = []
+    for function_name in function_names:
+        try:
+            get_player_function(module_name, function_name)
+        except MissingFunctionError:
+            missing.append(function_name)
+    return missing
@@ -0,0 +1,162 @@
+"""
+A pre-warmed interpreter for a pooled sandbox container. Started with `zygote.py serve <socket>` when the container
+is made, it imports everything play.py needs and waits. A game then runs `zygote.py` in place of `play.py`, which
+hands its stdin, stdout and stderr to the zygote over the socket. The zygote forks a child to play the game on them,
+and passes back its exit code. Each zygote serves a single game, just as each container does.
+
+Only light modules are imported at the top, as the client side runs in a fresh interpreter for every game.
+"""
+import array
+import os
+import select
+import signal
+import socket
+import sys
+import time
+
+SOCKET_PATH = "/tmp/zygote.sock"
+
+# How long a game waits for a zygote that is still starting before playing without it
+_CONNECT_TIMEOUT = 2.0
+
+
+def _exit_code(status: int) -> int:
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _receive_fds(connection: socket.socket, count: int) -> list:
+    fds = array.array("i")
+    _, ancillary, _, _ = connection.recvmsg(1, socket.CMSG_SPACE(count * fds.itemsize))
+    for level, kind, data in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+    return list(fds)
+
+
+def _drop_privileges():
+    """Everything the game's process can do without, as far as can be done without changing user,
+    which the sandbox cannot do with SETUID dropped"""
+    import ctypes
+    import resource
+
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    try:
+        pr_set_no_new_privs = 38
+        ctypes.CDLL(None, use_errno=True).prctl(pr_set_no_new_privs, 1, 0, 0, 0)
+    except (OSError, AttributeError):
+        pass
+
+
+def _play(fds: list):
+    import asyncio
+    import importlib
+    from sandbox import play
+
+    # Become a fresh process in every way the game can see
+    os.setsid()
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+    # Only close what is open, the limit on open files can be very large
+    for fd in [int(name) for name in os.listdir("/proc/self/fd")]:
+        if fd > 2:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    _drop_privileges()
+
+    # The submission was copied in after the zygote started, so forget what the import system saw then
+    importlib.invalidate_caches()
+
+    asyncio.run(play.main())
+
+
+def serve(path: str = SOCKET_PATH):
+    # Pay for every import a game needs up front
+    import asyncio  # noqa: F401
+    from sandbox import play  # noqa: F401
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(1)
+    connection, _ = listener.accept()
+    listener.close()
+    os.unlink(path)
+
+    fds = _receive_fds(connection, 3)
+    if len(fds) != 3:
+        return
+
+    # Hear about the child exiting through the same select as the client hanging up
+    wakeup_read, wakeup_write = os.pipe()
+    os.set_blocking(wakeup_write, False)
+    signal.set_wakeup_fd(wakeup_write)
+    signal.signal(signal.SIGCHLD, lambda *_: None)
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _play(fds)
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except BaseException:
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    for fd in fds:
+        os.close(fd)
+
+    while True:
+        readable, _, _ = select.select([connection, wakeup_read], [], [])
+        if wakeup_read in readable:
+            os.read(wakeup_read, 4096)
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done != 0:
+                connection.sendall(str(_exit_code(status)).encode())
+                return
+        if connection in readable and connection.recv(1) == b"":
+            # The game was killed, so take the child with it
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            return
+
+
+def connect(path: str = SOCKET_PATH) -> int:
+    """Plays a game through the zygote, returning the game's exit code.
+    Without a zygote to connect to, the game is played in this process as it would have been by play.py"""
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    deadline = time.monotonic() + _CONNECT_TIMEOUT
+    while True:
+        try:
+            connection.connect(path)
+            break
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.monotonic() > deadline:
+                connection.close()
+                import asyncio
+                from sandbox import play
+                asyncio.run(play.main())
+                return 0
+            time.sleep(0.01)
+
+    fds = array.array("i", [sys.stdin.fileno(), sys.stdout.fileno(), sys.stderr.fileno()])
+    connection.sendmsg([b"\0"], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds.tobytes())])
+    code = connection.recv(16)
+    return int(code) if code else 1
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        serve(*sys.argv[2:3])
+    else:
+        sys.exit(connect(*sys.argv[1:2]))
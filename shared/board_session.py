@@ -0,0 +1,50 @@
+from typing import List, Optional, Union
+
+import chess
+import chess.polyglot
+
+
+def board_checksum(board: chess.Board) -> int:
+    return chess.polyglot.zobrist_hash(board)
+
+
+class BoardDelta:
+    """Stands in for a board argument, giving the moves made since the player was last sent the board
+    and a checksum of the board that applying them should give"""
+    def __init__(self, moves: List[str], checksum: int):
+        self.moves = list(moves)
+        self.checksum = int(checksum)
+
+
+class BoardResync:
+    """Sent back in place of a result when a board delta could not be applied, asking for the whole board"""
+    pass
+
+
+class BoardSession:
+    """Keeps a player's own copy of the board, including its move stack, between calls"""
+    def __init__(self):
+        self._board: Optional[chess.Board] = None
+
+    def resolve(self, value: Union[chess.Board, BoardDelta]) -> Optional[chess.Board]:
+        """Turns a board or board delta into the board to hand to the player.
+        Returns None if a delta does not match the board we have, meaning a resync is needed"""
+        if isinstance(value, chess.Board):
+            self._board = value
+            return value.copy()
+
+        if self._board is None:
+            return None
+
+        board = self._board.copy()
+        try:
+            for uci in value.moves:
+                board.push(chess.Move.from_uci(uci))
+        except ValueError:
+            return None
+
+        if board_checksum(board) != value.checksum:
+            return None
+
+        self._board = board
+        return board.copy()
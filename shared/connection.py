@@ -1,7 +1,7 @@
 import abc
 import logging
 import time
-from typing import Any
+from typing import Any, Optional
 
 
 class Connection:
@@ -9,6 +9,16 @@ class Connection:
     def get_prints(self) -> str:
         pass
 
+    @property
+    def supports_board_deltas(self) -> bool:
+        """Whether the other side keeps its own board, so can be sent board deltas instead of whole boards"""
+        return False
+
+    @property
+    def last_compute_time(self) -> Optional[float]:
+        """How long the other side reported spending on the last result received, if it said"""
+        return None
+
     @abc.abstractmethod
     async def get_next_message_data(self):
         """Tries to get a data message from the connection. Raises ConnectionNotActiveError if the container
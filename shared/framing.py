@@ -0,0 +1,51 @@
+import struct
+from enum import Enum, unique
+from typing import BinaryIO, Optional
+
+# The ASCII record separator starts every frame. Text printed through sys.stdout and sys.stderr has it stripped
+# while binary framing is on, so ordinary prints are not mistaken for frames. A process writing raw bytes to its
+# stdout can still write a frame, but only onto its own connection
+FRAME_MARKER = b"\x1e"
+FRAME_HEADER = struct.Struct(">cI")
+
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+@unique
+class Framing(Enum):
+    JSON = "json"
+    BINARY = "binary"
+
+
+class FramingError(RuntimeError):
+    pass
+
+
+def encode_frame(payload: bytes) -> bytes:
+    return FRAME_HEADER.pack(FRAME_MARKER, len(payload)) + payload
+
+
+def _read_exactly(stream: BinaryIO, n: int) -> Optional[bytes]:
+    data = b""
+    while len(data) < n:
+        chunk = stream.read(n - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def read_frame(stream: BinaryIO) -> Optional[bytes]:
+    """Blocks until a whole frame has been read from the stream, returning its payload,
+    or None if the stream ended"""
+    header = _read_exactly(stream, FRAME_HEADER.size)
+    if header is None:
+        return None
+
+    marker, length = FRAME_HEADER.unpack(header)
+    if marker != FRAME_MARKER:
+        raise FramingError(f"Invalid frame marker: {marker}")
+    if length > MAX_FRAME_SIZE:
+        raise FramingError(f"Frame too large: {length}")
+
+    return _read_exactly(stream, length)
@@ -1,13 +1,17 @@
 import builtins
+import sys
+import time
 from enum import Enum, unique
 import json
 from json import JSONDecodeError
-from typing import Iterator, Callable, Any, AsyncGenerator, Awaitable
+from typing import Iterator, Callable, Any, AsyncGenerator, Awaitable, Union, Optional, List
 
 import chess
 
+from shared.board_session import BoardDelta, BoardResync
 from shared.connection import Connection, ConnectionNotActiveError
 from shared.exceptions import MissingFunctionError, ExceptionTraceback, FailsafeError
+from shared.framing import Framing, FramingError, encode_frame, read_frame, FRAME_MARKER
 
 
 @unique
@@ -40,9 +44,11 @@ class MessageInvalidTypeError(MessageParseError):
 
 
 class Message:
-    def __init__(self, message_type: MessageType, data):
+    def __init__(self, message_type: MessageType, data, compute_time: Optional[float] = None):
         self.message_type = MessageType(message_type)
         self.data = data
+        # How long the sender spent working out a result, so the receiver can tell it apart from latency
+        self.compute_time = compute_time
 
     def is_end(self):
         return self.message_type == MessageType.END
@@ -58,12 +64,31 @@ class Message:
 _input = builtins.input
 
 
-async def _input_receiver(input_function=None) -> AsyncGenerator[str, None]:
-    if input_function is None:
-        input_function = _input
-    while True:
-        s = input_function()
-        yield s
+def _print_output(data: Union[str, bytes]):
+    if isinstance(data, bytes):
+        # Anything printed must reach the stream before the frame that follows it
+        sys.stdout.flush()
+        sys.__stdout__.flush()
+        sys.__stdout__.buffer.write(data)
+        sys.__stdout__.buffer.flush()
+    else:
+        print(data, flush=True)
+
+
+class _FramingSafeOutput:
+    """Wraps a text stream so that text written to it cannot start a frame. Bytes written to its buffer, or straight
+    to its file descriptor, are not covered, so can only be kept from forging messages by the runner reading frames
+    from stdout alone"""
+    _marker = FRAME_MARKER.decode()
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, s: str):
+        return self._stream.write(s.replace(self._marker, " "))
+
+    def __getattr__(self, item):
+        return getattr(self._stream, item)
 
 
 class HandshakeFailedError(RuntimeError):
@@ -75,23 +100,93 @@ class HandshakeFailedError(RuntimeError):
 class MessagePrintConnection(Connection):
     _in_stream: AsyncGenerator[Message, None]
 
-    def __init__(self, out_handler: Callable[[str], Any] = None, in_stream: AsyncGenerator[str, None] = None,
-                 name: str = ""):
+    def __init__(self, out_handler: Callable[[Union[str, bytes]], Any] = None,
+                 in_stream: AsyncGenerator[Union[str, bytes], None] = None, name: str = "",
+                 on_framing: Optional[Callable[[Framing], Any]] = None):
         # Set up state
         self._done = False
         self._prints = []
         self._name = name
+        self._framing = Framing.JSON
+        self._on_framing = on_framing
+        self._last_compute_time = None
 
         # Set up output
-        self._out_handler = out_handler if out_handler is not None else lambda x: print(x, flush=True)
+        self._out_handler = out_handler if out_handler is not None else _print_output
 
         # Connect input
-        in_stream_text: AsyncGenerator[str, None] = in_stream if in_stream is not None else _input_receiver()
-        self._in_stream = MessagePrintConnection._make_messages_iterator(in_stream_text)
+        in_stream_text = in_stream if in_stream is not None else self._stdin_receiver()
+        self._in_stream = self._make_messages_iterator(in_stream_text)
+
+    @property
+    def framing(self) -> Framing:
+        return self._framing
+
+    def set_framing(self, framing: Framing):
+        """Switches how every following message is sent and received"""
+        self._framing = Framing(framing)
+        if self._on_framing is not None:
+            self._on_framing(self._framing)
+
+        if self._framing == Framing.BINARY and self._out_handler is _print_output:
+            if not isinstance(sys.stdout, _FramingSafeOutput):
+                sys.stdout = _FramingSafeOutput(sys.stdout)
+            if not isinstance(sys.stderr, _FramingSafeOutput):
+                sys.stderr = _FramingSafeOutput(sys.stderr)
+
+    async def handshake(self, framing: Framing = Framing.JSON) -> float:
+        """Pings the other side, agreeing on the framing for all later messages.
+        Returns the time taken, as with ping"""
+        start_time = time.time_ns()
+        if framing == Framing.JSON:
+            await self.send_ping()
+        else:
+            await self._send("ping", framing=Framing(framing).value)
+
+        response = await self.get_next_message_data()
+        end_time = time.time_ns()
+
+        if isinstance(response, dict) and response.get("framing") is not None:
+            self.set_framing(Framing(response["framing"]))
+
+        return (end_time - start_time) / 1e9
+
+    async def preload(self, module_name: str, function_names: List[str]) -> List[str]:
+        """Asks the other side to import the player's module and resolve its functions before the first call,
+        returning the names of any that are missing"""
+        await self._send("preload", module_name=module_name, function_names=list(function_names))
+        response = await self.get_next_message_data()
+        if not isinstance(response, dict):
+            return []
+        return list(response.get("missing", []))
+
+    async def audit(self, time_budget: float) -> dict:
+        """Asks the other side which paths it could write to, taking no longer than the time budget"""
+        await self._send("audit", time_budget=time_budget)
+        response = await self.get_next_message_data()
+        return response if isinstance(response, dict) else {}
+
+    async def _stdin_receiver(self) -> AsyncGenerator[Union[str, bytes], None]:
+        while True:
+            if self._framing == Framing.BINARY:
+                frame = read_frame(sys.stdin.buffer)
+                if frame is None:
+                    return
+                yield frame
+            else:
+                yield _input()
 
     def get_prints(self) -> str:
         return "\n".join(self._prints)
 
+    @property
+    def supports_board_deltas(self) -> bool:
+        return True
+
+    @property
+    def last_compute_time(self) -> Optional[float]:
+        return self._last_compute_time
+
     async def close(self):
         await self.send_message(Message(MessageType.END, {}))
 
@@ -99,14 +194,21 @@ class MessagePrintConnection(Connection):
         if self._done:
             raise ConnectionNotActiveError()
 
-        async for message in self._in_stream:
-            if message.message_type == MessageType.PRINT:
-                self._prints.append(message.data)
-            elif message.message_type == MessageType.RESULT:
-                return message.data
-            elif message.message_type == MessageType.END:
-                self._done = True
-                raise ConnectionNotActiveError()
+        try:
+            async for message in self._in_stream:
+                if message.message_type == MessageType.PRINT:
+                    self._prints.append(message.data)
+                elif message.message_type == MessageType.RESULT:
+                    self._last_compute_time = message.compute_time
+                    return message.data
+                elif message.message_type == MessageType.END:
+                    self._done = True
+                    raise ConnectionNotActiveError()
+        except FramingError as e:
+            # Nothing more can be read from a stream that has broken framing, so it is as good as closed
+            self._prints.append(f"Framing error: {e}")
+            self._done = True
+            raise ConnectionNotActiveError()
 
         self._done = True
         return await self.get_next_message_data()  # Force an except
@@ -117,14 +219,20 @@ class MessagePrintConnection(Connection):
     async def send_ping(self):
         await self._send("ping")
 
-    @staticmethod
-    async def _make_messages_iterator(lines: AsyncGenerator[str, None]) -> AsyncGenerator[Message, None]:
+    async def _make_messages_iterator(self, lines: AsyncGenerator[Union[str, bytes], None]) \
+            -> AsyncGenerator[Message, None]:
         async for line in lines:
-            line = str(line).strip()
-            if line.isspace() or line == "":
-                continue
-
-            message = MessagePrintConnection._process_line(line)
+            if isinstance(line, bytes):
+                message = MessagePrintConnection._process_frame(line)
+            elif self._framing == Framing.BINARY:
+                # Protocol messages only ever come in frames, so there is nothing to parse
+                message = Message(MessageType.PRINT, line)
+            else:
+                line = str(line).strip()
+                if line.isspace() or line == "":
+                    continue
+
+                message = MessagePrintConnection._process_line(line)
 
             if message.message_type == MessageType.END:
                 yield message
@@ -144,6 +252,13 @@ class MessagePrintConnection(Connection):
 
         return message
 
+    @staticmethod
+    def _process_frame(frame: bytes) -> "Message":
+        try:
+            return MessagePrintConnection._message_from_string(frame.decode())
+        except (MessageParseError, UnicodeDecodeError):
+            return Message(MessageType.PRINT, frame.decode(errors="replace"))
+
     @staticmethod
     def _process_line(line: str) -> "Message":
         # Check for commands
@@ -158,16 +273,18 @@ class MessagePrintConnection(Connection):
     async def _send(self, instruction, **kwargs):
         await self.send_result({"type": instruction, **kwargs})
 
-    async def send_result(self, data):
-        message = Message(MessageType.RESULT, data)
+    async def send_result(self, data, compute_time: Optional[float] = None):
+        message = Message(MessageType.RESULT, data, compute_time)
         await self.send_message(message)
 
     async def send_message(self, message: Message):
         if self._done:
             raise ConnectionNotActiveError()
 
-        s = json.dumps(message, cls=Encoder)
-        res = self._out_handler(s)
+        if self._framing == Framing.BINARY:
+            res = self._out_handler(encode_frame(json.dumps(message, cls=Encoder, separators=(",", ":")).encode()))
+        else:
+            res = self._out_handler(json.dumps(message, cls=Encoder))
         if isinstance(res, Awaitable):
             await res
 
@@ -183,13 +300,18 @@ class Encoder(json.JSONEncoder):
                           FailsafeError: Encoder._failsafe_error,
                           ExceptionTraceback: Encoder._exception_trace,
                           chess.Board: Encoder._chessboard,
-                          chess.Move: Encoder._chess_move}
+                          chess.Move: Encoder._chess_move,
+                          BoardDelta: Encoder._board_delta,
+                          BoardResync: Encoder._board_resync}
 
     @staticmethod
     def _message(message: Message):
-        return {'__custom_type': 'message',
-                'type': str(message.message_type.value),
-                'data': message.data}
+        encoded = {'__custom_type': 'message',
+                   'type': str(message.message_type.value),
+                   'data': message.data}
+        if message.compute_time is not None:
+            encoded['compute'] = message.compute_time
+        return encoded
 
     @staticmethod
     def _missing_function_error(e: MissingFunctionError):
@@ -217,6 +339,16 @@ class Encoder(json.JSONEncoder):
         return {'__custom_type': 'chess_move',
                 'uci': move.uci()}
 
+    @staticmethod
+    def _board_delta(delta: BoardDelta):
+        return {'__custom_type': 'board_delta',
+                'moves': delta.moves,
+                'checksum': delta.checksum}
+
+    @staticmethod
+    def _board_resync(_: BoardResync):
+        return {'__custom_type': 'board_resync'}
+
     def default(self, obj):
         if type(obj) in self._encoders:
             return self._encoders[type(obj)](obj)
@@ -231,11 +363,15 @@ class Decoder(json.JSONDecoder):
                           'failsafe_error': Decoder._failsafe_error,
                           'exception_trace': Decoder._exception_trace,
                           'chessboard': Decoder._chessboard,
-                          'chess_move': Decoder._chess_move}
+                          'chess_move': Decoder._chess_move,
+                          'board_delta': Decoder._board_delta,
+                          'board_resync': Decoder._board_resync}
 
     @staticmethod
     def _message(data: dict):
-        return Message(message_type=MessageType(data['type']), data=data['data'])
+        compute_time = data.get('compute')
+        return Message(message_type=MessageType(data['type']), data=data['data'],
+                       compute_time=float(compute_time) if isinstance(compute_time, (int, float)) else None)
 
     @staticmethod
     def _missing_function_error(e: dict):
@@ -261,6 +397,14 @@ class Decoder(json.JSONDecoder):
     def _chess_move(data: dict):
         return chess.Move.from_uci(data['uci'])
 
+    @staticmethod
+    def _board_delta(data: dict):
+        return BoardDelta(data['moves'], data['checksum'])
+
+    @staticmethod
+    def _board_resync(_: dict):
+        return BoardResync()
+
     def object_hook(self, obj):
         if '__custom_type' not in obj:
             return obj
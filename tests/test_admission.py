@@ -0,0 +1,103 @@
+import asyncio
+import unittest
+
+from runner.admission import AdmissionController, Priority, QueueFullError
+
+
+class TestAdmissionController(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.controller = AdmissionController()
+        # Room for two sandboxes at a time
+        await self.controller.start(None, sandbox_cpus=1, sandbox_memory=100, cpu_budget=2, memory_budget=1000,
+                                    max_queue_length=2)
+        self.order = []
+        self.releases = dict()
+
+    async def game(self, name: str, sandboxes: int = 1, priority: Priority = Priority.NORMAL):
+        """Holds its sandboxes until released"""
+        release = self.releases[name] = asyncio.Event()
+        async with self.controller.admit(sandboxes, priority):
+            self.order.append(name)
+            await release.wait()
+
+    def start(self, name: str, sandboxes: int = 1, priority: Priority = Priority.NORMAL) -> asyncio.Task:
+        return asyncio.ensure_future(self.game(name, sandboxes, priority))
+
+    async def test_queued_games_are_admitted_by_priority_then_arrival(self):
+        self.controller.max_queue_length = 3
+        self.start("running", sandboxes=2)
+        await asyncio.sleep(0)
+        games = [self.start("batch", priority=Priority.BATCH), self.start("normal"),
+                 self.start("interactive", priority=Priority.INTERACTIVE)]
+        await asyncio.sleep(0)
+        self.assertEqual(self.controller.queue_length, 3)
+
+        self.releases["running"].set()
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.order, ["running", "interactive", "normal"])
+
+        self.releases["interactive"].set()
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.order[-1], "batch")
+        for name in ["normal", "batch"]:
+            self.releases[name].set()
+        await asyncio.gather(*games)
+
+    async def test_full_queue_is_turned_away_with_retry_after(self):
+        self.controller.max_queue_length = 1
+        self.start("running", sandboxes=2)
+        await asyncio.sleep(0)
+        self.start("queued")
+        await asyncio.sleep(0)
+
+        with self.assertRaises(QueueFullError) as caught:
+            await self.game("rejected")
+        self.assertGreaterEqual(caught.exception.retry_after, 1)
+        self.assertEqual(self.controller.stats()["rejected"], 1)
+
+        for name in ["running", "queued"]:
+            self.releases[name].set()
+            await asyncio.sleep(0.01)
+
+    async def test_failed_game_gives_its_budget_back(self):
+        async def failing():
+            async with self.controller.admit(2):
+                await asyncio.sleep(0.01)
+                raise RuntimeError("game failed")
+
+        failed = asyncio.ensure_future(failing())
+        await asyncio.sleep(0)
+        queued = self.start("queued", sandboxes=2)
+        await asyncio.sleep(0)
+        self.assertEqual(self.order, [])
+
+        with self.assertRaises(RuntimeError):
+            await failed
+        await asyncio.sleep(0)
+        self.assertEqual(self.order, ["queued"])
+        self.releases["queued"].set()
+        await queued
+
+        stats = self.controller.stats()
+        self.assertEqual(stats["running"], 0)
+        self.assertEqual(stats["cpus_used"], 0)
+        self.assertEqual(stats["memory_used"], 0)
+
+    async def test_cancelled_waiter_does_not_hold_up_the_queue(self):
+        self.start("running")
+        await asyncio.sleep(0)
+        large = self.start("large", sandboxes=2)
+        small = self.start("small")
+        await asyncio.sleep(0)
+        self.assertEqual(self.order, ["running"])
+
+        large.cancel()
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.order, ["running", "small"])
+        for name in ["running", "small"]:
+            self.releases[name].set()
+        await small
+
+
+if __name__ == "__main__":
+    unittest.main()
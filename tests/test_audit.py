@@ -0,0 +1,187 @@
+import asyncio
+import io
+import os
+import shutil
+import stat
+import tarfile
+import tempfile
+import unittest
+from unittest import mock
+
+from runner.audits import SandboxAudits, UnsafeSandboxError, AuditTimedOutError
+from runner.sandbox import _iter_provisioning_archive
+from sandbox import audit
+from sandbox.audit import safe_mounts
+
+_MOUNTINFO = """\
+22 1 0:21 / / rw,relatime - overlay overlay rw,lowerdir=/l,upperdir=/u,workdir=/w
+23 22 0:22 / /proc rw,nosuid,nodev,noexec,relatime - proc proc rw
+24 22 0:23 / /dev rw,nosuid - tmpfs tmpfs rw,size=65536k,mode=755
+25 24 0:24 / /dev/pts rw,nosuid,noexec,relatime - devpts devpts rw,gid=5,mode=620,ptmxmode=666
+26 22 0:25 / /sys ro,nosuid,nodev,noexec,relatime - sysfs sysfs ro
+27 26 0:26 / /sys/fs/cgroup ro,nosuid,nodev,noexec,relatime - cgroup2 cgroup rw
+28 22 8:1 /home /home/sandbox ro,relatime - ext4 /dev/sda1 rw
+29 22 8:1 /data /mnt/with\\040space rw,relatime - ext4 /dev/sda1 ro
+30 22 0:27 / /tmp rw,nosuid,nodev,relatime shared:1 - tmpfs tmpfs rw,size=1024k
+31 22 0:28 / /truncated rw
+"""
+
+
+class TestSafeMounts(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        with os.fdopen(handle, "w") as f:
+            f.write(_MOUNTINFO)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_parses_mounts(self):
+        self.assertEqual(safe_mounts(self.path),
+                         {"/proc", "/dev/pts", "/sys", "/sys/fs/cgroup", "/home/sandbox", "/mnt/with space"})
+
+    def test_writable_storage_is_walked(self):
+        safe = safe_mounts(self.path)
+        self.assertNotIn("/dev", safe)
+        self.assertNotIn("/tmp", safe)
+
+    def test_root_is_always_walked(self):
+        with open(self.path, "w") as f:
+            f.write("22 1 0:21 / / ro,relatime - overlay overlay ro\n")
+        self.assertEqual(safe_mounts(self.path), set())
+
+    def test_missing_mountinfo(self):
+        self.assertEqual(safe_mounts(os.path.join(self.path, "missing")), set())
+
+
+def _access_as_sandbox_user(path, mode, **kwargs):
+    """Whether the sandbox user could get at a path. Everything in a sandbox's layout belongs to root, so only the
+    bits for others count, whoever runs the tests"""
+    bits = {os.W_OK: stat.S_IWOTH, os.R_OK: stat.S_IROTH, os.X_OK: stat.S_IXOTH}
+    st_mode = os.stat(path, follow_symlinks=False).st_mode
+    return all(st_mode & bit for flag, bit in bits.items() if mode & flag)
+
+
+class TestAudit(unittest.TestCase):
+    """Audits a copy of the shipped sandbox's layout: the provisioning archive under /home/sandbox, and the tmpfs
+    mounts it is started with"""
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for directory in ["etc", "usr/lib", "home/sandbox", "tmp", "var/tmp", "run/lock"]:
+            os.makedirs(os.path.join(self.root, directory))
+        with open(os.path.join(self.root, "etc", "hostname"), "w") as f:
+            f.write("sandbox\n")
+        for directory in ["tmp", "var/tmp", "run/lock"]:
+            os.chmod(os.path.join(self.root, directory), 0o1777)
+
+        handle, submission_path = tempfile.mkstemp(suffix=".tar")
+        os.close(handle)
+        with tarfile.open(submission_path, mode="w") as tar:
+            info = tarfile.TarInfo("ai.py")
+            source = b"def make_move(board):\n    return None\n"
+            info.size = len(source)
+            tar.addfile(info, io.BytesIO(source))
+        archive = b"".join(_iter_provisioning_archive(submission_path, True, 1024 * 1024))
+        os.remove(submission_path)
+        with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+            tar.extractall(os.path.join(self.root, "home", "sandbox"))
+
+        patcher = mock.patch("os.access", _access_as_sandbox_user)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        for directory, _, _ in os.walk(self.root):
+            os.chmod(directory, 0o755)
+        shutil.rmtree(self.root)
+
+    def run_audit(self, free_bytes: int) -> dict:
+        with mock.patch.object(audit, "_free_bytes", return_value=free_bytes):
+            return audit.audit(self.root, time_budget=10, workers=2)
+
+    def test_shipped_layout_passes(self):
+        report = self.run_audit(1024 * 1024)
+        self.assertTrue(report["complete"])
+        self.assertEqual(report["unbounded"], [])
+        self.assertEqual(set(report["bounded"]), {os.path.join(self.root, directory)
+                                                  for directory in ["tmp", "var/tmp", "run/lock"]})
+        self.assertGreater(report["scanned"], 10)
+
+    def test_submission_is_walked_and_read_only(self):
+        report = self.run_audit(1024 * 1024)
+        home = os.path.join(self.root, "home", "sandbox")
+        self.assertFalse(any(path.startswith(home) for path in report["bounded"]))
+        self.assertTrue(os.path.exists(os.path.join(home, "submission", "ai.py")))
+
+    def test_writable_home_is_unbounded(self):
+        home = os.path.join(self.root, "home", "sandbox")
+        os.chmod(home, 0o777)
+        report = self.run_audit(audit.UNBOUNDED_BYTES)
+        self.assertIn(home, report["unbounded"])
+
+    def test_writable_file_in_submission_is_unbounded(self):
+        path = os.path.join(self.root, "home", "sandbox", "submission", "ai.py")
+        os.chmod(path, 0o666)
+        report = self.run_audit(audit.UNBOUNDED_BYTES)
+        self.assertIn(path, report["unbounded"])
+
+    def test_running_out_of_time_is_incomplete(self):
+        with mock.patch.object(audit, "_free_bytes", return_value=0):
+            report = audit.audit(self.root, time_budget=0, workers=2)
+        self.assertFalse(report["complete"])
+
+
+class _Images:
+    async def inspect(self, name):
+        return {"Id": "sha256:" + name}
+
+
+class _Docker:
+    images = _Images()
+
+
+class _Connection:
+    """Answers audits with the given report, or never if there is none"""
+    def __init__(self, report=None):
+        self.report = report
+        self.audits = 0
+
+    async def audit(self, time_budget):
+        self.audits += 1
+        if self.report is None:
+            await asyncio.Event().wait()
+        return self.report
+
+
+class TestSandboxAudits(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.audits = SandboxAudits()
+        self.audits.configure(enabled=True, time_budget_seconds=0.01, timeout_seconds=0.05)
+
+    async def test_passed_audits_are_kept_by_image(self):
+        connection = _Connection({"complete": True, "unbounded": []})
+        await self.audits.check(_Docker(), "a", connection)
+        await self.audits.check(_Docker(), "a", connection)
+        self.assertEqual(connection.audits, 1)
+        self.assertEqual(self.audits.stats()["cached"], 1)
+
+    async def test_unbounded_paths_refuse_the_sandbox(self):
+        connection = _Connection({"complete": True, "unbounded": ["/home/sandbox"]})
+        for _ in range(2):
+            with self.assertRaises(UnsafeSandboxError) as caught:
+                await self.audits.check(_Docker(), "a", connection)
+            self.assertEqual(caught.exception.paths, ["/home/sandbox"])
+        self.assertEqual(connection.audits, 1)
+
+    async def test_no_answer_times_out_and_is_tried_again(self):
+        with self.assertRaises(AuditTimedOutError):
+            await self.audits.check(_Docker(), "a", _Connection())
+        self.assertEqual(self.audits.stats()["incomplete"], 1)
+
+        connection = _Connection({"complete": True, "unbounded": []})
+        await self.audits.check(_Docker(), "a", connection)
+        self.assertEqual(connection.audits, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+import chess
+
+from shared.board_session import BoardSession, BoardDelta, board_checksum
+
+
+def _after(*moves: str) -> chess.Board:
+    board = chess.Board()
+    for move in moves:
+        board.push_uci(move)
+    return board
+
+
+class TestBoardSession(unittest.TestCase):
+    def setUp(self):
+        self.session = BoardSession()
+
+    def test_whole_board_is_kept(self):
+        board = _after("e2e4")
+        resolved = self.session.resolve(board)
+        self.assertEqual(resolved, board)
+        self.assertIsNot(resolved, board)
+
+    def test_delta_is_applied_with_its_move_stack(self):
+        self.session.resolve(_after("e2e4"))
+        expected = _after("e2e4", "e7e5", "g1f3")
+        resolved = self.session.resolve(BoardDelta(["e7e5", "g1f3"], board_checksum(expected)))
+        self.assertEqual(resolved, expected)
+        self.assertEqual(resolved.move_stack, expected.move_stack)
+
+    def test_player_changing_its_board_does_not_change_the_session(self):
+        self.session.resolve(chess.Board()).push_uci("a2a3")
+        expected = _after("e2e4")
+        self.assertEqual(self.session.resolve(BoardDelta(["e2e4"], board_checksum(expected))), expected)
+
+    def test_delta_before_any_board_needs_a_resync(self):
+        self.assertIsNone(self.session.resolve(BoardDelta(["e2e4"], board_checksum(_after("e2e4")))))
+
+    def test_checksum_mismatch_needs_a_resync(self):
+        self.session.resolve(chess.Board())
+        self.assertIsNone(self.session.resolve(BoardDelta(["e2e4"], board_checksum(_after("d2d4")))))
+
+        # The board is left as it was, so a later delta from there still applies
+        expected = _after("d2d4")
+        self.assertEqual(self.session.resolve(BoardDelta(["d2d4"], board_checksum(expected))), expected)
+
+    def test_unreadable_move_needs_a_resync(self):
+        self.session.resolve(chess.Board())
+        self.assertIsNone(self.session.resolve(BoardDelta(["e2e9"], 0)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import importlib.util
+import io
+import marshal
+import os
+import sys
+import tarfile
+import tempfile
+import unittest
+
+from runner.bytecode import compiled_archive, SANDBOX_SUBMISSION_DIR
+
+_SOURCES = {
+    "ai.py": b"def make_move(board):\n    return 'e2e4'\n",
+    "helpers/moves.py": b"OPENING = ['e2e4']\n",
+    "broken.py": b"def make_move(:\n",
+    "../escaped.py": b"ESCAPED = True\n",
+    "notes.txt": b"not python\n",
+}
+
+
+def _submission(directory: str) -> str:
+    path = os.path.join(directory, "submission.tar")
+    with tarfile.open(path, mode="w") as tar:
+        for name, data in _SOURCES.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return path
+
+
+def _pyc(module: str) -> str:
+    return f"{module}.{sys.implementation.cache_tag}.pyc"
+
+
+class TestCompiledArchive(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.submission_path = _submission(directory.name)
+        self.cache_dir = os.path.join(directory.name, "cache")
+
+    def compile(self, submission_hash: str = "abc", max_bytes: int = 1024 ** 2) -> str:
+        return compiled_archive(submission_hash, self.submission_path, self.cache_dir, max_bytes)
+
+    def test_archive_holds_bytecode_laid_out_as_the_submission(self):
+        with tarfile.open(self.compile()) as archive:
+            files = sorted(member.name for member in archive.getmembers() if member.isfile())
+        self.assertEqual(files, [f"__pycache__/{_pyc('ai')}", f"helpers/__pycache__/{_pyc('moves')}"])
+
+    def test_bytecode_is_checked_against_the_source_and_names_the_sandbox_path(self):
+        with tarfile.open(self.compile()) as archive:
+            pyc = archive.extractfile(f"__pycache__/{_pyc('ai')}").read()
+
+        self.assertEqual(pyc[:4], importlib.util.MAGIC_NUMBER)
+        # Flags for a hash based pyc that is checked on import, as the copied sources have new modification times
+        self.assertEqual(int.from_bytes(pyc[4:8], "little"), 0b11)
+        self.assertEqual(pyc[8:16], importlib.util.source_hash(_SOURCES["ai.py"]))
+
+        code = marshal.loads(pyc[16:])
+        self.assertEqual(code.co_filename, f"{SANDBOX_SUBMISSION_DIR}/ai.py")
+        scope = {}
+        exec(code, scope)
+        self.assertEqual(scope["make_move"](None), "e2e4")
+
+    def test_archive_is_made_once(self):
+        path = self.compile()
+        os.utime(path, (0, 0))
+        self.assertEqual(self.compile(), path)
+        # Using it again marks it as recently used
+        self.assertGreater(os.stat(path).st_mtime, 0)
+
+    def test_least_recently_used_archive_is_evicted(self):
+        first = self.compile("first")
+        os.utime(first, (0, 0))
+        second = self.compile("second")
+        third = self.compile("third", max_bytes=2 * os.stat(second).st_size)
+
+        self.assertFalse(os.path.exists(first))
+        self.assertTrue(os.path.exists(second))
+        self.assertTrue(os.path.exists(third))
+
+    def test_unreadable_submission_gives_nothing(self):
+        with open(self.submission_path, "wb") as f:
+            f.write(b"not a tar")
+        self.assertIsNone(self.compile())
+        self.assertEqual([name for name in os.listdir(self.cache_dir) if name.endswith(".partial")], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import asyncio
+import itertools
+import unittest
+from unittest import mock
+
+from runner import sandbox
+from runner.container_pool import ContainerPool
+
+
+class _Container:
+    def __init__(self, container_id: str, deleted: list):
+        self.id = container_id
+        self.running = True
+        self._deleted = deleted
+
+    async def show(self):
+        return {"State": {"Running": self.running}}
+
+    async def delete(self, force=False):
+        self._deleted.append(self.id)
+
+
+class _Factory:
+    """Makes containers, failing with each of the given errors first"""
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.deleted = []
+        self.calls = 0
+        self._ids = itertools.count()
+
+    async def __call__(self, docker):
+        self.calls += 1
+        if len(self.errors) != 0:
+            raise self.errors.pop(0)
+        return _Container(str(next(self._ids)), self.deleted)
+
+
+async def _settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+class TestContainerPool(unittest.IsolatedAsyncioTestCase):
+    async def start(self, factory: _Factory, size: int = 2, health_check_seconds: float = 60) -> ContainerPool:
+        pool = ContainerPool(factory)
+        await pool.start(object(), size=size, max_idle_seconds=300, health_check_seconds=health_check_seconds)
+        self.addAsyncCleanup(pool.stop)
+        return pool
+
+    async def test_fills_and_refills_after_a_take(self):
+        factory = _Factory()
+        pool = await self.start(factory)
+        await _settle()
+        self.assertEqual(pool.idle_count, 2)
+
+        container = pool.take()
+        self.assertIsNotNone(container)
+        await _settle()
+        self.assertEqual(pool.idle_count, 2)
+        self.assertEqual(factory.calls, 3)
+
+    async def test_empty_pool_gives_nothing(self):
+        factory = _Factory()
+        pool = await self.start(factory, size=1)
+        self.assertIsNone(pool.take())
+
+    async def test_keeps_refilling_after_any_error(self):
+        factory = _Factory([RuntimeError("docker is struggling"), ValueError("bad response")])
+        pool = await self.start(factory, size=1, health_check_seconds=0.01)
+        for _ in range(20):
+            await asyncio.sleep(0.01)
+            if pool.idle_count == 1:
+                break
+        self.assertEqual(pool.idle_count, 1)
+        self.assertEqual(factory.calls, 3)
+
+    async def test_stopping_drains_idle_containers(self):
+        factory = _Factory()
+        pool = await self.start(factory)
+        await _settle()
+        taken = pool.take()
+        await _settle()
+
+        await pool.stop()
+        self.assertFalse(pool.enabled)
+        self.assertEqual(sorted(factory.deleted), sorted({"0", "1", "2"} - {taken.id}))
+        self.assertIsNone(pool.take())
+
+    async def test_unhealthy_members_are_recycled(self):
+        factory = _Factory()
+        pool = await self.start(factory, size=1, health_check_seconds=0.01)
+        await _settle()
+        first = pool._idle[0].container
+        first.running = False
+
+        for _ in range(20):
+            await asyncio.sleep(0.01)
+            if first.id in factory.deleted and pool.idle_count == 1:
+                break
+        self.assertIn(first.id, factory.deleted)
+        self.assertEqual(pool.idle_count, 1)
+        self.assertIsNot(pool.take(), first)
+
+
+class TestPoolProvisioning(unittest.IsolatedAsyncioTestCase):
+    async def start_provisioning(self, mode: str) -> ContainerPool:
+        pool = ContainerPool(_Factory())
+        options = {"submission_runner.provisioning": mode, "submission_runner.warm_pool_size": 2,
+                   "submission_runner.audit": False}
+        with mock.patch.object(sandbox, "container_pool", pool), \
+                mock.patch.object(sandbox, "get_option", lambda key, default=None: options.get(key, default)), \
+                mock.patch.object(sandbox.docker_client, "get", lambda: object()), \
+                mock.patch.object(sandbox, "_provisioning_digest", mock.AsyncMock(return_value="digest")), \
+                mock.patch.object(sandbox.submission_images, "start", mock.AsyncMock()), \
+                mock.patch.object(sandbox.submission_volumes, "start", mock.AsyncMock()):
+            await sandbox.start_provisioning(owner="a")
+        self.addAsyncCleanup(pool.stop)
+        return pool
+
+    async def test_copy_mode_starts_the_pool(self):
+        pool = await self.start_provisioning(sandbox.PROVISIONING_COPY)
+        self.assertTrue(pool.enabled)
+
+    async def test_prepared_sandboxes_do_not_start_the_pool(self):
+        for mode in [sandbox.PROVISIONING_IMAGE, sandbox.PROVISIONING_VOLUME]:
+            pool = await self.start_provisioning(mode)
+            self.assertFalse(pool.enabled)
+
+
+if __name__ == "__main__":
+    unittest.main()
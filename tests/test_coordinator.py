@@ -0,0 +1,133 @@
+import json
+import unittest
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from cuwais.common import Outcome, Result
+from cuwais.gamemodes import Gamemode
+
+from runner.admission import QueueFullError
+from runner.coordinator import Coordinator, RemoteGameError
+from runner.results import ParsedResult, SingleResult
+from shared.message_connection import Encoder
+
+_RESULT = ParsedResult("", [], [SingleResult(Outcome.Win, True, "a", Result.ValidGame, ""),
+                                SingleResult(Outcome.Loss, True, "b", Result.ValidGame, "")])
+
+
+class _Node:
+    """A runner node answering /status, and /run with the given status until told otherwise"""
+    def __init__(self):
+        self.status = 200
+        self.retry_after = 1
+        self.runs = []
+        app = web.Application()
+        app.router.add_get("/status", self._status)
+        app.router.add_get("/run", self._run)
+        self.server = TestServer(app)
+        self.url = ""
+
+    async def start(self):
+        await self.server.start_server()
+        self.url = str(self.server.make_url("")).rstrip("/")
+
+    async def _status(self, request):
+        return web.json_response({"admission": {"free_sandboxes": 8, "queued": 0}})
+
+    async def _run(self, request):
+        self.runs.append(dict(request.query))
+        if self.status == 429:
+            return web.json_response({"detail": "full"}, status=429, headers={"Retry-After": str(self.retry_after)})
+        if self.status != 200:
+            return web.json_response({"detail": f"failed with {self.status}"}, status=self.status)
+        return web.Response(text=json.dumps(_RESULT, cls=Encoder), content_type="application/json")
+
+
+class TestCoordinatorRun(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.nodes = [_Node(), _Node(), _Node()]
+        for node in self.nodes:
+            await node.start()
+            self.addAsyncCleanup(node.server.close)
+        self.coordinator = Coordinator()
+        self.addAsyncCleanup(self.coordinator.stop)
+        self.submissions = ["abc", "def"]
+
+    async def start(self, max_attempts: int = 3):
+        for node in self.nodes:
+            node.status = 200
+            node.runs = []
+        await self.coordinator.start([node.url for node in self.nodes], poll_interval_seconds=60,
+                                     max_attempts=max_attempts)
+        by_url = {node.url: node for node in self.nodes}
+        # The nodes in the order the coordinator will try them
+        self.order = [by_url[node.url] for node in self.coordinator.candidates(self.submissions)]
+
+    async def run_game(self) -> ParsedResult:
+        return await self.coordinator.run(Gamemode.get("chess"), self.submissions, {"seed": 1}, 10)
+
+    async def test_game_goes_to_the_first_candidate(self):
+        await self.start()
+        result = await self.run_game()
+        self.assertEqual(result.outcomes, _RESULT.outcomes)
+        self.assertEqual([len(node.runs) for node in self.order], [1, 0, 0])
+        self.assertEqual(json.loads(self.order[0].runs[0]["submissions"]), self.submissions)
+
+    async def test_unavailable_statuses_fail_over(self):
+        for status in [502, 503, 504]:
+            with self.subTest(status=status):
+                await self.start()
+                self.order[0].status = status
+                await self.run_game()
+
+                self.assertEqual(len(self.order[1].runs), 1)
+                self.assertFalse(self.coordinator._nodes[self.order[0].url].healthy)
+                await self.coordinator.stop()
+
+    async def test_lost_connection_fails_over(self):
+        await self.start()
+        await self.order[0].server.close()
+        await self.run_game()
+
+        self.assertEqual(len(self.order[1].runs), 1)
+        self.assertEqual(self.coordinator._nodes[self.order[0].url].failures, 1)
+
+    async def test_game_errors_are_not_retried(self):
+        for status in [400, 500]:
+            with self.subTest(status=status):
+                await self.start()
+                self.order[0].status = status
+                with self.assertRaises(RemoteGameError) as caught:
+                    await self.run_game()
+
+                self.assertEqual(caught.exception.status, status)
+                self.assertEqual(len(self.order[1].runs), 0)
+                self.assertTrue(self.coordinator._nodes[self.order[0].url].healthy)
+                await self.coordinator.stop()
+
+    async def test_gives_up_after_max_attempts(self):
+        await self.start(max_attempts=2)
+        for node in self.nodes:
+            node.status = 503
+        with self.assertRaises(RemoteGameError) as caught:
+            await self.run_game()
+
+        self.assertEqual(caught.exception.status, 503)
+        self.assertEqual([len(node.runs) for node in self.order], [1, 1, 0])
+
+    async def test_full_nodes_pass_the_game_on_then_give_the_soonest_retry(self):
+        await self.start()
+        for node, retry_after in zip(self.nodes, [5, 2, 9]):
+            node.status = 429
+            node.retry_after = retry_after
+        with self.assertRaises(QueueFullError) as caught:
+            await self.run_game()
+
+        self.assertEqual(caught.exception.retry_after, 2)
+        self.assertEqual([len(node.runs) for node in self.nodes], [1, 1, 1])
+        # Being full is not being lost
+        self.assertTrue(all(node.healthy for node in self.coordinator._nodes.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
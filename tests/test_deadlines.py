@@ -0,0 +1,112 @@
+import asyncio
+import time
+import unittest
+
+from runner.deadlines import DeadlineScheduler, scheduler
+from runner.timed_connection import TimedConnection
+from shared.connection import Connection, ConnectionTimedOutError
+
+
+class _SlowConnection(Connection):
+    """Answers each message after the given delay"""
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def get_prints(self) -> str:
+        return ""
+
+    async def get_next_message_data(self):
+        await asyncio.sleep(self.delay)
+        return "pong"
+
+    async def close(self):
+        pass
+
+    async def send_call(self, method_name, method_args, method_kwargs):
+        pass
+
+    async def send_ping(self):
+        pass
+
+
+class TestDeadlineScheduler(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.scheduler = DeadlineScheduler()
+
+    def task(self) -> asyncio.Task:
+        return asyncio.ensure_future(asyncio.sleep(10))
+
+    async def test_task_is_cancelled_once_its_deadline_passes(self):
+        task = self.task()
+        deadline = self.scheduler.schedule(time.monotonic() + 0.01, task)
+
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertTrue(deadline.expired)
+        self.assertEqual(len(self.scheduler), 0)
+
+    async def test_cancelled_deadline_does_not_fire(self):
+        task = self.task()
+        deadline = self.scheduler.schedule(time.monotonic() + 0.01, task)
+        self.scheduler.cancel(deadline)
+        await asyncio.sleep(0.03)
+
+        self.assertFalse(task.done())
+        self.assertFalse(deadline.expired)
+        self.assertEqual(len(self.scheduler), 0)
+        task.cancel()
+
+    async def test_timer_is_rearmed_for_the_next_deadline(self):
+        late, early = self.task(), self.task()
+        self.scheduler.schedule(time.monotonic() + 0.05, late)
+        self.scheduler.schedule(time.monotonic() + 0.01, early)
+
+        await asyncio.sleep(0.03)
+        self.assertTrue(early.cancelled())
+        self.assertFalse(late.done())
+        self.assertEqual(len(self.scheduler), 1)
+
+        await asyncio.sleep(0.05)
+        self.assertTrue(late.cancelled())
+
+    async def test_cancelling_the_earliest_still_fires_the_rest(self):
+        early, late = self.task(), self.task()
+        self.scheduler.cancel(self.scheduler.schedule(time.monotonic() + 0.01, early))
+        self.scheduler.schedule(time.monotonic() + 0.02, late)
+
+        await asyncio.sleep(0.05)
+        self.assertFalse(early.done())
+        self.assertTrue(late.cancelled())
+        early.cancel()
+
+
+class TestTimedConnection(unittest.IsolatedAsyncioTestCase):
+    async def test_slow_operation_times_out(self):
+        connection = TimedConnection(_SlowConnection(1), timeout=0.02)
+        with self.assertRaises(ConnectionTimedOutError):
+            await connection.get_next_message_data()
+
+    async def test_time_is_shared_between_operations(self):
+        connection = TimedConnection(_SlowConnection(0.1), timeout=0.25)
+        self.assertEqual(await connection.get_next_message_data(), "pong")
+        self.assertEqual(await connection.get_next_message_data(), "pong")
+        with self.assertRaises(ConnectionTimedOutError):
+            await connection.get_next_message_data()
+        # Out of time, so later operations fail straight away
+        with self.assertRaises(ConnectionTimedOutError):
+            await connection.get_next_message_data()
+
+    async def test_cancelling_the_caller_is_not_a_timeout(self):
+        connection = TimedConnection(_SlowConnection(1), timeout=10)
+        task = asyncio.ensure_future(connection.get_next_message_data())
+        await asyncio.sleep(0.01)
+        task.cancel()
+
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        # Its deadline goes with it, rather than firing later
+        self.assertEqual(len(scheduler), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
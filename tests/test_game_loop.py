@@ -0,0 +1,202 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import chess
+from cuwais.common import Outcome, Result
+from cuwais.gamemodes import Gamemode
+
+from runner import gamemode_runner
+from runner.gamemode_runner import _BoardSync, _LatencyEstimator, _run_loop
+from shared.board_session import BoardSession, BoardDelta, BoardResync
+
+
+class _Player:
+    """Plays the first legal move, keeping its own board from any deltas it is sent as a sandbox would"""
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.session = BoardSession()
+        self.boards = []
+        self.time_remaining = []
+
+    def respond(self, board):
+        if isinstance(board, (chess.Board, BoardDelta)):
+            board = self.session.resolve(board)
+            if board is None:
+                return BoardResync()
+        return sorted(move.uci() for move in board.legal_moves)[0]
+
+
+class _ForgetfulPlayer(_Player):
+    """Loses its copy of the board after its first move, as a sandbox that was restarted would"""
+    def respond(self, board):
+        move = super().respond(board)
+        if len(self.boards) == 1:
+            self.session = BoardSession()
+        return move
+
+
+class _ResyncingPlayer(_Player):
+    def respond(self, board):
+        return BoardResync()
+
+
+class _Middleware:
+    """Stands in for the middleware between the game loop and its sandboxes"""
+    def __init__(self, players, compute_time=None, board_deltas=False):
+        self.players = players
+        self.compute_time = compute_time
+        self.board_deltas = board_deltas
+
+    def supports_board_deltas(self, player_id) -> bool:
+        return self.board_deltas
+
+    def last_compute_time(self, player_id):
+        return self.compute_time
+
+    async def call(self, player_id, method_name, board, time_remaining):
+        player = self.players[player_id]
+        if isinstance(board, chess.Board):
+            board = board.copy()  # As if sent to a sandbox, which gets its own board
+        player.boards.append(board)
+        player.time_remaining.append(time_remaining)
+        await asyncio.sleep(player.delay)
+        return player.respond(board)
+
+
+def _calibrations(latency: float):
+    return {0: [latency] * 5, 1: [latency] * 5}
+
+
+class TestLatencyEstimator(unittest.TestCase):
+    def test_seeded_from_calibration_and_capped(self):
+        latency = _LatencyEstimator(2, cap=0.2)
+        latency.seed(0, [0.1, 0.3])
+        latency.seed(1, [1.0])
+        self.assertAlmostEqual(latency[0], 0.2)
+        self.assertAlmostEqual(latency[1], 0.2)
+
+    def test_moving_average_of_round_trips_less_compute_time(self):
+        latency = _LatencyEstimator(1, alpha=0.2)
+        latency.seed(0, [0.1])
+        latency.update(0, elapsed=0.5, compute_time=0.45)
+        self.assertAlmostEqual(latency[0], 0.2 * 0.05 + 0.8 * 0.1)
+
+    def test_never_raised_above_calibration(self):
+        latency = _LatencyEstimator(1)
+        latency.seed(0, [0.1])
+        latency.update(0, elapsed=1.0, compute_time=0.0)
+        self.assertAlmostEqual(latency[0], 0.1)
+
+    def test_unreported_compute_time_is_ignored(self):
+        latency = _LatencyEstimator(1)
+        latency.seed(0, [0.1])
+        latency.update(0, elapsed=0.01, compute_time=None)
+        self.assertAlmostEqual(latency[0], 0.1)
+
+
+class TestMoveCharging(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.gamemode = Gamemode.get("chess")
+        self.options = {**self.gamemode.options, "turn_time": 10}
+
+    async def test_fast_move_does_not_add_to_the_clock(self):
+        players = [_Player(), _Player()]
+        await _run_loop(self.gamemode, _Middleware(players), self.options, 4, calibrations=_calibrations(0.1))
+        self.assertEqual(players[0].time_remaining, [10, 10])
+
+    async def test_move_is_charged_less_the_latency(self):
+        players = [_Player(delay=0.3), _Player()]
+        await _run_loop(self.gamemode, _Middleware(players), self.options, 4, calibrations=_calibrations(0.1))
+        charged = 10 - players[0].time_remaining[1]
+        self.assertGreaterEqual(charged, 0.3 - 0.1)
+        self.assertLess(charged, 0.3)
+
+    async def test_running_out_of_time_loses(self):
+        self.options["turn_time"] = 1
+        players = [_Player(), _Player(delay=0.6)]
+        outcomes, result, moves, _ = await _run_loop(self.gamemode, _Middleware(players), self.options, 8,
+                                                     calibrations=_calibrations(0.0))
+        self.assertEqual(result, Result.Timeout)
+        self.assertEqual(outcomes, [Outcome.Win, Outcome.Loss])
+        self.assertEqual(len(moves), 3)
+
+
+def _with_board_deltas(key, default=None):
+    return True if key == "submission_runner.board_deltas" else default
+
+
+class TestBoardSync(unittest.TestCase):
+    def test_whole_board_then_moves_since(self):
+        gamemode = Gamemode.get("chess")
+        sync = _BoardSync([True])
+        board = chess.Board()
+        self.assertIs(sync.board_for(gamemode, board, 0), board)
+
+        board.push_uci("e2e4")
+        board.push_uci("e7e5")
+        delta = sync.board_for(gamemode, board, 0)
+        self.assertIsInstance(delta, BoardDelta)
+        self.assertEqual(delta.moves, ["e2e4", "e7e5"])
+        self.assertEqual(delta.checksum, chess.polyglot.zobrist_hash(board))
+
+    def test_whole_board_resets_what_was_sent(self):
+        gamemode = Gamemode.get("chess")
+        sync = _BoardSync([True])
+        board = chess.Board()
+        sync.board_for(gamemode, board, 0)
+        board.push_uci("e2e4")
+        self.assertIs(sync.full_board_for(gamemode, board, 0), board)
+
+        board.push_uci("e7e5")
+        self.assertEqual(sync.board_for(gamemode, board, 0).moves, ["e7e5"])
+
+    def test_disabled_players_always_get_the_board(self):
+        gamemode = Gamemode.get("chess")
+        sync = _BoardSync([False])
+        board = chess.Board()
+        sync.board_for(gamemode, board, 0)
+        board.push_uci("e2e4")
+        self.assertIs(sync.board_for(gamemode, board, 0), board)
+
+
+class TestBoardDeltas(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.gamemode = Gamemode.get("chess")
+        self.options = {**self.gamemode.options, "turn_time": 10}
+        patcher = mock.patch.object(gamemode_runner, "get_option", _with_board_deltas)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def play(self, players, turns: int = 6):
+        return await _run_loop(self.gamemode, _Middleware(players, board_deltas=True), self.options, turns,
+                               calibrations=_calibrations(0.1))
+
+    async def test_players_are_sent_moves_after_the_first_board(self):
+        players = [_Player(), _Player()]
+        outcomes, result, moves, _ = await self.play(players)
+        self.assertEqual(result, Result.GameUnfinished)
+        self.assertIsInstance(players[0].boards[0], chess.Board)
+        self.assertTrue(all(isinstance(board, BoardDelta) for board in players[0].boards[1:]))
+        self.assertEqual([len(board.moves) for board in players[0].boards[1:]], [2, 2])
+
+    async def test_out_of_sync_player_is_sent_the_whole_board(self):
+        players = [_ForgetfulPlayer(), _Player()]
+        outcomes, result, moves, _ = await self.play(players)
+        self.assertEqual(result, Result.GameUnfinished)
+        self.assertEqual(len(moves), 6)
+        self.assertIsInstance(players[0].boards[1], BoardDelta)
+        self.assertIsInstance(players[0].boards[2], chess.Board)
+        # Both round trips of the resync are credited, so a quick resync costs nothing
+        self.assertEqual(players[0].time_remaining, [10, 10, 10, 10])
+
+    async def test_asking_to_resync_a_whole_board_is_an_illegal_move(self):
+        players = [_ResyncingPlayer(), _Player()]
+        outcomes, result, moves, _ = await self.play(players)
+        self.assertEqual(result, Result.IllegalMove)
+        self.assertEqual(outcomes, [Outcome.Loss, Outcome.Win])
+        self.assertEqual(len(players[0].boards), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
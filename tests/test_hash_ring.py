@@ -0,0 +1,67 @@
+import unittest
+from collections import Counter
+
+from runner.coordinator import HashRing
+
+_NODES = ["http://a:8080", "http://b:8080", "http://c:8080"]
+_KEYS = [f"{i:040x}" for i in range(1000)]
+
+
+def _ring(nodes) -> HashRing:
+    ring = HashRing(replicas=64)
+    for node in nodes:
+        ring.add(node)
+    return ring
+
+
+def _owners(ring: HashRing) -> dict:
+    return {key: next(ring.walk(key)) for key in _KEYS}
+
+
+class TestHashRing(unittest.TestCase):
+    def test_empty_ring_has_no_owner(self):
+        self.assertEqual(list(HashRing().walk("key")), [])
+
+    def test_walk_visits_every_node_once(self):
+        ring = _ring(_NODES)
+        for key in _KEYS[:50]:
+            walk = list(ring.walk(key))
+            self.assertEqual(sorted(walk), sorted(_NODES))
+
+    def test_owner_does_not_depend_on_order_added(self):
+        self.assertEqual(_owners(_ring(_NODES)), _owners(_ring(reversed(_NODES))))
+
+    def test_keys_are_spread_over_nodes(self):
+        counts = Counter(_owners(_ring(_NODES)).values())
+        for node in _NODES:
+            self.assertGreater(counts[node], len(_KEYS) / len(_NODES) / 3)
+
+    def test_removing_a_node_only_moves_its_keys(self):
+        ring = _ring(_NODES)
+        before = _owners(ring)
+        ring.remove(_NODES[0])
+        after = _owners(ring)
+
+        for key in _KEYS:
+            if before[key] != _NODES[0]:
+                self.assertEqual(after[key], before[key])
+            else:
+                self.assertNotEqual(after[key], _NODES[0])
+
+    def test_adding_a_node_only_takes_keys(self):
+        before = _owners(_ring(_NODES))
+        after = _owners(_ring(_NODES + ["http://d:8080"]))
+        for key in _KEYS:
+            self.assertIn(after[key], {before[key], "http://d:8080"})
+
+    def test_next_node_is_the_fallback(self):
+        ring = _ring(_NODES)
+        for key in _KEYS[:50]:
+            first, second = list(ring.walk(key))[:2]
+            ring.remove(first)
+            self.assertEqual(next(ring.walk(key)), second)
+            ring.add(first)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import asyncio
+import unittest
+
+from runner.image_cache import SubmissionImageCache
+
+
+class _Images:
+    """Stands in for the images part of an aiodocker client"""
+    def __init__(self, tags=()):
+        self.tags = {tag: {"RepoTags": [tag], "Size": 150} for tag in tags}
+        self.tags["base"] = {"Size": 100}
+        self.deleted = []
+
+    async def inspect(self, name):
+        return self.tags[name]
+
+    async def list(self, filters=None):
+        return [info for tag, info in self.tags.items() if tag != "base"]
+
+    async def delete(self, name, force=False):
+        self.deleted.append(name)
+        del self.tags[name]
+
+
+class _Docker:
+    def __init__(self, tags=()):
+        self.images = _Images(tags)
+
+
+class _Builder:
+    """Builds images when told to, counting the builds started"""
+    def __init__(self):
+        self.started = 0
+        self.finish = asyncio.Event()
+
+    async def __call__(self, docker, submission_hash, repository, tag):
+        self.started += 1
+        await self.finish.wait()
+        docker.images.tags[f"{repository}:{tag}"] = {"RepoTags": [f"{repository}:{tag}"], "Size": 150}
+
+
+class TestSubmissionImageCache(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.builder = _Builder()
+        self.cache = SubmissionImageCache(self.builder, "base")
+
+    async def start(self, docker, max_images=4):
+        await self.cache.start(docker, max_images=max_images, max_bytes=1024, owner="a", digest="new")
+
+    async def test_stale_images_are_deleted(self):
+        docker = _Docker(["aiwarssoc/sandbox-submission-a:abc-old", "aiwarssoc/sandbox-submission-a:def-new"])
+        await self.start(docker)
+
+        self.assertEqual(docker.images.deleted, ["aiwarssoc/sandbox-submission-a:abc-old"])
+        self.assertEqual(await self.cache.acquire("def"), "aiwarssoc/sandbox-submission-a:def-new")
+        self.assertEqual(self.builder.started, 0)
+
+        self.builder.finish.set()
+        self.assertEqual(await self.cache.acquire("abc"), "aiwarssoc/sandbox-submission-a:abc-new")
+        self.assertEqual(self.builder.started, 1)
+
+    async def test_cancelling_the_first_request_does_not_cancel_the_build(self):
+        await self.start(_Docker())
+        first = asyncio.ensure_future(self.cache.acquire("abc"))
+        second = asyncio.ensure_future(self.cache.acquire("abc"))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+
+        self.builder.finish.set()
+        self.assertEqual(await second, "aiwarssoc/sandbox-submission-a:abc-new")
+        self.assertTrue(first.cancelled())
+        self.assertEqual(self.builder.started, 1)
+
+    async def test_unused_images_are_evicted_before_stopping(self):
+        docker = _Docker()
+        self.builder.finish.set()
+        await self.start(docker, max_images=1)
+        await self.cache.acquire("abc")
+        await self.cache.acquire("def")
+        self.assertEqual(docker.images.deleted, [])
+
+        self.cache.release("abc")
+        await self.cache.stop()
+        self.assertEqual(docker.images.deleted, ["aiwarssoc/sandbox-submission-a:abc-new"])
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import unittest
+from unittest import mock
+
+from runner import logger as logger_module
+from runner.logger import logger, game_log, hold_game_log
+
+
+class TestGameLog(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        # Game logs are configured at import, so are turned on here as they would be by submission_runner.game_logs
+        buffer_filter = logger_module._GameBufferFilter()
+        logger.addFilter(buffer_filter)
+        self.addCleanup(logger.removeFilter, buffer_filter)
+        for name, value in [("_game_logs_enabled", True), ("_game_log_sample_rate", 0.0)]:
+            patcher = mock.patch.object(logger_module, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.written = []
+        patcher = mock.patch.object(logger_module._handler, "handle", self.written.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def messages(self) -> list:
+        return [record.getMessage() for record in self.written]
+
+    def test_successful_game_is_not_written(self):
+        with game_log():
+            logger.debug("setting up")
+            logger.info("playing")
+        self.assertEqual(self.messages(), [])
+        self.assertEqual(logger.level, logging.NOTSET)
+
+    def test_failed_game_is_written_in_order(self):
+        with self.assertRaises(RuntimeError):
+            with game_log():
+                logger.debug("setting up")
+                logger.info("playing")
+                raise RuntimeError("game failed")
+        self.assertEqual(self.messages(), ["setting up", "playing"])
+
+    def test_game_marked_as_failed_is_written(self):
+        with game_log() as game:
+            logger.debug("setting up")
+            game.failed = True
+        self.assertEqual(self.messages(), ["setting up"])
+
+    def test_warnings_are_not_held_back(self):
+        with game_log() as game:
+            logger.warning("now")
+            self.assertEqual(len(game.records), 0)
+
+    def test_sampled_game_is_written(self):
+        with mock.patch.object(logger_module, "_game_log_sample_rate", 1.0):
+            with game_log():
+                logger.debug("sampled")
+        self.assertEqual(self.messages(), ["sampled"])
+
+    async def test_concurrent_games_have_their_own_buffers(self):
+        async def play(name: str, fail: bool):
+            with game_log() as game:
+                logger.debug(f"{name} starting")
+                await asyncio.sleep(0.01)
+                logger.debug(f"{name} finishing")
+                game.failed = fail
+
+        await asyncio.gather(asyncio.ensure_future(play("a", False)), asyncio.ensure_future(play("b", True)))
+        self.assertEqual(self.messages(), ["b starting", "b finishing"])
+
+    async def test_held_buffer_is_flushed_once_the_task_finishes(self):
+        release = asyncio.Event()
+
+        async def teardown():
+            await release.wait()
+            logger.debug("tearing down")
+            raise RuntimeError("teardown failed")
+
+        with game_log():
+            logger.debug("playing")
+            task = asyncio.ensure_future(teardown())
+            hold_game_log(task)
+        self.assertEqual(self.messages(), [])
+
+        release.set()
+        with self.assertRaises(RuntimeError):
+            await task
+        await asyncio.sleep(0)
+        self.assertEqual(self.messages(), ["playing", "tearing down"])
+
+
+if __name__ == "__main__":
+    unittest.main()
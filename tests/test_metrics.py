@@ -0,0 +1,87 @@
+import asyncio
+import multiprocessing
+import threading
+import unittest
+
+from runner import metrics
+from runner.executors import ExecutorPool, _Executor
+
+_counter = metrics.Counter("test_metrics_requests_total", "Requests", labels=("outcome",))
+_gauge = metrics.Gauge("test_metrics_live", "Live things")
+_histogram = metrics.Histogram("test_metrics_seconds", "Durations", labels=("phase",), buckets=(0.1, 1.0))
+
+
+def _lines(text: str, prefix: str) -> dict:
+    """The samples of one metric in rendered output, by everything before the value"""
+    samples = dict()
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+class TestMetricSnapshots(unittest.TestCase):
+    def setUp(self):
+        _counter._values.clear()
+        _gauge._value = 0.0
+        _histogram._series.clear()
+
+    def test_snapshots_are_added_in(self):
+        _counter.inc(outcome="hit")
+        _gauge.inc()
+        _histogram.observe(0.05, phase="move")
+
+        other = metrics.snapshot()
+        _counter._values.clear()
+        _counter.inc(2, outcome="miss")
+        text = metrics.render([other, other])
+
+        self.assertEqual(_lines(text, "test_metrics_requests_total"),
+                         {'test_metrics_requests_total{outcome="hit"}': 2.0,
+                          'test_metrics_requests_total{outcome="miss"}': 2.0})
+        self.assertEqual(_lines(text, "test_metrics_live"), {"test_metrics_live": 3.0})
+        histogram = _lines(text, "test_metrics_seconds")
+        self.assertAlmostEqual(histogram.pop('test_metrics_seconds_sum{phase="move"}'), 0.15)
+        self.assertEqual(histogram, {'test_metrics_seconds_bucket{phase="move",le="0.1"}': 3.0,
+                                     'test_metrics_seconds_bucket{phase="move",le="1.0"}': 3.0,
+                                     'test_metrics_seconds_bucket{phase="move",le="+Inf"}': 3.0,
+                                     'test_metrics_seconds_count{phase="move"}': 3.0})
+
+    def test_series_only_seen_elsewhere_are_rendered(self):
+        text = metrics.render([{"test_metrics_seconds": {("preload",): ([0, 1], 0.5, 1)}}])
+        self.assertEqual(_lines(text, "test_metrics_seconds_count"),
+                         {'test_metrics_seconds_count{phase="preload"}': 1.0})
+
+
+class TestExecutorMetrics(unittest.IsolatedAsyncioTestCase):
+    async def test_metrics_are_relayed_from_executors(self):
+        parent, child = multiprocessing.Pipe()
+
+        def executor():
+            # Answers like an executor process would, with metrics of its own
+            kind, request_id = child.recv()
+            child.send((kind, request_id, {"test_metrics_live": 5.0}))
+
+        thread = threading.Thread(target=executor)
+        thread.start()
+
+        pool = ExecutorPool()
+        remote = _Executor(0, None, parent)
+        remote.ready.set_result(None)
+        pool._executors = [remote]
+        asyncio.get_event_loop().add_reader(parent.fileno(), pool._receive, remote)
+        try:
+            snapshots = await pool.metrics()
+        finally:
+            asyncio.get_event_loop().remove_reader(parent.fileno())
+            thread.join()
+            parent.close()
+            child.close()
+
+        _gauge._value = 1.0
+        self.assertEqual(_lines(metrics.render(snapshots), "test_metrics_live"), {"test_metrics_live": 6.0})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import time
+import unittest
+
+from runner.reaper import Reaper, SANDBOX_LABEL, SANDBOX_INSTANCE_LABEL
+
+
+class _Container:
+    def __init__(self, docker: "_Docker", container_id: str, labels: dict, created: float):
+        self._docker = docker
+        self.id = container_id
+        self._info = {"Labels": labels, "Created": created}
+
+    def __getitem__(self, key):
+        return self._info[key]
+
+    async def delete(self, force=False):
+        self._docker.deleted.append(self.id)
+
+
+class _Containers:
+    def __init__(self, docker: "_Docker"):
+        self._docker = docker
+
+    async def list(self, all=False, filters=None):
+        label, _, runner_id = json.loads(filters)["label"][0].partition("=")
+        return [container for container in self._docker.containers_made
+                if container.id not in self._docker.deleted and (container["Labels"] or {}).get(label) == runner_id]
+
+
+class _Docker:
+    """Stands in for an aiodocker client, with only the containers it is given"""
+    def __init__(self):
+        self.containers_made = []
+        self.deleted = []
+        self.containers = _Containers(self)
+
+    def make(self, container_id: str, runner_id: str, instance: str, age: float) -> _Container:
+        container = _Container(self, container_id, {SANDBOX_LABEL: runner_id, SANDBOX_INSTANCE_LABEL: instance},
+                               time.time() - age)
+        self.containers_made.append(container)
+        return container
+
+
+class TestReaper(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.docker = _Docker()
+        self.reaper = Reaper()
+
+    async def asyncTearDown(self):
+        await self.reaper.stop()
+
+    async def test_orphans_left_by_an_earlier_run_are_reaped_at_startup(self):
+        self.docker.make("old", "runner-a", "earlier", age=120)
+        self.docker.make("young", "runner-a", "earlier", age=0)
+        self.docker.make("theirs", "runner-b", "other", age=120)
+        await self.reaper.start(self.docker, "runner-a", orphan_interval_seconds=60)
+
+        self.assertEqual(self.docker.deleted, ["old"])
+        self.assertEqual(self.reaper.stats()["orphans_reaped"], 1)
+
+    async def test_live_sandboxes_are_not_orphans(self):
+        await self.reaper.start(self.docker, "runner-a", orphan_interval_seconds=60)
+        live = self.docker.make("live", "runner-a", self.reaper.instance_id, age=0)
+        self.reaper.track(live)
+        self.docker.make("leaked", "runner-a", self.reaper.instance_id, age=0)
+
+        await self.reaper.reap_orphans(min_age_seconds=0)
+        self.assertEqual(self.docker.deleted, ["leaked"])
+
+    async def test_another_running_process_with_the_same_id_is_left_alone(self):
+        await self.reaper.start(self.docker, "runner-a", orphan_interval_seconds=60)
+        self.docker.make("other", "runner-a", "other-process", age=-1)
+
+        await self.reaper.reap_orphans(min_age_seconds=0)
+        self.assertEqual(self.docker.deleted, [])
+
+    async def test_deletes_are_batched_and_finish_before_stopping(self):
+        await self.reaper.start(self.docker, "runner-a", batch_size=2)
+        containers = [self.docker.make(str(i), "runner-a", self.reaper.instance_id, age=0) for i in range(5)]
+        for container in containers:
+            self.reaper.track(container)
+
+        await asyncio.gather(*[self.reaper.delete(container) for container in containers])
+        self.assertEqual(sorted(self.docker.deleted), ["0", "1", "2", "3", "4"])
+        self.assertEqual(self.reaper.stats()["deleted"], 5)
+        self.assertEqual(self.reaper.stats()["live"], 0)
+
+    async def test_deferred_teardown_is_awaited_when_stopping(self):
+        await self.reaper.start(self.docker, "runner-a")
+        torn_down = []
+
+        async def teardown(name: str, fail: bool = False):
+            await asyncio.sleep(0.01)
+            torn_down.append(name)
+            if fail:
+                raise RuntimeError("teardown failed")
+
+        self.reaper.defer(teardown("a"))
+        self.reaper.defer(teardown("b", fail=True))
+        self.assertEqual(self.reaper.stats()["deferred"], 2)
+
+        await self.reaper.stop()
+        self.assertEqual(sorted(torn_down), ["a", "b"])
+        self.assertEqual(self.reaper.stats()["deferred"], 0)
+
+    async def test_a_runner_id_is_needed(self):
+        with self.assertRaises(ValueError):
+            await self.reaper.start(self.docker, "")
+
+
+if __name__ == "__main__":
+    unittest.main()
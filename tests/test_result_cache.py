@@ -0,0 +1,181 @@
+import asyncio
+import functools
+import unittest
+
+from cuwais.common import Outcome, Result
+from cuwais.gamemodes import Gamemode
+
+from runner.coordinator import Coordinator, Node
+from runner.result_cache import ResultCache
+from runner.results import ParsedResult, SingleResult
+
+
+def _result(result: Result = Result.ValidGame) -> ParsedResult:
+    return ParsedResult("", [], [SingleResult(Outcome.Win, True, "a", result, ""),
+                                 SingleResult(Outcome.Loss, True, "b", result, "")])
+
+
+class _Games:
+    """Stands in for gamemode_runner.run, counting the games started and finishing them when told to"""
+    def __init__(self, result: ParsedResult = None):
+        self.started = 0
+        self.cancelled = 0
+        self.result = result or _result()
+        self.finish = asyncio.Event()
+
+    async def run(self, gamemode, submission_hashes, options, turns, priority=None, trace=False) -> ParsedResult:
+        self.started += 1
+        try:
+            await self.finish.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return self.result
+
+
+class TestResultCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.gamemode = Gamemode.get("chess")
+        self.cache = ResultCache()
+        self.cache.configure([self.gamemode.name], ttl_seconds=60, max_entries=2)
+        self.games = _Games()
+
+    def run_game(self, submissions=("a", "b"), options=None, deterministic=False) -> asyncio.Task:
+        return asyncio.ensure_future(self.cache.run(self.games.run, self.gamemode, list(submissions),
+                                                    options or {}, 10, deterministic=deterministic))
+
+    async def test_identical_requests_share_one_game(self):
+        requests = [self.run_game() for _ in range(3)]
+        await asyncio.sleep(0)
+        self.games.finish.set()
+        results = await asyncio.gather(*requests)
+
+        self.assertEqual(self.games.started, 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(self.cache.coalesced, 2)
+        self.assertEqual(self.cache.stats()["in_flight"], 0)
+
+    async def test_different_requests_do_not_share(self):
+        requests = [self.run_game(("a", "b")), self.run_game(("b", "a"))]
+        await asyncio.sleep(0)
+        self.games.finish.set()
+        await asyncio.gather(*requests)
+        self.assertEqual(self.games.started, 2)
+
+    async def test_cancelling_one_waiter_keeps_the_game(self):
+        first, second = self.run_game(), self.run_game()
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        self.games.finish.set()
+
+        self.assertIs(await second, self.games.result)
+        with self.assertRaises(asyncio.CancelledError):
+            await first
+        self.assertEqual(self.games.cancelled, 0)
+
+    async def test_cancelling_every_waiter_cancels_the_game(self):
+        requests = [self.run_game(), self.run_game()]
+        await asyncio.sleep(0)
+        for request in requests:
+            request.cancel()
+        await asyncio.gather(*requests, return_exceptions=True)
+        await asyncio.sleep(0)
+
+        self.assertEqual(self.games.cancelled, 1)
+        self.assertEqual(self.cache.stats()["in_flight"], 0)
+
+    async def test_failures_are_shared_and_not_kept(self):
+        async def failing(*args, **kwargs):
+            await asyncio.sleep(0)
+            raise RuntimeError("failed")
+
+        options = {"seed": 1}
+        requests = [self.cache.run(failing, self.gamemode, ["a", "b"], options, 10, deterministic=True)
+                    for _ in range(2)]
+        results = await asyncio.gather(*requests, return_exceptions=True)
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    async def test_deterministic_results_are_kept(self):
+        options = {"seed": 1}
+        self.games.finish.set()
+        first = await self.run_game(options=options, deterministic=True)
+        second = await self.run_game(options=options, deterministic=True)
+
+        self.assertIs(second, first)
+        self.assertEqual(self.games.started, 1)
+        self.assertEqual(self.cache.hits, 1)
+
+    async def test_results_need_a_seed_and_deterministic_submissions(self):
+        self.games.finish.set()
+        await self.run_game(deterministic=True)
+        await self.run_game(deterministic=True)
+        await self.run_game(options={"seed": 1})
+        await self.run_game(options={"seed": 1})
+        self.assertEqual(self.games.started, 4)
+
+    async def test_unrepeatable_results_are_not_kept(self):
+        self.games.result = _result(Result.Timeout)
+        self.games.finish.set()
+        await self.run_game(options={"seed": 1}, deterministic=True)
+        await self.run_game(options={"seed": 1}, deterministic=True)
+        self.assertEqual(self.games.started, 2)
+
+    async def test_least_recently_used_is_evicted(self):
+        self.games.finish.set()
+        for seed in [1, 2, 1, 3]:
+            await self.run_game(options={"seed": seed}, deterministic=True)
+        self.assertEqual(self.cache.evictions, 1)
+
+        started = self.games.started
+        await self.run_game(options={"seed": 1}, deterministic=True)
+        self.assertEqual(self.games.started, started)
+        await self.run_game(options={"seed": 2}, deterministic=True)
+        self.assertEqual(self.games.started, started + 1)
+
+
+class _Response:
+    status = 200
+
+    def __init__(self, result: ParsedResult):
+        self.result = result
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def json(self):
+        return self.result
+
+
+class _Session:
+    """Stands in for the coordinator's aiohttp session, answering every /run with the same result"""
+    def __init__(self):
+        self.params = []
+
+    def get(self, url, params=None, **kwargs):
+        self.params.append(params)
+        return _Response(_result())
+
+
+class TestCoordinatorCaching(unittest.IsolatedAsyncioTestCase):
+    async def test_deterministic_is_passed_on(self):
+        coordinator = Coordinator()
+        coordinator._nodes = {"http://node": Node("http://node")}
+        coordinator._ring.add("http://node")
+        coordinator._session = _Session()
+
+        cache = ResultCache()
+        cache.configure(["chess"], ttl_seconds=60, max_entries=2)
+        for _ in range(2):
+            await cache.run(functools.partial(coordinator.run, deterministic=True), Gamemode.get("chess"), ["a", "b"], {"seed": 1}, 10, deterministic=True)
+
+        self.assertEqual(len(coordinator._session.params), 1)
+        self.assertEqual(coordinator._session.params[0]["deterministic"], "true")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+
+from runner.sandbox import _iter_provisioning_archive, InvalidSubmissionError, _LOCKED_DOWN_MODE
+
+
+def _submission(members) -> str:
+    """Writes a submission archive holding the given (TarInfo, data) pairs, returning its path"""
+    handle, path = tempfile.mkstemp(suffix=".tar")
+    os.close(handle)
+    with tarfile.open(path, mode="w", format=tarfile.PAX_FORMAT) as tar:
+        for info, data in members:
+            if data is not None:
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+            else:
+                tar.addfile(info)
+    return path
+
+
+def _provision(path: str) -> list:
+    archive = b"".join(_iter_provisioning_archive(path, False, 1024 * 1024))
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        return tar.getmembers()
+
+
+class TestProvisioningArchive(unittest.TestCase):
+    def setUp(self):
+        self.paths = []
+
+    def tearDown(self):
+        for path in self.paths:
+            os.remove(path)
+
+    def provision(self, members) -> list:
+        path = _submission(members)
+        self.paths.append(path)
+        return _provision(path)
+
+    def assertRejected(self, members):
+        path = _submission(members)
+        self.paths.append(path)
+        with self.assertRaises(InvalidSubmissionError):
+            _provision(path)
+
+    def test_members_are_locked_down(self):
+        info = tarfile.TarInfo("ai.py")
+        info.uid = 1000
+        info.mode = 0o777
+        members = {member.name: member for member in self.provision([(info, b"x = 1\n")])}
+
+        for member in members.values():
+            self.assertEqual(member.uid, 0)
+            self.assertEqual(member.gid, 0)
+            self.assertEqual(member.mode, _LOCKED_DOWN_MODE)
+        self.assertIn("submission/ai.py", members)
+
+    def test_home_directory_is_locked_down(self):
+        members = self.provision([(tarfile.TarInfo("ai.py"), b"")])
+        self.assertEqual(members[0].name, ".")
+        self.assertTrue(members[0].isdir())
+        self.assertEqual(members[0].mode, _LOCKED_DOWN_MODE)
+
+    def test_pax_headers_cannot_override_lock_down(self):
+        long_name = "a" * 150 + "/ai.py"
+        info = tarfile.TarInfo(long_name)
+        info.pax_headers = {"uid": "1000", "gid": "1000", "uname": "sandbox", "gname": "sandbox"}
+        members = self.provision([(info, b"x = 1\n")])
+
+        member = next(member for member in members if member.name.endswith("ai.py"))
+        self.assertEqual(member.name, "submission/" + long_name)
+        self.assertEqual(member.uid, 0)
+        self.assertEqual(member.gid, 0)
+        self.assertEqual(member.uname, "root")
+
+    def test_traversal_is_rejected(self):
+        self.assertRejected([(tarfile.TarInfo("../ai.py"), b"")])
+        self.assertRejected([(tarfile.TarInfo("a/../../ai.py"), b"")])
+        self.assertRejected([(tarfile.TarInfo("/etc/ai.py"), b"")])
+
+    def test_hard_link_outside_is_rejected(self):
+        info = tarfile.TarInfo("ai.py")
+        info.type = tarfile.LNKTYPE
+        info.linkname = "../sandbox/play.py"
+        self.assertRejected([(info, None)])
+
+    def test_symlinks_outside_are_rejected(self):
+        for target in ["/etc/passwd", "../sandbox/play.py", "a/../../shared"]:
+            info = tarfile.TarInfo("ai.py")
+            info.type = tarfile.SYMTYPE
+            info.linkname = target
+            self.assertRejected([(info, None)])
+
+    def test_symlinks_inside_are_kept(self):
+        info = tarfile.TarInfo("lib/ai.py")
+        info.type = tarfile.SYMTYPE
+        info.linkname = "../ai.py"
+        members = {member.name: member for member in self.provision([(tarfile.TarInfo("ai.py"), b""),
+                                                                     (info, None)])}
+        self.assertEqual(members["submission/lib/ai.py"].linkname, "../ai.py")
+
+    def test_devices_are_rejected(self):
+        info = tarfile.TarInfo("disk")
+        info.type = tarfile.BLKTYPE
+        self.assertRejected([(info, None)])
+
+    def test_size_limit(self):
+        path = _submission([(tarfile.TarInfo("ai.py"), b"x" * 2048)])
+        self.paths.append(path)
+        with self.assertRaises(InvalidSubmissionError):
+            b"".join(_iter_provisioning_archive(path, False, 1024))
+
+
+if __name__ == "__main__":
+    unittest.main()
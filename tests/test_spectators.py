@@ -0,0 +1,94 @@
+import asyncio
+import json
+import unittest
+
+from runner.spectators import SpectatorHub
+
+
+async def _read_all(frames) -> list:
+    return [json.loads(frame) async for frame in frames]
+
+
+class TestSpectatorHub(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.hub = SpectatorHub(buffer_size=4, max_coalesces=2)
+        self.game_id = self.hub.open_game("chess", ["a", "b"])
+        self.hub.publish(self.game_id, {"type": "start", "initial_board": "board", "players": ["white", "black"]})
+
+    def move(self, move: str):
+        self.hub.publish(self.game_id, {"type": "move", "player": 0, "move": move})
+
+    async def test_late_subscriber_starts_from_a_snapshot(self):
+        self.move("e2e4")
+        self.move("e7e5")
+        frames = self.hub.subscribe(self.game_id)
+        self.move("g1f3")
+        self.hub.close_game(self.game_id, {"type": "result", "submission_results": []})
+
+        events = await _read_all(frames)
+        self.assertEqual(events[0]["type"], "snapshot")
+        self.assertEqual(events[0]["initial_board"], "board")
+        self.assertEqual(events[0]["moves"], ["e2e4", "e7e5"])
+        self.assertEqual([event["type"] for event in events[1:]], ["move", "result"])
+        self.assertEqual(events[1]["move"], "g1f3")
+
+    async def test_slow_subscriber_is_coalesced_into_a_snapshot(self):
+        frames = self.hub.subscribe(self.game_id)
+        for move in ["a", "b", "c", "d", "e"]:
+            self.move(move)
+        self.hub.close_game(self.game_id)
+
+        events = await _read_all(frames)
+        self.assertEqual([event["type"] for event in events], ["snapshot", "move"])
+        # The move that filled the buffer is in the snapshot, rather than being sent again after it
+        self.assertEqual(events[0]["moves"], ["a", "b", "c", "d"])
+        self.assertEqual(events[1]["move"], "e")
+
+    async def test_subscriber_that_keeps_falling_behind_is_dropped(self):
+        frames = self.hub.subscribe(self.game_id)
+        for i in range(4 * 4):
+            self.move(str(i))
+        self.assertEqual(self.hub.games()[0]["spectators"], 0)
+
+        events = await _read_all(frames)
+        self.assertEqual([event["type"] for event in events], ["dropped"])
+
+    async def test_catching_up_resets_the_coalescing_limit(self):
+        received = []
+
+        async def spectate(frames):
+            async for frame in frames:
+                received.append(json.loads(frame))
+
+        spectator = asyncio.ensure_future(spectate(self.hub.subscribe(self.game_id)))
+        await asyncio.sleep(0)
+        played = []
+        for i in range(4):
+            for move in range(5):
+                played.append(f"{i}{move}")
+                self.move(played[-1])
+            await asyncio.sleep(0)
+        self.assertEqual(self.hub.games()[0]["spectators"], 1)
+        self.hub.close_game(self.game_id)
+        await spectator
+
+        # Replaying the snapshots and moves gives every move once, in order
+        seen = []
+        for event in received:
+            if event["type"] == "snapshot":
+                seen = list(event["moves"])
+            else:
+                seen.append(event["move"])
+        self.assertEqual(seen, played)
+        self.assertEqual(sum(event["type"] == "snapshot" for event in received), 5)
+
+    async def test_closed_game_cannot_be_subscribed_to(self):
+        self.hub.close_game(self.game_id)
+        self.assertIsNone(self.hub.subscribe(self.game_id))
+        self.assertEqual(self.hub.games(), [])
+        # Publishing to a game that has gone is ignored
+        self.move("e2e4")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+
+from runner.streams import FramedSplitter, LineSplitter
+from shared.framing import Framing, FramingError, FRAME_HEADER, FRAME_MARKER, encode_frame
+
+
+def _binary(max_line_length: int = 1024, max_frame_size: int = 1024) -> FramedSplitter:
+    splitter = FramedSplitter(max_line_length=max_line_length, max_frame_size=max_frame_size)
+    splitter.set_framing(Framing.BINARY)
+    return splitter
+
+
+class TestLineSplitter(unittest.TestCase):
+    def test_long_lines_are_broken_up(self):
+        splitter = LineSplitter(max_line_length=4)
+        self.assertEqual(splitter.feed(b"abcdefghij"), ["abcd", "efgh"])
+        self.assertEqual(splitter.flush(), ["ij"])
+
+    def test_characters_split_across_chunks_survive(self):
+        splitter = LineSplitter()
+        data = "é\n".encode()
+        self.assertEqual(splitter.feed(data[:1]), [])
+        self.assertEqual(splitter.feed(data[1:]), ["é"])
+
+
+class TestFramedSplitter(unittest.TestCase):
+    def test_json_lines_until_switched(self):
+        splitter = FramedSplitter()
+        self.assertEqual(splitter.feed(b'{"a": 1}\nhello\n'), ['{"a": 1}', "hello"])
+
+    def test_frames_between_prints(self):
+        splitter = _binary()
+        data = b"before\n" + encode_frame(b"one") + b"between" + encode_frame(b"two") + b"after\n"
+        self.assertEqual(splitter.feed(data), ["before", b"one", "between", b"two", "after"])
+
+    def test_frame_split_across_chunks(self):
+        splitter = _binary()
+        frame = encode_frame(b"payload")
+        items = []
+        for i in range(len(frame)):
+            items += splitter.feed(frame[i:i + 1])
+        self.assertEqual(items, [b"payload"])
+
+    def test_text_before_switch_is_kept(self):
+        splitter = FramedSplitter()
+        self.assertEqual(splitter.feed(b"partial"), [])
+        splitter.set_framing(Framing.BINARY)
+        self.assertEqual(splitter.feed(b" line\n" + encode_frame(b"x")), ["partial line", b"x"])
+
+    def test_frame_at_limit_is_accepted(self):
+        splitter = _binary(max_frame_size=8)
+        self.assertEqual(splitter.feed(encode_frame(b"x" * 8)), [b"x" * 8])
+
+    def test_frame_over_limit_is_rejected_from_its_header(self):
+        splitter = _binary(max_frame_size=8)
+        with self.assertRaises(FramingError):
+            splitter.feed(FRAME_HEADER.pack(FRAME_MARKER, 9))
+
+    def test_prints_between_frames_are_broken_up(self):
+        splitter = _binary(max_line_length=4)
+        self.assertEqual(splitter.feed(b"abcdefghij\n" + encode_frame(b"x")), ["abcd", "efgh", "ij", b"x"])
+
+    def test_unfinished_frame_is_flushed_as_a_print(self):
+        splitter = _binary()
+        self.assertEqual(splitter.feed(encode_frame(b"payload")[:-2]), [])
+        flushed = splitter.flush()
+        self.assertEqual(len(flushed), 1)
+        self.assertIsInstance(flushed[0], str)
+
+
+if __name__ == "__main__":
+    unittest.main()
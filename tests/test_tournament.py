@@ -0,0 +1,52 @@
+import unittest
+
+from cuwais.gamemodes import Gamemode
+
+from runner.tournament import round_robin, swiss_round, run_batch, InvalidPairingsError
+
+
+class TestRoundRobin(unittest.TestCase):
+    def test_every_pair_plays_once(self):
+        self.assertEqual(round_robin(["a", "b", "c"], 2), [["a", "b"], ["a", "c"], ["b", "c"]])
+
+    def test_double_plays_every_seating(self):
+        pairings = round_robin(["a", "b", "c"], 2, double=True)
+        self.assertEqual(len(pairings), 6)
+        self.assertIn(["b", "a"], pairings)
+        self.assertIn(["a", "b"], pairings)
+
+    def test_too_few_submissions(self):
+        self.assertEqual(round_robin(["a"], 2), [])
+
+
+class TestSwissRound(unittest.TestCase):
+    def test_similar_scores_are_paired(self):
+        pairings, bye = swiss_round(["a", "b", "c", "d"], {"a": 0, "b": 2, "c": 1, "d": 2})
+        self.assertEqual(pairings, [["b", "d"], ["c", "a"]])
+        self.assertIsNone(bye)
+
+    def test_lowest_ranked_gets_the_bye(self):
+        pairings, bye = swiss_round(["a", "b", "c"], {"a": 2, "b": 1, "c": 0})
+        self.assertEqual(pairings, [["a", "b"]])
+        self.assertEqual(bye, "c")
+
+    def test_rematches_are_avoided(self):
+        pairings, _ = swiss_round(["a", "b", "c", "d"], {"a": 3, "b": 2, "c": 1, "d": 0}, [["a", "b"]])
+        self.assertEqual(pairings, [["a", "c"], ["b", "d"]])
+
+    def test_rematch_when_there_is_no_one_else(self):
+        pairings, _ = swiss_round(["a", "b"], {}, [["b", "a"]])
+        self.assertEqual(pairings, [["a", "b"]])
+
+
+class TestRunBatch(unittest.IsolatedAsyncioTestCase):
+    async def test_pairings_must_fit_the_gamemode(self):
+        async def run_game(*args, **kwargs):
+            raise AssertionError("No game should be run")
+
+        with self.assertRaises(InvalidPairingsError):
+            await run_batch(Gamemode.get("chess"), [["a", "b"], ["a", "b", "c"]], {}, 10, 1, run_game=run_game)
+
+
+if __name__ == "__main__":
+    unittest.main()
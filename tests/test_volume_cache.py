@@ -0,0 +1,97 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from runner import volume_cache
+from runner.volume_cache import SubmissionVolumes, SUBMISSION_VOLUME_LABEL, SUBMISSION_VOLUME_OWNER_LABEL, \
+    SUBMISSION_VOLUME_DIGEST_LABEL
+
+
+class _Volumes:
+    """Stands in for the volumes part of an aiodocker client"""
+    def __init__(self, volumes=()):
+        self.volumes = {volume["Name"]: volume for volume in volumes}
+        self.deleted = []
+
+    async def list(self):
+        return {"Volumes": list(self.volumes.values())}
+
+    async def create(self, config):
+        self.volumes[config["Name"]] = config
+
+
+class _Docker:
+    def __init__(self, volumes=()):
+        self.volumes = _Volumes(volumes)
+
+
+class _DockerVolume:
+    def __init__(self, docker, name):
+        self.docker = docker
+        self.name = name
+
+    async def delete(self):
+        self.docker.volumes.deleted.append(self.name)
+        del self.docker.volumes.volumes[self.name]
+
+
+def _volume(name: str, submission_hash: str, owner: str, digest: str) -> dict:
+    return {"Name": name, "Labels": {SUBMISSION_VOLUME_LABEL: submission_hash, SUBMISSION_VOLUME_OWNER_LABEL: owner,
+                                     SUBMISSION_VOLUME_DIGEST_LABEL: digest}}
+
+
+class TestSubmissionVolumes(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        patcher = mock.patch.object(volume_cache, "DockerVolume", _DockerVolume)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.populated = []
+        self.finish = asyncio.Event()
+        self.finish.set()
+        self.volumes = SubmissionVolumes(self.populate)
+
+    async def asyncTearDown(self):
+        await self.volumes.stop()
+
+    async def populate(self, docker, submission_hash, name):
+        self.populated.append(name)
+        await self.finish.wait()
+
+    async def test_stale_volumes_are_deleted(self):
+        docker = _Docker([_volume("old", "abc", "a", "old"), _volume("current", "def", "a", "new"),
+                          _volume("theirs", "abc", "b", "old")])
+        await self.volumes.start(docker, gc_grace_seconds=60, owner="a", digest="new")
+
+        self.assertEqual(docker.volumes.deleted, ["old"])
+        self.assertEqual(await self.volumes.acquire("def"), "current")
+        self.assertEqual(await self.volumes.acquire("abc"), "aiwarssoc-submission-a-abc-new")
+        self.assertEqual(self.populated, ["aiwarssoc-submission-a-abc-new"])
+
+    async def test_cancelling_the_first_request_does_not_cancel_populating(self):
+        await self.volumes.start(_Docker(), gc_grace_seconds=60, owner="a", digest="new")
+        self.finish.clear()
+        first = asyncio.ensure_future(self.volumes.acquire("abc"))
+        second = asyncio.ensure_future(self.volumes.acquire("abc"))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+
+        self.finish.set()
+        self.assertEqual(await second, "aiwarssoc-submission-a-abc-new")
+        self.assertEqual(len(self.populated), 1)
+
+    async def test_only_unused_volumes_are_collected(self):
+        docker = _Docker()
+        await self.volumes.start(docker, gc_grace_seconds=0, owner="a", digest="new")
+        await self.volumes.acquire("abc")
+        await self.volumes.acquire("def")
+        self.volumes.release("abc")
+
+        await self.volumes.collect()
+        self.assertEqual(docker.volumes.deleted, ["aiwarssoc-submission-a-abc-new"])
+        self.assertEqual(self.volumes.stats(), {"volumes": 1, "in_use": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
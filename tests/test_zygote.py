@@ -0,0 +1,96 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from shared.message_connection import MessagePrintConnection, MessageType
+
+_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_SUBMISSION = """
+import os
+
+
+def parent():
+    return os.getppid()
+"""
+
+
+def _instructions() -> str:
+    """The lines the runner would send: a ping, a call, then a call to a function the submission does not have"""
+    lines = []
+
+    async def send():
+        connection = MessagePrintConnection(out_handler=lines.append)
+        await connection.send_ping()
+        await connection.send_call("parent", [], {})
+        await connection.send_call("missing", [], {})
+
+    asyncio.run(send())
+    return "\n".join(lines) + "\n"
+
+
+def _results(out: str) -> list:
+    messages = [MessagePrintConnection._message_from_string(line) for line in out.splitlines() if line.strip()]
+    return [message.data for message in messages if message.message_type == MessageType.RESULT]
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "the zygote passes file descriptors over a unix socket")
+class TestZygote(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        os.mkdir(os.path.join(self.directory, "submission"))
+        with open(os.path.join(self.directory, "submission", "__init__.py"), "w"):
+            pass
+        self.socket_path = os.path.join(self.directory, "zygote.sock")
+        self.env = dict(os.environ, PYTHONPATH=_REPO)
+
+    def zygote(self, *args) -> subprocess.Popen:
+        return subprocess.Popen([sys.executable, "-m", "sandbox.zygote", *args], cwd=self.directory, env=self.env,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+    def write_submission(self):
+        # Written once the zygote is up, as the submission is copied in after the container starts
+        with open(os.path.join(self.directory, "submission", "ai.py"), "w") as f:
+            f.write(_SUBMISSION)
+
+    def test_forked_game_plays_on_the_client_streams(self):
+        server = self.zygote("serve", self.socket_path)
+        self.addCleanup(server.communicate)
+        self.addCleanup(server.kill)
+        deadline = time.monotonic() + 10
+        while not os.path.exists(self.socket_path):
+            self.assertLess(time.monotonic(), deadline, "the zygote never started listening")
+            self.assertIsNone(server.poll(), server.stderr.read() if server.poll() is not None else "")
+            time.sleep(0.01)
+        self.write_submission()
+
+        client = self.zygote(self.socket_path)
+        out, err = client.communicate(_instructions(), timeout=10)
+        self.assertEqual(server.wait(timeout=10), 0)
+
+        # A missing function ends the game cleanly, and the zygote hands back that exit code
+        self.assertEqual(client.returncode, 0, err)
+        results = _results(out)
+        self.assertEqual(results[0], "pong")
+        # The game ran in a child forked by the zygote, not in the client
+        self.assertEqual(results[1], server.pid)
+        self.assertEqual(len(results), 3)
+
+    def test_plays_in_process_without_a_zygote(self):
+        self.write_submission()
+        client = self.zygote(self.socket_path)
+        out, err = client.communicate(_instructions(), timeout=10)
+
+        self.assertEqual(client.returncode, 0, err)
+        results = _results(out)
+        self.assertEqual(results[1], os.getpid())
+
+
+if __name__ == "__main__":
+    unittest.main()